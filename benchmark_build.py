@@ -0,0 +1,112 @@
+# python3 benchmark_build.py
+# End-to-end benchmark of create_db.py against the local stand-in of the API (mock_api.py), so fetch and load changes
+# can be compared reproducibly offline. The mock API is served from this process and each scenario (a set of injected
+# faults, see SCENARIOS) runs full builds of the configured database (replacing its tables, trainer data included)
+# without the response cache, so every page is requested (the output of create_db.py is hidden, errors excepted).
+# The median of the repeats is printed for each scenario: pages and HTTP requests (retries included) per second,
+# request latency, retries and failures, the wall time of the build and of each pipeline stage (from the --metrics
+# output) and the peak memory (max RSS) of the create_db.py process.
+# Use --recorded to serve the pages of a response cache directory instead of synthetic pages, and --json to write
+# every run as JSON.
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from mock_api import MockAPI, RecordedPages, SyntheticPages, SIZES
+
+
+# Injected faults of each scenario (MockAPI arguments). Only species and evolution chain pages go missing: the moves and
+# abilities listed in a Pokemon page must exist (the link tables have foreign keys to them).
+SCENARIOS = {
+    'clean': {},
+    'latency': {'latency': 0.02, 'jitter': 0.03},
+    'faults': {'latency': 0.01, 'jitter': 0.02, 'missing': 0.02, 'missing_in': ['pokemon-species', 'evolution-chain'],
+               'throttle': 0.01, 'errors': 0.02, 'retry_after': 0.1},
+    'rate-limited': {'max_rate': 200, 'retry_after': 0.1},
+    'no-lists': {'unlisted': ['pokemon-species', 'evolution-chain']},
+}
+
+parser = argparse.ArgumentParser(description="Benchmark full builds of create_db.py against the mock API.")
+parser.add_argument('--scenario', choices=list(SCENARIOS), action='append',
+                    help="scenario to run (repeat the option for several, every scenario by default)")
+parser.add_argument('--repeat', type=int, default=3, help="number of builds per scenario")
+parser.add_argument('--pokemon', type=int, default=SIZES['pokemon'], help="number of synthetic Pokemon")
+parser.add_argument('--recorded', metavar='CACHE_DIR', help="serve the pages of a response cache directory instead of "
+                                                            "synthetic pages")
+parser.add_argument('--host-rate', type=float, default=10000, help="max requests per second of create_db.py")
+parser.add_argument('--transform', choices=['sql', 'python'], default='sql', help="transform engine of the builds")
+parser.add_argument('--seed', type=int, default=1, help="seed of the synthetic pages and injected faults")
+parser.add_argument('--json', metavar='PATH', help="write the results of every run to PATH")
+args = parser.parse_args()
+
+
+def build(api):
+    """Run a full build against the mock API. -> dictionary of the run's results."""
+    served = api.stats()['requests']
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'metrics.json')
+        proc = subprocess.Popen([sys.executable, 'create_db.py', '--no-cache', '--quiet', '--api-url', api.url,
+                                 '--host-rate', str(args.host_rate), '--transform', args.transform,
+                                 '--metrics', path], stdout=subprocess.DEVNULL)
+        _, status, usage = os.wait4(proc.pid, 0)
+        proc.returncode = os.waitstatus_to_exitcode(status)
+        if not os.path.exists(path):
+            raise RuntimeError("create_db.py exited with status " + str(proc.returncode) + " before the build ran.")
+        with open(path) as f:
+            metrics = json.load(f)
+    # ru_maxrss is in kilobytes on Linux.
+    result = {'ok': proc.returncode == 0, 'peak_mb': usage.ru_maxrss / 1024, 'served': api.stats()['requests'] - served}
+    counters = {}
+    for c in metrics['counters']:
+        key = c['name'] + ('_' + c['labels']['result'] if c['name'] == 'fetch_requests_total' else '')
+        counters[key] = counters.get(key, 0) + c['value']
+    latency = [h for h in metrics['histograms'] if h['name'] == 'fetch_request_seconds']
+    build_seconds = [g['value'] for g in metrics['gauges'] if g['name'] == 'build_seconds'][0]
+    result.update({'build': build_seconds, 'pages': counters.get('fetch_requests_total_ok', 0),
+                   'requests': sum(h['count'] for h in latency), 'retries': counters.get('fetch_retries_total', 0),
+                   'failed': counters.get('fetch_errors_total', 0), 'mb': counters.get('fetch_bytes_total', 0) / 1e6,
+                   'p50': max((h['p50'] for h in latency), default=None),
+                   'p99': max((h['p99'] for h in latency), default=None),
+                   'stages': {g['labels']['stage']: g['value'] for g in metrics['gauges']
+                              if g['name'] == 'pipeline_stage_seconds'}})
+    result['pages_per_second'] = result['pages'] / build_seconds
+    result['requests_per_second'] = result['requests'] / build_seconds
+    return result
+
+
+def median(runs, key):
+    """Median of a result over the runs. -> float."""
+    return statistics.median(run[key] for run in runs)
+
+
+if __name__ == "__main__":
+    if args.recorded:
+        fixtures = RecordedPages(args.recorded)
+    else:
+        fixtures = SyntheticPages(args.pokemon, seed=args.seed)
+    fixtures.warm()
+    results = {}
+    for scenario in args.scenario or list(SCENARIOS):
+        api = MockAPI(fixtures, seed=args.seed, **SCENARIOS[scenario]).start()
+        try:
+            runs = [build(api) for _ in range(args.repeat)]
+        finally:
+            api.stop()
+        results[scenario] = runs
+        stages = {name: statistics.median(run['stages'][name] for run in runs) for name in runs[0]['stages']}
+        print(scenario + ":", sum(run['ok'] for run in runs), "of", len(runs), "builds finished, median",
+              round(median(runs, 'build'), 2), "seconds,", round(median(runs, 'peak_mb')), "MB peak memory (max RSS).")
+        print("   ", round(median(runs, 'pages')), "pages (" + str(round(median(runs, 'mb'), 1)), "MB) at",
+              round(median(runs, 'pages_per_second')), "pages/s,", round(median(runs, 'requests')), "requests at",
+              round(median(runs, 'requests_per_second')), "requests/s (p50", median(runs, 'p50'), "s, p99",
+              median(runs, 'p99'), "s),", round(median(runs, 'retries')), "retries,", round(median(runs, 'failed')),
+              "failed.")
+        print("    stages (s):", ', '.join(name + ' ' + str(round(seconds, 2))
+                                        for name, seconds in sorted(stages.items(), key=lambda x: -x[1])))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=1)
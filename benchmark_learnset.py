@@ -0,0 +1,78 @@
+# python3 benchmark_learnset.py
+# Compares the learnset index (learnset.py) with the SQL query it replaces on the current database: "which Pokemon can
+# learn every move in a set and have an ability". Each query takes the moves and one ability of a random Pokemon (so
+# there is at least one match), is answered by both (GROUP BY ... HAVING on pokemon_moves intersected with
+# pokemon_abilities, and the AND of the bitsets), and the results are checked to be the same. The median and 99th
+# percentile latency of each are printed in microseconds.
+import argparse
+import random
+import statistics
+import time
+import psycopg2
+import hidden
+from learnset import LearnsetIndex
+from trainer import PGSQLConnection
+
+
+# Pokemon that can learn every move in the list and have the ability.
+SQL = r"""
+SELECT poke_id FROM pokemon_moves WHERE move_id = ANY(%(moves)s) GROUP BY poke_id HAVING count(*) = %(n)s
+INTERSECT
+SELECT poke_id FROM pokemon_abilities WHERE ability_id = %(ability)s
+ORDER BY poke_id;
+"""
+
+parser = argparse.ArgumentParser(description="Benchmark the learnset index against the SQL query.")
+parser.add_argument('--queries', type=int, default=500, help="number of random queries")
+parser.add_argument('--moves', type=int, default=3, help="number of moves per query")
+parser.add_argument('--seed', type=int, default=1, help="seed of the random queries")
+args = parser.parse_args()
+
+secrets = hidden.secrets()
+conn = psycopg2.connect(host=secrets['host'], port=secrets['port'], database=secrets['database'],
+                        user=secrets['user'], password=secrets['pass'], connect_timeout=3)
+pgsql_conn = PGSQLConnection(host=secrets['host'], port=secrets['port'], database=secrets['database'],
+                             user=secrets['user'], password=secrets['pass'])
+
+
+def percentile(values, q):
+    """Value at quantile q of a list. -> float."""
+    return sorted(values)[min(len(values) - 1, int(q * len(values)))]
+
+
+try:
+    with conn.cursor() as cur:
+        cur.execute("SELECT poke_id, array_agg(move_id) FROM pokemon_moves GROUP BY poke_id;")
+        learnsets = dict(cur.fetchall())
+        cur.execute("SELECT poke_id, array_agg(ability_id) FROM pokemon_abilities GROUP BY poke_id;")
+        ability_sets = dict(cur.fetchall())
+        random.seed(args.seed)
+        candidates = sorted(set(learnsets) & set(ability_sets))
+        queries = []
+        for _ in range(args.queries):
+            poke_id = random.choice(candidates)
+            moves = random.sample(learnsets[poke_id], min(args.moves, len(learnsets[poke_id])))
+            queries.append((moves, random.choice(ability_sets[poke_id])))
+
+        index = LearnsetIndex(pgsql_conn, check_every=3600)
+        index.index()
+        sql_times, index_times, mismatches = [], [], 0
+        for moves, ability in queries:
+            start = time.perf_counter()
+            cur.execute(SQL, {'moves': moves, 'n': len(moves), 'ability': ability})
+            sql_result = [x[0] for x in cur.fetchall()]
+            sql_times.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            index_result = index.find(moves=moves, abilities=[ability])
+            index_times.append(time.perf_counter() - start)
+            mismatches += sql_result != index_result
+finally:
+    conn.close()
+
+print("Index of", index.stats()['pokemon'], "Pokemon built in", round(index.build_seconds * 1000, 1), "ms.")
+print(len(queries), "queries of", args.moves, "moves and 1 ability (microseconds):")
+print("{:<8}{:>12}{:>12}".format('', 'median', 'p99'))
+for name, times in (('sql', sql_times), ('index', index_times)):
+    print("{:<8}{:>12.1f}{:>12.1f}".format(name, statistics.median(times) * 1e6, percentile(times, 0.99) * 1e6))
+print("Speedup (median):", round(statistics.median(sql_times) / statistics.median(index_times), 1), "x")
+print("Same results for every query." if not mismatches else str(mismatches) + " QUERIES DIFFER!")
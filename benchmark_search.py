@@ -0,0 +1,69 @@
+# python3 benchmark_search.py
+# Latency benchmarks of the full text search API (search.py) on the current database. Random prefixes of the words in
+# the stored search vectors are searched over every table with highlighting, without highlighting, and with an ad hoc
+# statement that computes each row's tsvector at query time (what a query that does not use the stored columns costs).
+# The median and 99th percentile latency of each are printed in microseconds.
+import argparse
+import random
+import statistics
+import time
+import psycopg2
+import hidden
+from search import SEARCH_TABLES, TextSearch, prefix_query
+from trainer import PGSQLConnection
+
+
+# Same search computing the tsvector of every row at query time (no stored column or index).
+ADHOC_SQL = ' UNION ALL '.join(
+    "SELECT '" + table + "' as source, id, ts_rank(v, q) as rank FROM (SELECT id, setweight(to_tsvector('english', "
+    "coalesce(name, '')), 'A') || setweight(to_tsvector('english', coalesce(info, '')), 'B') as v FROM " + table +
+    ") AS t, to_tsquery('english', %(query)s) AS q WHERE v @@ q" for table in SEARCH_TABLES) + \
+    " ORDER BY rank DESC, source, id LIMIT %(limit)s;"
+
+parser = argparse.ArgumentParser(description="Benchmark the full text search API.")
+parser.add_argument('--queries', type=int, default=200, help="number of random queries")
+parser.add_argument('--limit', type=int, default=10, help="rows per page")
+parser.add_argument('--seed', type=int, default=1, help="seed of the random queries")
+args = parser.parse_args()
+
+secrets = hidden.secrets()
+pgsql_conn = PGSQLConnection(host=secrets['host'], port=secrets['port'], database=secrets['database'],
+                             user=secrets['user'], password=secrets['pass'])
+conn = psycopg2.connect(host=secrets['host'], port=secrets['port'], database=secrets['database'],
+                        user=secrets['user'], password=secrets['pass'], connect_timeout=3)
+
+
+def percentile(values, q):
+    """Value at quantile q of a list. -> float."""
+    return sorted(values)[min(len(values) - 1, int(q * len(values)))]
+
+
+try:
+    with conn.cursor() as cur:
+        cur.execute(' UNION '.join("SELECT word FROM ts_stat('SELECT search FROM " + table + "')"
+                                   for table in SEARCH_TABLES) + ";")
+        words = sorted(x[0] for x in cur.fetchall() if x[0].isalpha() and len(x[0]) > 3)
+        random.seed(args.seed)
+        queries = [random.choice(words)[:random.randint(3, 6)] for _ in range(args.queries)]
+        # Keep one connection open for the API calls so only the statements are timed.
+        with pgsql_conn:
+            search = TextSearch(pgsql_conn)
+            times = {'api (highlight)': [], 'api (no highlight)': [], 'ad hoc tsvector': []}
+            for query in queries:
+                start = time.perf_counter()
+                search.search(query, limit=args.limit)
+                times['api (highlight)'].append(time.perf_counter() - start)
+                start = time.perf_counter()
+                search.search(query, limit=args.limit, highlight=False)
+                times['api (no highlight)'].append(time.perf_counter() - start)
+                start = time.perf_counter()
+                cur.execute(ADHOC_SQL, {'query': prefix_query(query), 'limit': args.limit})
+                cur.fetchall()
+                times['ad hoc tsvector'].append(time.perf_counter() - start)
+finally:
+    conn.close()
+
+print(len(queries), "prefix searches over", ', '.join(SEARCH_TABLES), "(microseconds):")
+print("{:<20}{:>12}{:>12}".format('', 'median', 'p99'))
+for name, values in times.items():
+    print("{:<20}{:>12.1f}{:>12.1f}".format(name, statistics.median(values) * 1e6, percentile(values, 0.99) * 1e6))
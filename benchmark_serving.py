@@ -0,0 +1,110 @@
+# python3 benchmark_serving.py
+# Latency benchmarks of the serving views (pokemon_docs and trainer_teams, see SERVING_SQL in create_db.py) on the
+# current database. Benchmark trainers get random teams (with moves their Pokemon can learn), then random Pokemon and
+# teams are read with TrainerPack.get_pokemon and get_team (one index lookup in a view) and with the query of each view
+# filtered to the same row (joining pokedex, pokemon_abilities, abilities, pokemon_moves, moves and types, or the
+# trainer tables, on every read). The median and 99th percentile latency of each are printed in microseconds, along with
+# the time of a concurrent refresh of each view. Both reads are checked to return the same rows, and the benchmark
+# trainers are deleted at the end.
+import argparse
+import random
+import statistics
+import time
+import psycopg2
+import hidden
+from trainer import PGSQLPool, SERVING_VIEWS, TrainerPack, select_row
+
+
+# Prefix of the names of the benchmark trainers (they are deleted at the end).
+PREFIX = 'serving-benchmark-'
+
+parser = argparse.ArgumentParser(description="Benchmark reads of the serving views against the joins they replace.")
+parser.add_argument('--reads', type=int, default=500, help="number of random reads of each kind")
+parser.add_argument('--trainers', type=int, default=200, help="number of benchmark trainers")
+parser.add_argument('--seed', type=int, default=1, help="seed of the random teams and reads")
+args = parser.parse_args()
+
+secrets = hidden.secrets()
+pgsql_conn = PGSQLPool(host=secrets['host'], port=secrets['port'], database=secrets['database'], user=secrets['user'],
+                       password=secrets['pass'], minconn=1, maxconn=1)
+conn = psycopg2.connect(host=secrets['host'], port=secrets['port'], database=secrets['database'],
+                        user=secrets['user'], password=secrets['pass'], connect_timeout=3)
+
+
+def percentile(values, q):
+    """Value at quantile q of a list. -> float."""
+    return sorted(values)[min(len(values) - 1, int(q * len(values)))]
+
+
+def timed(func, keys):
+    """Call func for every key. -> (list of seconds per call, list of results)."""
+    times, results = [], []
+    for key in keys:
+        start = time.perf_counter()
+        results.append(func(key))
+        times.append(time.perf_counter() - start)
+    return times, results
+
+
+if __name__ == "__main__":
+    random.seed(args.seed)
+    tp = TrainerPack(pgsql_conn)
+    names = [PREFIX + str(n) for n in range(args.trainers)]
+    tp.create_trainers(names, max_pokemon=6, max_moves=4)
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT poke_id, array_agg(move_id) FROM pokemon_moves GROUP BY poke_id;")
+            learnsets = dict(cur.fetchall())
+            cur.execute("SELECT poke_id, array_agg(ability_id) FROM pokemon_abilities GROUP BY poke_id;")
+            abilities = dict(cur.fetchall())
+            cur.execute("SELECT id FROM pokedex ORDER BY id;")
+            poke_ids = [x[0] for x in cur.fetchall()]
+            # The query of each view filtered to one row (the filter is pushed down into the joins).
+            joins = {}
+            for view in SERVING_VIEWS:
+                cur.execute("SELECT pg_get_viewdef(%s::regclass);", (view,))
+                joins[view] = "SELECT * FROM (" + cur.fetchone()[0].rstrip(';') + ") AS v WHERE id = %s;"
+
+        teams = {name: [(poke_id, random.choice(abilities.get(poke_id, [None])))
+                        for poke_id in random.sample(poke_ids, random.randint(1, min(6, len(poke_ids))))]
+                 for name in names}
+        ids = tp.replace_teams(teams)
+        tp.replace_moves({row_id: random.sample(learnsets.get(poke_id, []), min(4, len(learnsets.get(poke_id, []))))
+                          for name in names for row_id, (poke_id, _) in zip(ids[name], teams[name])})
+        refreshed = {}
+        for view in SERVING_VIEWS:
+            start = time.perf_counter()
+            tp.refresh_views([view])
+            refreshed[view] = time.perf_counter() - start
+
+        def joined(view):
+            """Read one row with the query of a view. -> function of the row id."""
+            def read(row_id):
+                with conn.cursor() as cur:
+                    cur.execute(joins[view], (row_id,))
+                    return select_row(cur.fetchone(), cur.description)
+            return read
+
+        pokemon = [random.choice(poke_ids) for _ in range(args.reads)]
+        trainers = tp.get_trainer_ids([random.choice(names) for _ in range(args.reads)])
+        times, mismatches = {}, []
+        for label, view, read, keys in (('pokemon', 'pokemon_docs', tp.get_pokemon, pokemon),
+                                        ('team', 'trainer_teams', tp.get_team, trainers)):
+            times[label + ' (view)'], served = timed(read, keys)
+            times[label + ' (joins)'], expected = timed(joined(view), keys)
+            if served != expected:
+                mismatches.append(view)
+    finally:
+        with pgsql_conn as conn_cur:
+            conn_cur[1].execute("DELETE FROM trainers WHERE name LIKE %s;", (PREFIX + '%',))
+        tp.refresh_views(['trainer_teams'])
+        conn.close()
+        pgsql_conn.close()
+
+    print(args.reads, "random reads of", len(poke_ids), "Pokemon and", args.trainers, "teams (microseconds):")
+    print("{:<20}{:>12}{:>12}".format('', 'median', 'p99'))
+    for name, values in times.items():
+        print("{:<20}{:>12.1f}{:>12.1f}".format(name, statistics.median(values) * 1e6, percentile(values, 0.99) * 1e6))
+    print("Concurrent refresh (milliseconds):", ', '.join(view + ' ' + str(round(seconds * 1000, 1))
+                                                         for view, seconds in refreshed.items()))
+    print("Every view read matches the joins." if not mismatches else "VIEWS DIFFER: " + ', '.join(mismatches) + "!")
@@ -0,0 +1,69 @@
+# python3 benchmark_similarity.py
+# Compares the base-stat similarity index (similarity.py) with the SQL query it replaces on the current database:
+# the k Pokemon nearest to a Pokemon by weighted Euclidean distance over the stat columns (ORDER BY distance LIMIT k).
+# Random Pokemon are queried one at a time with SQL, and with the index both one at a time and as one batch. The
+# neighbors are checked to be the same and the median and 99th percentile latency are printed in microseconds.
+import argparse
+import random
+import statistics
+import time
+import psycopg2
+import hidden
+from similarity import COLUMNS, StatIndex
+from trainer import PGSQLConnection
+
+
+parser = argparse.ArgumentParser(description="Benchmark the similarity index against the SQL query.")
+parser.add_argument('--queries', type=int, default=200, help="number of random queries")
+parser.add_argument('-k', type=int, default=5, help="number of neighbors per query")
+parser.add_argument('--seed', type=int, default=1, help="seed of the random queries")
+args = parser.parse_args()
+
+secrets = hidden.secrets()
+conn = psycopg2.connect(host=secrets['host'], port=secrets['port'], database=secrets['database'],
+                        user=secrets['user'], password=secrets['pass'], connect_timeout=3)
+pgsql_conn = PGSQLConnection(host=secrets['host'], port=secrets['port'], database=secrets['database'],
+                             user=secrets['user'], password=secrets['pass'])
+start = time.perf_counter()
+index = StatIndex(pgsql_conn)
+load_seconds = time.perf_counter() - start
+
+# Same weighted distance in SQL (the weights include the normalization by the column variance).
+distance = ' + '.join("%s * power(p." + col + " - q." + col + ", 2)" for col in COLUMNS)
+SQL = ("SELECT p.id FROM pokedex AS p, pokedex AS q WHERE q.id = %s AND p.id <> q.id "
+       "ORDER BY " + distance + ", p.id LIMIT %s;")
+
+
+def percentile(values, q):
+    """Value at quantile q of a list. -> float."""
+    return sorted(values)[min(len(values) - 1, int(q * len(values)))]
+
+
+random.seed(args.seed)
+queries = [int(random.choice(index.ids)) for _ in range(args.queries)]
+weights = [float(w) for w in index.weights]
+sql_times, index_times, mismatches = [], [], 0
+try:
+    with conn.cursor() as cur:
+        for poke_id in queries:
+            start = time.perf_counter()
+            cur.execute(SQL, [poke_id] + weights + [args.k])
+            sql_result = [x[0] for x in cur.fetchall()]
+            sql_times.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            index_result = [x[0] for x in index.similar([poke_id], args.k)[0]]
+            index_times.append(time.perf_counter() - start)
+            mismatches += sql_result != index_result
+finally:
+    conn.close()
+start = time.perf_counter()
+index.similar(queries, args.k)
+batch_seconds = time.perf_counter() - start
+
+print("Index of", len(index.ids), "Pokemon opened in", round(load_seconds * 1000, 1), "ms.")
+print(len(queries), "queries of the", args.k, "nearest Pokemon (microseconds):")
+print("{:<8}{:>12}{:>12}".format('', 'median', 'p99'))
+for name, times in (('sql', sql_times), ('index', index_times)):
+    print("{:<8}{:>12.1f}{:>12.1f}".format(name, statistics.median(times) * 1e6, percentile(times, 0.99) * 1e6))
+print("Batch of", len(queries), "queries:", round(batch_seconds / len(queries) * 1e6, 1), "microseconds per query.")
+print("Same neighbors for every query." if not mismatches else str(mismatches) + " QUERIES DIFFER (ties or rounding)!")
@@ -0,0 +1,117 @@
+# python3 benchmark_snapshot.py
+# Compares loading the tables of the current database from a columnar snapshot (snapshot.py) with pulling them through
+# select queries (select_frame, as in TrainerPack.iter_select). A snapshot of the database is exported into a temporary
+# directory, then a new process (like a notebook or batch job starting up) opens it repeat times: the time to import
+# snapshot.py, to map every table (zero-copy), to import pandas and to convert every table to a dataframe is measured
+# inside the process, along with the whole process run time (Python start up included). The tables are also pulled with
+# select queries (one query per table, the link tables as rows of pairs) and the median times are printed in
+# milliseconds. The snapshot rows are checked against the database.
+import argparse
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import pandas as pd
+import hidden
+from snapshot import LINK_TABLES, SNAPSHOT_TABLES, Snapshot, export_snapshot
+from trainer import PGSQLPool, select_frame
+
+
+parser = argparse.ArgumentParser(description="Benchmark snapshot loads against select queries.")
+parser.add_argument('--repeat', type=int, default=5, help="number of loads of each kind")
+args = parser.parse_args()
+
+# Code run by each new process: import the module, open the snapshot and map every table (the link tables as CSR
+# arrays), then import pandas and convert every table to a dataframe.
+CHILD_CODE = r"""
+import sys, time
+start = time.perf_counter()
+from snapshot import Snapshot
+imported = time.perf_counter()
+snapshot = Snapshot(snapshot_dir=sys.argv[1])
+tables = [snapshot.table(name) for name in snapshot.manifest['tables']]
+links = [snapshot.links(name) for name in snapshot.manifest['links']]
+mapped = time.perf_counter()
+import pandas
+loaded = time.perf_counter()
+frames = [snapshot.frame(name) for name in snapshot.manifest['tables']]
+print(imported - start, mapped - imported, loaded - mapped, time.perf_counter() - loaded)
+"""
+
+secrets = hidden.secrets()
+pgsql_conn = PGSQLPool(host=secrets['host'], port=secrets['port'], database=secrets['database'], user=secrets['user'],
+                       password=secrets['pass'], minconn=1, maxconn=1)
+
+
+def select(sql):
+    """Pull the results of a select query with select_frame. -> pd dataframe."""
+    with pgsql_conn as conn_cur:
+        conn_cur[1].execute(sql)
+        return select_frame(conn_cur[1].fetchall(), conn_cur[1].description)
+
+
+def select_all():
+    """Pull every snapshot table with a select query. -> dictionary of table and dataframe."""
+    frames = {table: select("SELECT * FROM " + table + " ORDER BY 1;") for table in SNAPSHOT_TABLES}
+    frames.update({table: select("SELECT " + ', '.join(cols) + " FROM " + table + " ORDER BY 1, 2;")
+                   for table, cols in LINK_TABLES.items()})
+    return frames
+
+
+def rows_of(frame):
+    """Rows of a dataframe with comparable values (numbers as floats, arrays as tuples, missing values as None).
+    -> list of tuples."""
+    def value(x):
+        if isinstance(x, (list, tuple)) or hasattr(x, 'tolist') and not isinstance(x, (int, float)):
+            return tuple(x.tolist() if hasattr(x, 'tolist') else x)
+        if x is None or x is pd.NA or isinstance(x, float) and x != x:
+            return None
+        return float(x) if isinstance(x, (int, float)) else x
+    return [tuple(value(x) for x in row) for row in frame.astype(object).itertuples(index=False, name=None)]
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as snapshot_dir:
+        start = time.perf_counter()
+        export_snapshot(pgsql_conn, snapshot_dir)
+        export_seconds = time.perf_counter() - start
+
+        imported, mapped, pandas_imported, converted, process = [], [], [], [], []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            out = subprocess.run([sys.executable, '-c', CHILD_CODE, snapshot_dir], check=True, capture_output=True,
+                                 text=True).stdout.split()
+            process.append(time.perf_counter() - start)
+            imported.append(float(out[0]))
+            mapped.append(float(out[1]))
+            pandas_imported.append(float(out[2]))
+            converted.append(float(out[3]))
+
+        selected = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            frames = select_all()
+            selected.append(time.perf_counter() - start)
+
+        snapshot = Snapshot(snapshot_dir=snapshot_dir)
+        mismatches = [table for table in SNAPSHOT_TABLES
+                      if rows_of(snapshot.frame(table)) != rows_of(frames[table][snapshot.frame(table).columns])]
+        for table, (id_col, link_col) in LINK_TABLES.items():
+            ids, indptr, indices = snapshot.links(table)
+            pairs = list(zip(ids.repeat(indptr[1:] - indptr[:-1]).tolist(), indices.tolist()))
+            if pairs != list(frames[table][[id_col, link_col]].itertuples(index=False, name=None)):
+                mismatches.append(table)
+
+    rows = sum(info['rows'] for info in snapshot.manifest['tables'].values())
+    print("Snapshot of", len(snapshot.manifest['tables']), "tables (" + str(rows), "rows) exported in",
+          round(export_seconds * 1000, 1), "ms.")
+    print("Loading every table (milliseconds, median of", args.repeat, "runs):")
+    for name, times in (('snapshot, import snapshot.py', imported), ('snapshot, open and map every table', mapped),
+                        ('snapshot, import pandas', pandas_imported),
+                        ('snapshot, convert every table to pandas', converted),
+                        ('snapshot, whole new process', process), ('select queries, every table', selected)):
+        print("{:<38}{:>10.1f}".format(name, statistics.median(times) * 1000))
+    print("Every snapshot table matches the database." if not mismatches else
+          "TABLES DIFFER: " + ', '.join(mismatches) + "!")
+    pgsql_conn.close()
@@ -0,0 +1,125 @@
+# python3 benchmark_trainer.py
+# Throughput benchmark of concurrent team edits (trainer.py) on the current database. Worker processes (each with its
+# own PGSQLPool connection) replace the teams of random benchmark trainers in batches (replace_teams, then
+# replace_moves for the new team members in the same transaction). Each worker edits its own share of the trainers
+# (like users editing their own teams), or any trainer with --shared (so workers keep waiting for each other's locks).
+# Then every worker races to add Pokemon to one shared trainer until the database rejects them. Afterwards the stored
+# counts are checked against the rows and the limits of every benchmark trainer, and the benchmark trainers are deleted.
+import argparse
+import multiprocessing
+import random
+import time
+import psycopg2
+import hidden
+from trainer import PGSQLPool, TrainerPack
+
+
+# Prefix of the names of the benchmark trainers (they are deleted at the end).
+PREFIX = 'benchmark-'
+
+# Stored counts that differ from the rows or exceed the limits of their trainer.
+CHECK_SQL = r"""
+SELECT (SELECT count(*) FROM trainers AS o WHERE o.name LIKE %(prefix)s AND (o.pokemon_count > o.max_pokemon OR
+            o.pokemon_count <> (SELECT count(*) FROM trainer WHERE owner_id = o.id))),
+       (SELECT count(*) FROM trainer AS t JOIN trainers AS o ON o.id = t.owner_id WHERE o.name LIKE %(prefix)s AND
+            (t.move_count > o.max_moves OR
+             t.move_count <> (SELECT count(*) FROM trainer_moves WHERE trainer_id = t.id)));
+"""
+
+parser = argparse.ArgumentParser(description="Benchmark concurrent team edits with database enforced limits.")
+parser.add_argument('--workers', type=int, default=8, help="number of worker processes")
+parser.add_argument('--trainers', type=int, default=1000, help="number of benchmark trainers")
+parser.add_argument('--batch', type=int, default=20, help="teams replaced per call")
+parser.add_argument('--seconds', type=float, default=5, help="duration of the edit phase")
+parser.add_argument('--shared', action='store_true', help="every worker edits any trainer (not only its own share)")
+parser.add_argument('--seed', type=int, default=1, help="seed of the random teams")
+args = parser.parse_args()
+
+secrets = hidden.secrets()
+
+
+def team_pack():
+    """Open a single connection pool for a worker process. -> (PGSQLPool, TrainerPack)."""
+    pool = PGSQLPool(host=secrets['host'], port=secrets['port'], database=secrets['database'], user=secrets['user'],
+                     password=secrets['pass'], minconn=1, maxconn=1)
+    return pool, TrainerPack(pool, PREFIX + 'race')
+
+
+def edit_teams(worker, names, poke_ids, move_ids, start_at):
+    """Replace random teams (and their moves) until the end of the edit phase. -> (teams edited, rejected calls,
+    retried calls)."""
+    random.seed(args.seed + worker)
+    names = names if args.shared else names[worker::args.workers]
+    pool, tp = team_pack()
+    tp.get_trainer_ids(names)
+    edited = rejected = retried = 0
+    time.sleep(max(0.0, start_at - time.time()))
+    end = time.perf_counter() + args.seconds
+    while time.perf_counter() < end:
+        size = TrainerPack.MAX_POKEMON
+        teams = {name: [(poke_id, None) for poke_id in random.sample(poke_ids, random.randint(1, size))]
+                 for name in random.sample(names, min(args.batch, len(names)))}
+        try:
+            with tp.transaction():
+                ids = tp.replace_teams(teams)
+                if ids is None:
+                    rejected += 1
+                    continue
+                tp.replace_moves({row_id: random.sample(move_ids, random.randint(0, TrainerPack.MAX_MOVES))
+                                  for team in ids.values() for row_id in team})
+        except psycopg2.errors.DeadlockDetected:
+            retried += 1
+            continue
+        edited += len(teams)
+    pool.close()
+    return edited, rejected, retried
+
+
+def race(worker, poke_ids, start_at):
+    """Add one Pokemon at a time to the shared race trainer until the database rejects it. -> Pokemon added."""
+    pool, tp = team_pack()
+    time.sleep(max(0.0, start_at - time.time()))
+    added = 0
+    while tp.insert_teams({tp.trainer_id: [(random.choice(poke_ids), None)]}) is not None:
+        added += 1
+    pool.close()
+    return added
+
+
+if __name__ == "__main__":
+    conn = psycopg2.connect(host=secrets['host'], port=secrets['port'], database=secrets['database'],
+                            user=secrets['user'], password=secrets['pass'], connect_timeout=3)
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            cur.execute("DELETE FROM trainers WHERE name LIKE %s;", (PREFIX + '%',))
+            cur.execute("SELECT id FROM pokedex ORDER BY id;")
+            poke_ids = [x[0] for x in cur.fetchall()]
+            cur.execute("SELECT id FROM moves ORDER BY id;")
+            move_ids = [x[0] for x in cur.fetchall()]
+        pool, tp = team_pack()
+        names = [PREFIX + str(n) for n in range(args.trainers)]
+        tp.create_trainers(names)
+        pool.close()
+
+        with multiprocessing.Pool(args.workers) as procs:
+            start_at = time.time() + 1
+            results = procs.starmap(edit_teams, [(n, names, poke_ids, move_ids, start_at) for n in range(args.workers)])
+            edited, rejected, retried = (sum(x) for x in zip(*results))
+            start_at = time.time() + 1
+            added = sum(procs.starmap(race, [(n, poke_ids, start_at) for n in range(args.workers)]))
+
+        with conn.cursor() as cur:
+            cur.execute(CHECK_SQL, {'prefix': PREFIX + '%'})
+            bad_teams, bad_pokemon = cur.fetchone()
+            cur.execute("DELETE FROM trainers WHERE name LIKE %s;", (PREFIX + '%',))
+    finally:
+        conn.close()
+
+    print(args.workers, "workers replaced", edited, "teams (and their moves) in", args.seconds, "seconds:",
+          round(edited / args.seconds), "team edits per second.")
+    print(rejected, "calls rejected by the limits,", retried, "calls retried after a deadlock.")
+    print(args.workers, "workers racing for one team added", added, "Pokemon (MAX_POKEMON =",
+          str(TrainerPack.MAX_POKEMON) + ").")
+    print("Every count matches its rows and limits." if not bad_teams and not bad_pokemon else
+          str(bad_teams) + " TEAMS AND " + str(bad_pokemon) + " POKEMON HAVE WRONG COUNTS!")
@@ -0,0 +1,80 @@
+# python3 benchmark_transform.py
+# Compares the SQL and Python transform engines of create_db.py (--transform sql/python) on the full dataset, and the
+# SQL engine split into shards across several connections (--transform-workers). Each engine rebuilds the database
+# from the response cache (--offline, so run create_db.py once first to fill it) repeat times, and the median wall
+# time of the transform stages, the page parsing done by the Python engine during the loads and the whole build are
+# printed from the --metrics output. The final tables of every engine are then compared with a checksum of their rows.
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import psycopg2
+import hidden
+from url_cache import CACHE_DIR
+
+
+# Stages that create the final tables from the json tables.
+TRANSFORM_STAGES = ['pokedex', 'types', 'moves', 'abilities', 'pokemon_links']
+
+# Final tables compared between the engines.
+COMPARED_TABLES = ['pokedex', 'types', 'moves', 'abilities', 'pokemon_moves', 'pokemon_abilities']
+
+parser = argparse.ArgumentParser(description="Benchmark the SQL and Python transform engines of create_db.py.")
+parser.add_argument('--cache-dir', default=CACHE_DIR, help="directory of the response cache")
+parser.add_argument('--repeat', type=int, default=3, help="number of builds per engine")
+parser.add_argument('--transform-workers', type=int, default=4, help="connections of the sharded SQL engine")
+args = parser.parse_args()
+
+secrets = hidden.secrets()
+
+
+def build(engine, workers=1):
+    """Rebuild the database offline with one engine (and number of transform workers). -> dictionary of timings in
+    seconds."""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'metrics.json')
+        subprocess.run([sys.executable, 'create_db.py', '--offline', '--quiet', '--cache-dir', args.cache_dir,
+                        '--transform', engine, '--transform-workers', str(workers), '--metrics', path], check=True)
+        with open(path) as f:
+            metrics = json.load(f)
+    stages = {g['labels'].get('stage'): g['value'] for g in metrics['gauges'] if g['name'] == 'pipeline_stage_seconds'}
+    build_seconds = [g['value'] for g in metrics['gauges'] if g['name'] == 'build_seconds'][0]
+    parse = sum(c['value'] for c in metrics['counters'] if c['name'] == 'transform_parse_seconds_total')
+    return {'transforms': sum(stages[name] for name in TRANSFORM_STAGES), 'parse': parse, 'build': build_seconds,
+            **{name: stages[name] for name in TRANSFORM_STAGES}}
+
+
+def checksums():
+    """Checksum of the rows of each compared table. -> dictionary of table and md5."""
+    conn = psycopg2.connect(host=secrets['host'], port=secrets['port'], database=secrets['database'],
+                            user=secrets['user'], password=secrets['pass'], connect_timeout=3)
+    try:
+        with conn.cursor() as cur:
+            result = {}
+            for table in COMPARED_TABLES:
+                cur.execute("SELECT count(*), md5(string_agg(t::text, E'\\n' ORDER BY t::text)) FROM " + table + " t;")
+                result[table] = cur.fetchone()
+            return result
+    finally:
+        conn.close()
+
+
+results = {}
+tables = {}
+engines = {'sql': ('sql', 1), 'sql x' + str(args.transform_workers): ('sql', args.transform_workers),
+           'python': ('python', 1)}
+for name, (engine, workers) in engines.items():
+    runs = [build(engine, workers) for _ in range(args.repeat)]
+    results[name] = {key: statistics.median(run[key] for run in runs) for key in runs[0]}
+    tables[name] = checksums()
+
+print("Median seconds over", args.repeat, "builds (parse is the Python engine's page parsing during the loads):")
+print("{:<16}".format('') + ''.join("{:>10}".format(name) for name in engines))
+for key in results['sql']:
+    print("{:<16}".format(key) + ''.join("{:>10.3f}".format(results[name][key]) for name in engines))
+for table in COMPARED_TABLES:
+    (count, _), same = tables['sql'][table], all(tables[name][table] == tables['sql'][table] for name in engines)
+    print(table, count, "rows,", "same rows in every engine." if same else "ROWS DIFFER between the engines!")
@@ -1,57 +1,167 @@
 # python3 create_db.py
 # Pulls data from the https://pokeapi.co API and creates a Pokemon database
+# The build runs as a pipeline of stages (see pipeline.py). Each json table (js_<name>) is fetched and loaded by its
+# own stage, move/ability pages are requested as soon as their ids show up in the Pokemon pages, and each SQL
+# transform runs on its own connection as soon as the tables it reads from are ready. The Pokemon species and evolution
+# chain ids are discovered from the paginated list endpoints of the API instead of probing a fixed range of ids.
+# Use --metrics to write the stage times, request latencies, bytes downloaded, retries, errors and rows per table of
+# the run as JSON or Prometheus text (see metrics.py), and --quiet to only print warnings and errors.
+# Use --transform-workers n to split the pokedex, moves, abilities and link transforms of a full build by id range
+# across n connections (an INSERT ... SELECT statement never gets parallel workers, so one statement keeps one server
+# core busy). The shards of a transform commit one after another once all of them have finished, the one recording
+# the finished stage last, so a failed commit leaves the stage unfinished and --resume runs it again (the transforms
+# upsert).
+# The serving views (SERVING_SQL) are filled after the tables they read, so a full build swaps them in along with the
+# tables, and a refresh that changed any page refreshes them concurrently.
+# A refresh is not one transaction: each stage commits in public when it finishes. The page hashes are stored last, so
+# a failed refresh is recovered by running --refresh again (--resume only continues a full build).
+import argparse
+import hashlib
+import json
+import queue
+import re
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, ExitStack
 import psycopg2
-from psycopg2.extensions import AsIs
+from psycopg2.extras import execute_values
 import hidden
-from get_url import get_url
+from fetch_engine import HOST_RATE
+from get_url import get_url, ENGINE_SETTINGS
+from metrics import METRICS
+from pg_copy import copy_rows
+from pipeline import Pipeline
+from projection import project_page
+from py_transform import ParsedPages, TRANSFORMS, transform_evolutions, transform_links, url_id
+from url_cache import URLCache, CACHE_DIR, CACHE_TTL
 
 
-# Number of Pokemon desired (or list/iterable object of integers [1:1025] possible)
-NUM_OF_POKE = 1025
+# Number of Pokemon desired: None for every Pokemon species listed by the API, a number n for ids [1:n],
+# or a list/iterable object of integers
+NUM_OF_POKE = None
 
-# Load the credentials, connect to PGSQL database, and create cursor
+# Base url of the API
+API_URL = 'https://pokeapi.co/api/v2/'
+
+# The Pokemon species and evolution chain ids are discovered from the paginated list endpoints of the API
+# (?limit=&offset=), LIST_LIMIT resources per page. If a list can't be fetched (e.g. offline without the list pages
+# in the cache), ids [1:n] are requested instead, with n from FALLBACK_COUNTS.
+LIST_LIMIT = 200
+FALLBACK_COUNTS = {'pokemon-species': 1025, 'evolution-chain': 549}
+
+# Move/ability ids are read from the urls in each Pokemon page (e.g. .../move/13/)
+MOVE_ID = re.compile(r'/move/([0-9]+)/')
+ABILITY_ID = re.compile(r'/ability/([0-9]+)/')
+
+# Command line options for the on-disk response cache (see url_cache.py).
+# Use --offline to rebuild purely from cached pages (no network), e.g. in CI sandboxes.
+# Use --api-url to build from another server, e.g. the local stand-in of the API in mock_api.py (benchmark_build.py).
+parser = argparse.ArgumentParser(description="Create the Pokemon database from the https://pokeapi.co API.")
+parser.add_argument('--offline', action='store_true', help="replay cached pages only, never touch the network")
+parser.add_argument('--no-cache', action='store_true', help="always request pages from the API")
+parser.add_argument('--cache-dir', default=CACHE_DIR, help="directory of the response cache")
+parser.add_argument('--cache-ttl', type=int, default=CACHE_TTL, help="seconds before cached pages are revalidated")
+parser.add_argument('--refresh', action='store_true',
+                    help="upsert only new or changed pages into an existing database (keeps trainer data)")
+parser.add_argument('--resume', action='store_true',
+                    help="continue an interrupted full build: fetch only missing or failed pages and re-run only the "
+                         "stages whose inputs changed")
+parser.add_argument('--transform', choices=['sql', 'python'], default='sql',
+                    help="create the final tables with the jsonb SQL statements or the Python engine (py_transform.py)")
+parser.add_argument('--transform-workers', type=int, default=1,
+                    help="connections per SQL transform of a full build (each one transforms a range of ids)")
+parser.add_argument('--keep-full-body', action='store_true',
+                    help="store the whole pages in the json tables instead of only the fields the transforms read")
+parser.add_argument('--quiet', action='store_true', help="only print warnings and errors")
+parser.add_argument('--metrics', metavar='PATH',
+                    help="write the run metrics (stage times, requests, bytes, retries, rows) to PATH ('-' for stdout)")
+parser.add_argument('--metrics-format', choices=['json', 'prometheus'], default='json',
+                    help="format of the --metrics file")
+parser.add_argument('--api-url', default=API_URL,
+                    help="base url of the API, e.g. the local stand-in of mock_api.py (http://127.0.0.1:8000/api/v2/)")
+parser.add_argument('--host-rate', type=float, default=HOST_RATE, help="max requests per second to the API host")
+args = parser.parse_args()
+API_URL = args.api_url if args.api_url.endswith('/') else args.api_url + '/'
+ENGINE_SETTINGS['host_rate'] = args.host_rate
+METRICS.quiet = args.quiet
+parsed = ParsedPages() if args.transform == 'python' else None
+if args.offline and args.no_cache:
+    parser.error("--offline requires the response cache (remove --no-cache)")
+if args.resume and args.refresh:
+    parser.error("--resume continues a full build (a refresh can simply be run again)")
+if args.transform_workers < 1 or args.transform_workers > 1 and (args.refresh or parsed is not None):
+    parser.error("--transform-workers must be at least 1, and more than 1 only splits the SQL transforms of a full "
+                 "build (not --refresh or --transform python)")
+cache = None if args.no_cache else URLCache(args.cache_dir, ttl=args.cache_ttl, offline=args.offline)
+
+# Load the credentials
 secrets = hidden.secrets()
-conn = psycopg2.connect(host=secrets['host'], port=secrets['port'], database=secrets['database'],
-                        user=secrets['user'], password=secrets['pass'], connect_timeout=3)
-cur = conn.cursor()
-print("Connection opened to PGSQL database.")
-
-# Drop existing tables created in this program to start from scratch.
-sql = r"""
-DROP TABLE IF EXISTS js_pokemon;
-DROP TABLE IF EXISTS js_species;
-DROP TABLE IF EXISTS js_types;
-DROP TABLE IF EXISTS js_evo;
-DROP TABLE IF EXISTS js_moves;
-DROP TABLE IF EXISTS js_abilities;
-DROP TABLE IF EXISTS pokedex CASCADE;
-DROP TABLE IF EXISTS types CASCADE;
-DROP TABLE IF EXISTS pokemon_moves;
-DROP TABLE IF EXISTS pokemon_abilities;
-DROP TABLE IF EXISTS moves CASCADE;
-DROP TABLE IF EXISTS abilities CASCADE;
-DROP TABLE IF EXISTS trainer CASCADE;
-DROP TABLE IF EXISTS trainer_moves;
-"""
-cur.execute(sql)
-print(sql)
 
-conn.commit()
+# Ids discovered from each list endpoint by the discovery stages
+discovered = {}
+
+# Ids loaded into each json table by the fetch stages, hashes of refreshed pages waiting to be stored (refresh mode),
+# and the move/ability ids found in the Pokemon pages (None marks the end)
+loaded = {}
+pending_hashes = {}
+move_ids = queue.Queue()
+ability_ids = queue.Queue()
+
+# Stages finished by an earlier run of an interrupted build (resume mode), and stages that changed their tables
+# in this run (the json tables of fetch stages that loaded pages and every stage that ran)
+finished = set()
+changed = set()
+
+# A full build creates every table in a staging schema while the live tables in public stay readable.
+# Once everything is loaded and indexed, the live tables are moved to the old schema and the staging tables
+# are moved into public in a single transaction, and the old schema is dropped.
+STAGING_SCHEMA = 'pokemon_build'
+OLD_SCHEMA = 'pokemon_old'
+
+# Tables created in this program
+TABLES = ['js_pokemon', 'js_species', 'js_types', 'js_type_damage', 'js_evo', 'js_moves', 'js_abilities', 'pokedex',
+          'types', 'type_efficacy',
+          'pokemon_moves', 'pokemon_abilities', 'moves', 'abilities', 'trainers', 'trainer', 'trainer_moves',
+          'build_info', 'evo_species', 'evo_edges', 'evo_closure']
+
+# Version written to the build_info table once the build (or a refresh that changed something) is live.
+# Readers such as ref_cache.py compare it to detect a rebuild.
+BUILD_VERSION = uuid.uuid4().hex
+
+# A full build checkpoints its progress in the staging schema: the pages loaded so far are committed in batches,
+# and these tables record the finished stages and the pages that could not be fetched (a 404 page is not requested
+# again by --resume). They are dropped along with the staging schema after the swap.
+CHECKPOINT_SQL = r"""
+CREATE TABLE IF NOT EXISTS build_stages (stage TEXT PRIMARY KEY, finished_at TIMESTAMPTZ DEFAULT now());
+CREATE TABLE IF NOT EXISTS fetch_failures (tbl TEXT, id INTEGER, status TEXT, PRIMARY KEY (tbl, id));
+"""
 
 # Create json helper tables (js_<name>) and final database tables
-sql = r"""
-CREATE TABLE IF NOT EXISTS js_pokemon (id INTEGER PRIMARY KEY, body JSONB);
-CREATE TABLE IF NOT EXISTS js_species (id INTEGER PRIMARY KEY, body JSONB);
-CREATE TABLE IF NOT EXISTS js_types (id INTEGER PRIMARY KEY, body JSONB);
-CREATE TABLE IF NOT EXISTS js_evo (id INTEGER PRIMARY KEY, body JSONB);
-CREATE TABLE IF NOT EXISTS js_moves (id INTEGER PRIMARY KEY, body JSONB);
-CREATE TABLE IF NOT EXISTS js_abilities (id INTEGER PRIMARY KEY, body JSONB);
+# The json tables are UNLOGGED (no WAL is written for the bulk loads, and they are emptied after a server crash)
+CREATE_SQL = r"""
+CREATE UNLOGGED TABLE IF NOT EXISTS js_pokemon (id INTEGER PRIMARY KEY, body JSONB, hash TEXT);
+CREATE UNLOGGED TABLE IF NOT EXISTS js_species (id INTEGER PRIMARY KEY, body JSONB, hash TEXT);
+CREATE UNLOGGED TABLE IF NOT EXISTS js_types (id INTEGER PRIMARY KEY, body JSONB, hash TEXT);
+CREATE UNLOGGED TABLE IF NOT EXISTS js_type_damage (id INTEGER PRIMARY KEY, body JSONB, hash TEXT);
+CREATE UNLOGGED TABLE IF NOT EXISTS js_evo (id INTEGER PRIMARY KEY, body JSONB, hash TEXT);
+CREATE UNLOGGED TABLE IF NOT EXISTS js_moves (id INTEGER PRIMARY KEY, body JSONB, hash TEXT);
+CREATE UNLOGGED TABLE IF NOT EXISTS js_abilities (id INTEGER PRIMARY KEY, body JSONB, hash TEXT);
+ALTER TABLE js_pokemon ADD COLUMN IF NOT EXISTS hash TEXT;
+ALTER TABLE js_species ADD COLUMN IF NOT EXISTS hash TEXT;
+ALTER TABLE js_types ADD COLUMN IF NOT EXISTS hash TEXT;
+ALTER TABLE js_evo ADD COLUMN IF NOT EXISTS hash TEXT;
+ALTER TABLE js_moves ADD COLUMN IF NOT EXISTS hash TEXT;
+ALTER TABLE js_abilities ADD COLUMN IF NOT EXISTS hash TEXT;
 CREATE TABLE IF NOT EXISTS pokedex (
     id INTEGER PRIMARY KEY, name VARCHAR(20) UNIQUE, height NUMERIC, weight NUMERIC, hp NUMERIC,
     attack NUMERIC, defense NUMERIC, s_attack NUMERIC, s_defense NUMERIC, speed NUMERIC, 
     type TEXT [], evo_set INTEGER, info TEXT
 );
 CREATE TABLE IF NOT EXISTS types (id INTEGER PRIMARY KEY, name VARCHAR(20) UNIQUE);
+CREATE TABLE IF NOT EXISTS type_efficacy (
+    attack_type INTEGER, defend_type INTEGER, factor NUMERIC, PRIMARY KEY (attack_type, defend_type)
+);
 CREATE TABLE IF NOT EXISTS pokemon_moves (
     poke_id INTEGER, move_id INTEGER, PRIMARY KEY (poke_id, move_id), UNIQUE (move_id, poke_id)
 );
@@ -60,38 +170,178 @@ CREATE TABLE IF NOT EXISTS pokemon_abilities (
 );
 CREATE TABLE IF NOT EXISTS moves (
     id INTEGER PRIMARY KEY, name VARCHAR(50) UNIQUE, pp INTEGER, damage NUMERIC, accuracy NUMERIC,
-    type INTEGER REFERENCES types (id) ON DELETE CASCADE, info TEXT
+    type INTEGER, info TEXT
 );
 CREATE TABLE IF NOT EXISTS abilities (id INTEGER PRIMARY KEY, name VARCHAR(50) UNIQUE, info TEXT);
+-- Stored full text search vectors (the name weighted above the info text) used by search.py
+ALTER TABLE pokedex ADD COLUMN IF NOT EXISTS search TSVECTOR GENERATED ALWAYS AS (
+    setweight(to_tsvector('english', coalesce(name, '')), 'A') ||
+    setweight(to_tsvector('english', coalesce(info, '')), 'B')
+) STORED;
+ALTER TABLE moves ADD COLUMN IF NOT EXISTS search TSVECTOR GENERATED ALWAYS AS (
+    setweight(to_tsvector('english', coalesce(name, '')), 'A') ||
+    setweight(to_tsvector('english', coalesce(info, '')), 'B')
+) STORED;
+ALTER TABLE abilities ADD COLUMN IF NOT EXISTS search TSVECTOR GENERATED ALWAYS AS (
+    setweight(to_tsvector('english', coalesce(name, '')), 'A') ||
+    setweight(to_tsvector('english', coalesce(info, '')), 'B')
+) STORED;
+CREATE TABLE IF NOT EXISTS trainers (
+    id INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY, name VARCHAR(50) NOT NULL UNIQUE,
+    max_pokemon INTEGER NOT NULL DEFAULT 6, max_moves INTEGER NOT NULL DEFAULT 4,
+    pokemon_count INTEGER NOT NULL DEFAULT 0,
+    CONSTRAINT trainers_max_pokemon CHECK (pokemon_count BETWEEN 0 AND max_pokemon)
+);
 CREATE TABLE IF NOT EXISTS trainer (
     id SERIAL PRIMARY KEY, poke_id INTEGER NOT NULL REFERENCES pokedex (id) ON DELETE CASCADE,
-    ability_id INTEGER REFERENCES abilities (id) ON DELETE CASCADE
+    ability_id INTEGER REFERENCES abilities (id) ON DELETE CASCADE,
+    owner_id INTEGER NOT NULL REFERENCES trainers (id) ON DELETE CASCADE, move_count INTEGER NOT NULL DEFAULT 0
 );
 CREATE TABLE IF NOT EXISTS trainer_moves (
     trainer_id INTEGER REFERENCES trainer (id) ON DELETE CASCADE,
     move_id INTEGER REFERENCES moves (id) ON DELETE CASCADE, PRIMARY KEY (trainer_id, move_id)
 );
+CREATE TABLE IF NOT EXISTS build_info (
+    id INTEGER PRIMARY KEY CHECK (id = 1), version TEXT NOT NULL, mode TEXT, built_at TIMESTAMPTZ DEFAULT now()
+);
+CREATE TABLE IF NOT EXISTS evo_species (id INTEGER PRIMARY KEY, name VARCHAR(20), chain_id INTEGER, stage INTEGER);
+CREATE TABLE IF NOT EXISTS evo_edges (
+    chain_id INTEGER, parent_id INTEGER, child_id INTEGER, PRIMARY KEY (parent_id, child_id),
+    UNIQUE (child_id, parent_id)
+);
+CREATE TABLE IF NOT EXISTS evo_closure (
+    chain_id INTEGER, ancestor_id INTEGER, descendant_id INTEGER, depth INTEGER, branch INTEGER, path INTEGER [],
+    PRIMARY KEY (ancestor_id, descendant_id), UNIQUE (descendant_id, ancestor_id)
+);
 """
-cur.execute(sql)
-print(sql)
 
-conn.commit()
+# Team limits of the trainers (one team per trainer), enforced inside the database so concurrent writers can't exceed
+# them. Statement triggers keep the Pokemon count of each trainer (trainers.pokemon_count, checked against max_pokemon
+# by a CHECK constraint) and the move count of each team Pokemon (trainer.move_count, checked against the max_moves of
+# its trainer) up to date. Every write to a team first locks the row of its trainer in trainers (the same lock an UPDATE
+# of max_moves takes), then the counted rows, each in id order. So a write waits for a concurrent change of the limits
+# of its trainer (and the reverse), and concurrent batches touching the same teams wait for each other instead of
+# deadlocking. Limits are reported as check_violation errors.
+# The trigger functions live in public (they must outlive the staging schema of a full build). The triggers are dropped
+# and created again (CREATE OR REPLACE TRIGGER needs PostgreSQL 14).
+# Databases created before trainers existed get the default trainer as the owner of their team (and their counts).
+TRAINER_SQL = r"""
+CREATE OR REPLACE FUNCTION public.trainer_pokemon_count() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'TRUNCATE' THEN
+        UPDATE trainers SET pokemon_count = 0 WHERE pokemon_count <> 0;
+    ELSIF TG_OP = 'UPDATE' THEN
+        PERFORM 1 FROM trainers WHERE id IN (OLD.owner_id, NEW.owner_id) ORDER BY id FOR NO KEY UPDATE;
+        UPDATE trainers SET pokemon_count = pokemon_count - 1 WHERE id = OLD.owner_id;
+        UPDATE trainers SET pokemon_count = pokemon_count + 1 WHERE id = NEW.owner_id;
+    ELSIF TG_OP = 'INSERT' THEN
+        PERFORM 1 FROM trainers WHERE id IN (SELECT owner_id FROM new_rows) ORDER BY id FOR NO KEY UPDATE;
+        UPDATE trainers AS o SET pokemon_count = o.pokemon_count + c.n
+        FROM (SELECT owner_id, count(*) as n FROM new_rows GROUP BY owner_id) AS c WHERE o.id = c.owner_id;
+    ELSE
+        PERFORM 1 FROM trainers WHERE id IN (SELECT owner_id FROM old_rows) ORDER BY id FOR NO KEY UPDATE;
+        UPDATE trainers AS o SET pokemon_count = o.pokemon_count - c.n
+        FROM (SELECT owner_id, count(*) as n FROM old_rows GROUP BY owner_id) AS c WHERE o.id = c.owner_id;
+    END IF;
+    RETURN NULL;
+END $$;
 
-# Get initial json data from pokeapi and insert into json tables (js_<name>)
-# Note some pages in evolution-chain data are missing from api (look at page = 210), data is still complete though
-url_paths = ['https://pokeapi.co/api/v2/pokemon/', 'https://pokeapi.co/api/v2/pokemon-species/',
-             'https://pokeapi.co/api/v2/type/', 'https://pokeapi.co/api/v2/evolution-chain/']
-json_tables = ['js_pokemon', 'js_species', 'js_types', 'js_evo']
-indexes = [NUM_OF_POKE, NUM_OF_POKE, None, 549]
-for i in range(len(url_paths)):
-    id_texts = get_url(url_paths[i], indexes[i])
-    values = ','.join([cur.mogrify("(%s,%s)", tup).decode('utf-8') for tup in id_texts])
-    cur.execute("INSERT INTO %s VALUES %s;", (AsIs(json_tables[i]), AsIs(values)))
+CREATE OR REPLACE FUNCTION public.trainer_move_count() RETURNS trigger LANGUAGE plpgsql AS $$
+DECLARE
+    over_id INTEGER;
+    over_name TEXT;
+    over_max INTEGER;
+BEGIN
+    IF TG_OP = 'TRUNCATE' THEN
+        UPDATE trainer SET move_count = 0 WHERE move_count <> 0;
+        RETURN NULL;
+    ELSIF TG_OP = 'UPDATE' THEN
+        PERFORM 1 FROM trainers WHERE id IN (SELECT owner_id FROM trainer WHERE id IN (OLD.trainer_id, NEW.trainer_id))
+        ORDER BY id FOR NO KEY UPDATE;
+        PERFORM 1 FROM trainer WHERE id IN (OLD.trainer_id, NEW.trainer_id) ORDER BY id FOR NO KEY UPDATE;
+        UPDATE trainer SET move_count = move_count - 1 WHERE id = OLD.trainer_id;
+        UPDATE trainer SET move_count = move_count + 1 WHERE id = NEW.trainer_id;
+        SELECT t.id, o.name, o.max_moves INTO over_id, over_name, over_max
+        FROM trainer AS t JOIN trainers AS o ON o.id = t.owner_id
+        WHERE t.id = NEW.trainer_id AND t.move_count > o.max_moves;
+    ELSIF TG_OP = 'INSERT' THEN
+        PERFORM 1 FROM trainers WHERE id IN (SELECT owner_id FROM trainer WHERE id IN (SELECT trainer_id FROM new_rows))
+        ORDER BY id FOR NO KEY UPDATE;
+        PERFORM 1 FROM trainer WHERE id IN (SELECT trainer_id FROM new_rows) ORDER BY id FOR NO KEY UPDATE;
+        UPDATE trainer AS t SET move_count = t.move_count + c.n
+        FROM (SELECT trainer_id, count(*) as n FROM new_rows GROUP BY trainer_id) AS c WHERE t.id = c.trainer_id;
+        SELECT t.id, o.name, o.max_moves INTO over_id, over_name, over_max
+        FROM trainer AS t JOIN trainers AS o ON o.id = t.owner_id
+        WHERE t.id IN (SELECT trainer_id FROM new_rows) AND t.move_count > o.max_moves LIMIT 1;
+    ELSE
+        PERFORM 1 FROM trainer WHERE id IN (SELECT trainer_id FROM old_rows) ORDER BY id FOR NO KEY UPDATE;
+        UPDATE trainer AS t SET move_count = t.move_count - c.n
+        FROM (SELECT trainer_id, count(*) as n FROM old_rows GROUP BY trainer_id) AS c WHERE t.id = c.trainer_id;
+    END IF;
+    IF over_id IS NOT NULL THEN
+        RAISE EXCEPTION 'Total moves of trainer Pokemon % (trainer %) would exceed max_moves = %.',
+            over_id, over_name, over_max USING ERRCODE = 'check_violation';
+    END IF;
+    RETURN NULL;
+END $$;
 
-conn.commit()
+CREATE OR REPLACE FUNCTION public.trainers_max_moves() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    PERFORM 1 FROM trainer WHERE owner_id = NEW.id ORDER BY id FOR SHARE;
+    IF EXISTS (SELECT 1 FROM trainer WHERE owner_id = NEW.id AND move_count > NEW.max_moves) THEN
+        RAISE EXCEPTION 'Total moves of a Pokemon of trainer % exceed max_moves = %.', NEW.name, NEW.max_moves
+            USING ERRCODE = 'check_violation';
+    END IF;
+    RETURN NEW;
+END $$;
+
+ALTER TABLE trainer ADD COLUMN IF NOT EXISTS owner_id INTEGER REFERENCES trainers (id) ON DELETE CASCADE;
+ALTER TABLE trainer ADD COLUMN IF NOT EXISTS move_count INTEGER NOT NULL DEFAULT 0;
+INSERT INTO trainers (name) VALUES ('default') ON CONFLICT (name) DO NOTHING;
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM trainer WHERE owner_id IS NULL) THEN
+        UPDATE trainer SET owner_id = (SELECT id FROM trainers WHERE name = 'default') WHERE owner_id IS NULL;
+        UPDATE trainer AS t SET move_count = c.n
+        FROM (SELECT trainer_id, count(*) as n FROM trainer_moves GROUP BY trainer_id) AS c WHERE t.id = c.trainer_id;
+        UPDATE trainers AS o SET pokemon_count = c.n, max_pokemon = greatest(o.max_pokemon, c.n)
+        FROM (SELECT owner_id, count(*) as n FROM trainer GROUP BY owner_id) AS c WHERE o.id = c.owner_id;
+    END IF;
+END $$;
+ALTER TABLE trainer ALTER COLUMN owner_id SET NOT NULL;
+CREATE INDEX IF NOT EXISTS trainer_owner ON trainer (owner_id);
+
+DROP TRIGGER IF EXISTS trainer_insert ON trainer;
+CREATE TRIGGER trainer_insert AFTER INSERT ON trainer REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION public.trainer_pokemon_count();
+DROP TRIGGER IF EXISTS trainer_delete ON trainer;
+CREATE TRIGGER trainer_delete AFTER DELETE ON trainer REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION public.trainer_pokemon_count();
+DROP TRIGGER IF EXISTS trainer_owner ON trainer;
+CREATE TRIGGER trainer_owner AFTER UPDATE OF owner_id ON trainer
+    FOR EACH ROW WHEN (OLD.owner_id IS DISTINCT FROM NEW.owner_id) EXECUTE FUNCTION public.trainer_pokemon_count();
+DROP TRIGGER IF EXISTS trainer_truncate ON trainer;
+CREATE TRIGGER trainer_truncate AFTER TRUNCATE ON trainer
+    FOR EACH STATEMENT EXECUTE FUNCTION public.trainer_pokemon_count();
+DROP TRIGGER IF EXISTS trainer_moves_insert ON trainer_moves;
+CREATE TRIGGER trainer_moves_insert AFTER INSERT ON trainer_moves REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION public.trainer_move_count();
+DROP TRIGGER IF EXISTS trainer_moves_delete ON trainer_moves;
+CREATE TRIGGER trainer_moves_delete AFTER DELETE ON trainer_moves REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION public.trainer_move_count();
+DROP TRIGGER IF EXISTS trainer_moves_owner ON trainer_moves;
+CREATE TRIGGER trainer_moves_owner AFTER UPDATE OF trainer_id ON trainer_moves
+    FOR EACH ROW WHEN (OLD.trainer_id IS DISTINCT FROM NEW.trainer_id) EXECUTE FUNCTION public.trainer_move_count();
+DROP TRIGGER IF EXISTS trainer_moves_truncate ON trainer_moves;
+CREATE TRIGGER trainer_moves_truncate AFTER TRUNCATE ON trainer_moves
+    FOR EACH STATEMENT EXECUTE FUNCTION public.trainer_move_count();
+DROP TRIGGER IF EXISTS trainers_max_moves ON trainers;
+CREATE TRIGGER trainers_max_moves BEFORE UPDATE OF max_moves ON trainers
+    FOR EACH ROW WHEN (NEW.max_moves < OLD.max_moves) EXECUTE FUNCTION public.trainers_max_moves();
+"""
 
 # Insert data into the pokedex table from js_pokemon, js_evo, js_species
-sql = r"""
+POKEDEX_SQL = r"""
 WITH cte AS (
     SELECT (body->'id')::int as id, 
             unnest(translate(jsonb_path_query_array(body->'flavor_text_entries', '$.language.name')::text, 
@@ -99,6 +349,7 @@ WITH cte AS (
             unnest(translate(regexp_replace(jsonb_path_query_array(body->'flavor_text_entries', '$.flavor_text')::text, 
                    '\\n|\\f', ' ', 'g'), '[]', '{}')::text[]) as info
     FROM js_species
+    WHERE %(ids)s::int[] IS NULL OR id = ANY(%(ids)s::int[])
 ), rownum AS (
     SELECT row_number() over(order by (select NULL)) as rn, * FROM cte
 ), engchk AS (
@@ -123,6 +374,7 @@ FROM (
            (body->'stats'->5->'base_stat')::numeric,
             translate(jsonb_path_query_array(body->'types', '$.type.name')::text, '[]', '{}')::text[]
     FROM js_pokemon
+    WHERE %(ids)s::int[] IS NULL OR id = ANY(%(ids)s::int[])
 ) AS pd
 LEFT JOIN (
     SELECT (body->'id')::int as evo_set, 
@@ -134,78 +386,55 @@ LEFT JOIN (
     ON pd.name = es.name
 LEFT JOIN (SELECT id, info FROM infotb WHERE rk = 1) AS it 
     ON pd.id = it.id
-ORDER BY pd.id;
+ORDER BY pd.id
+ON CONFLICT (id) DO UPDATE SET 
+    name = EXCLUDED.name, height = EXCLUDED.height, weight = EXCLUDED.weight, hp = EXCLUDED.hp,
+    attack = EXCLUDED.attack, defense = EXCLUDED.defense, s_attack = EXCLUDED.s_attack,
+    s_defense = EXCLUDED.s_defense, speed = EXCLUDED.speed, type = EXCLUDED.type, evo_set = EXCLUDED.evo_set,
+    info = EXCLUDED.info;
 """
-cur.execute(sql)
-print(sql)
 
 # Insert data into the types table from js_types
-sql = r"""
+TYPES_SQL = r"""
 INSERT INTO types (id, name)
 SELECT substring(unnest(translate(jsonb_path_query_array(body->'results', '$.url')::text, 
                  '[]', '{}')::text[]) from '.+/([0-9]+)/$')::int,
        unnest(translate(jsonb_path_query_array(body->'results', '$.name')::text, '[]', '{}')::text[])
-FROM js_types; 
+FROM js_types
+ON CONFLICT (id) DO UPDATE SET name = EXCLUDED.name; 
 """
-cur.execute(sql)
-print(sql)
 
-# Insert data into the pokemon_moves table from js_pokemon
-sql = r"""
-INSERT INTO pokemon_moves (poke_id, move_id)
-SELECT (body->'id')::int,
-        substring(unnest(translate(jsonb_path_query_array(body->'moves', '$.move.url')::text, 
-                  '[]', '{}')::text[]) from '.+/([0-9]+)/$')::int
-FROM js_pokemon;
+# Ids of the types in the type list page (js_types), fetched one by one into js_type_damage
+TYPE_IDS_SQL = r"""
+SELECT substring(unnest(translate(jsonb_path_query_array(body->'results', '$.url')::text, 
+                 '[]', '{}')::text[]) from '.+/([0-9]+)/$')::int as id
+FROM js_types
+ORDER BY id;
 """
-cur.execute(sql)
-print(sql)
 
-# Insert data into the pokemon_abilities table from js_pokemon
-# Some Pokemon have duplicate abilities listed so SELECT DISTINCT is used (look at pokemon_id = 948 or 949)
-sql = r"""
-INSERT INTO pokemon_abilities (poke_id, ability_id)
-SELECT DISTINCT (body->'id')::int,
-                 substring(unnest(translate(jsonb_path_query_array(body->'abilities', '$.ability.url')::text, 
-                           '[]', '{}')::text[]) from '.+/([0-9]+)/$')::int
-FROM js_pokemon;
+# Insert the damage factor of every attacking type against every defending type into the type_efficacy table from
+# js_type_damage (the damage_relations of each type page, 1.0 for pairs that are not listed)
+TYPE_EFFICACY_SQL = r"""
+INSERT INTO type_efficacy (attack_type, defend_type, factor)
+SELECT atk.id, dfn.id, coalesce(rel.factor, 1.0)
+FROM types AS atk
+CROSS JOIN types AS dfn
+LEFT JOIN (
+    SELECT (body->'id')::int as attack_type,
+            substring(e.value->>'url' from '.+/([0-9]+)/$')::int as defend_type,
+            min(f.factor) as factor
+    FROM js_type_damage
+    CROSS JOIN (VALUES ('double_damage_to', 2.0), ('half_damage_to', 0.5), ('no_damage_to', 0.0)) AS f (relation, factor)
+    CROSS JOIN jsonb_array_elements(body->'damage_relations'->f.relation) AS e
+    GROUP BY 1, 2
+) AS rel 
+    ON rel.attack_type = atk.id AND rel.defend_type = dfn.id
+ORDER BY atk.id, dfn.id
+ON CONFLICT (attack_type, defend_type) DO UPDATE SET factor = EXCLUDED.factor;
 """
-cur.execute(sql)
-print(sql)
-
-conn.commit()
-
-# Get move_ids from pokemon_moves table
-sql = r"SELECT DISTINCT move_id FROM pokemon_moves ORDER BY move_id;"
-cur.execute(sql)
-print(sql)
-move_ids = cur.fetchall()
-
-conn.commit()
-
-# Get ability_ids from pokemon_abilities table
-sql = r"SELECT DISTINCT ability_id FROM pokemon_abilities ORDER BY ability_id;"
-cur.execute(sql)
-print(sql)
-ability_ids = cur.fetchall()
-
-conn.commit()
-
-# Get final json data from pokeapi and insert into json tables (js_<name>)
-MOVES_INDEX = [x[0] for x in move_ids]
-ABILITIES_INDEX = [y[0] for y in ability_ids]
-url_paths = ['https://pokeapi.co/api/v2/move/', 'https://pokeapi.co/api/v2/ability/']
-json_tables = ['js_moves', 'js_abilities']
-indexes = [MOVES_INDEX, ABILITIES_INDEX]
-for i in range(len(url_paths)):
-    id_texts = get_url(url_paths[i], indexes[i])
-    values = ','.join([cur.mogrify("(%s,%s)", tup).decode('utf-8') for tup in id_texts])
-    cur.execute("INSERT INTO %s VALUES %s;", (AsIs(json_tables[i]), AsIs(values)))
-
-conn.commit()
 
 # Insert data into moves table from js_moves
-sql = r"""
+MOVES_SQL = r"""
 WITH cte AS (
     SELECT (body->'id')::int as id, 
             unnest(translate(jsonb_path_query_array(body->'effect_entries', '$.language.name')::text, 
@@ -213,6 +442,7 @@ WITH cte AS (
             unnest(translate(regexp_replace(jsonb_path_query_array(body->'effect_entries', '$.effect')::text, 
                    '\\n|\\n\\n|\\f|  ', ' ', 'g'), '[]', '{}')::text[]) as effect
     FROM js_moves
+    WHERE %(ids)s::int[] IS NULL OR id = ANY(%(ids)s::int[])
 ), rownum AS (
     SELECT row_number() over(order by (select NULL)) as rn, * FROM cte
 ), engchk AS (
@@ -226,6 +456,7 @@ WITH cte AS (
             unnest(translate(regexp_replace(jsonb_path_query_array(body->'flavor_text_entries', '$.flavor_text')::text, 
                    '\\n|\\f', ' ', 'g'), '[]', '{}')::text[]) as ftext
     FROM js_moves
+    WHERE %(ids)s::int[] IS NULL OR id = ANY(%(ids)s::int[])
 ), rownum1 AS (
     SELECT row_number() over(order by (select NULL)) as rn, * FROM cte1
 ), engchk1 AS (
@@ -247,18 +478,20 @@ FROM (
             END,
             substring(body->'type'->>'url' from '.+/([0-9]+)/$')::int
     FROM js_moves
+    WHERE %(ids)s::int[] IS NULL OR id = ANY(%(ids)s::int[])
 ) AS mt
 LEFT JOIN (SELECT id, ftext FROM flavtb WHERE rk = 1) AS ft
     ON mt.id = ft.id
 LEFT JOIN (SELECT id, effect FROM effctb WHERE rk = 1) AS et
     ON mt.id = et.id
-ORDER BY mt.id;
+ORDER BY mt.id
+ON CONFLICT (id) DO UPDATE SET
+    name = EXCLUDED.name, pp = EXCLUDED.pp, damage = EXCLUDED.damage, accuracy = EXCLUDED.accuracy,
+    type = EXCLUDED.type, info = EXCLUDED.info;
 """
-cur.execute(sql)
-print(sql)
 
 # Insert data into abilities table from js_abilities
-sql = r"""
+ABILITIES_SQL = r"""
 WITH cte AS (
     SELECT (body->'id')::int as id, 
             unnest(translate(jsonb_path_query_array(body->'effect_entries', '$.language.name')::text, 
@@ -266,6 +499,7 @@ WITH cte AS (
             unnest(translate(regexp_replace(jsonb_path_query_array(body->'effect_entries', '$.effect')::text, 
                    '\\n|\\n\\n|\\f|  ', ' ', 'g'), '[]', '{}')::text[]) as effect
     FROM js_abilities
+    WHERE %(ids)s::int[] IS NULL OR id = ANY(%(ids)s::int[])
 ), rownum AS (
     SELECT row_number() over(order by (select NULL)) as rn, * FROM cte
 ), engchk AS (
@@ -279,6 +513,7 @@ WITH cte AS (
             unnest(translate(regexp_replace(jsonb_path_query_array(body->'flavor_text_entries', '$.flavor_text')::text, 
                    '\\n|\\f', ' ', 'g'), '[]', '{}')::text[]) as ftext
     FROM js_abilities
+    WHERE %(ids)s::int[] IS NULL OR id = ANY(%(ids)s::int[])
 ), rownum1 AS (
     SELECT row_number() over(order by (select NULL)) as rn, * FROM cte1
 ), engchk1 AS (
@@ -292,50 +527,685 @@ FROM (
     SELECT (body->'id')::int as id,
             body->>'name'
     FROM js_abilities
+    WHERE %(ids)s::int[] IS NULL OR id = ANY(%(ids)s::int[])
 ) AS abt
 LEFT JOIN (SELECT id, ftext FROM flavtb WHERE rk = 1) AS ft
     ON abt.id = ft.id
 LEFT JOIN (SELECT id, effect FROM effctb WHERE rk = 1) AS et
     ON abt.id = et.id
-ORDER BY abt.id;
+ORDER BY abt.id
+ON CONFLICT (id) DO UPDATE SET name = EXCLUDED.name, info = EXCLUDED.info;
+"""
+
+# Evolution graph of the chains in js_evo (species ids from the species urls), walked to any depth:
+# evo_species holds the stage of each species (1 for the first stage) in its chain, evo_edges each evolution
+# (parent_id evolves into child_id) and evo_closure every (ancestor, descendant) pair of a chain along with its depth
+# (0 for the pair of a species with itself), the path of species ids from the ancestor to the descendant and the branch
+# (the child of the ancestor the path goes through). Both pair tables are indexed in both directions.
+EVO_NODES_SQL = r"""
+CREATE TEMP TABLE evo_nodes ON COMMIT DROP AS
+WITH RECURSIVE node AS (
+    SELECT (body->'id')::int as chain_id, 
+            body->'chain' as stage,
+            ARRAY[substring(body->'chain'->'species'->>'url' from '.+/([0-9]+)/$')::int] as path
+    FROM js_evo
+    WHERE %(ids)s::int[] IS NULL OR id = ANY(%(ids)s::int[])
+    UNION ALL
+    SELECT n.chain_id, 
+           e.value,
+           n.path || substring(e.value->'species'->>'url' from '.+/([0-9]+)/$')::int
+    FROM node AS n
+    CROSS JOIN jsonb_array_elements(n.stage->'evolves_to') AS e
+)
+SELECT chain_id, path[cardinality(path)] as id, stage->'species'->>'name' as name, path FROM node;
+"""
+
+# Remove the evolution graph of changed chains in refresh mode (the rows are inserted again after)
+UNLINK_EVO_SQL = r"""
+DELETE FROM evo_closure WHERE chain_id = ANY(%(ids)s);
+DELETE FROM evo_edges WHERE chain_id = ANY(%(ids)s);
+DELETE FROM evo_species WHERE chain_id = ANY(%(ids)s);
+"""
+
+# Insert the evolution graph tables from the evo_nodes temp table (target, sql)
+EVO_SQL = [
+    ('evo_species', r"""
+INSERT INTO evo_species (id, name, chain_id, stage)
+SELECT id, name, chain_id, cardinality(path) FROM evo_nodes ORDER BY id
+ON CONFLICT (id) DO UPDATE SET name = EXCLUDED.name, chain_id = EXCLUDED.chain_id, stage = EXCLUDED.stage;
+"""),
+    ('evo_edges', r"""
+INSERT INTO evo_edges (chain_id, parent_id, child_id)
+SELECT chain_id, path[cardinality(path) - 1], id FROM evo_nodes WHERE cardinality(path) > 1
+ON CONFLICT (parent_id, child_id) DO UPDATE SET chain_id = EXCLUDED.chain_id;
+"""),
+    ('evo_closure', r"""
+INSERT INTO evo_closure (chain_id, ancestor_id, descendant_id, depth, branch, path)
+SELECT chain_id, a.ancestor_id, id, cardinality(path) - a.n, path[a.n + 1], path[a.n:]
+FROM evo_nodes
+CROSS JOIN unnest(path) WITH ORDINALITY AS a (ancestor_id, n)
+ON CONFLICT (ancestor_id, descendant_id) DO UPDATE SET
+    chain_id = EXCLUDED.chain_id, depth = EXCLUDED.depth, branch = EXCLUDED.branch, path = EXCLUDED.path;
+"""),
+]
+
+# Remove the move and ability links of changed Pokemon in refresh mode (the links are inserted again after)
+UNLINK_SQL = r"""
+DELETE FROM pokemon_moves WHERE poke_id = ANY(%(ids)s);
+DELETE FROM pokemon_abilities WHERE poke_id = ANY(%(ids)s);
+"""
+
+# Insert data into the pokemon_moves table from js_pokemon
+POKEMON_MOVES_SQL = r"""
+INSERT INTO pokemon_moves (poke_id, move_id)
+SELECT (body->'id')::int,
+        substring(unnest(translate(jsonb_path_query_array(body->'moves', '$.move.url')::text, 
+                  '[]', '{}')::text[]) from '.+/([0-9]+)/$')::int
+FROM js_pokemon
+WHERE %(ids)s::int[] IS NULL OR id = ANY(%(ids)s::int[])
+ON CONFLICT DO NOTHING;
 """
-cur.execute(sql)
-print(sql)
 
-conn.commit()
+# Insert data into the pokemon_abilities table from js_pokemon
+# Some Pokemon have duplicate abilities listed so SELECT DISTINCT is used (look at pokemon_id = 948 or 949)
+POKEMON_ABILITIES_SQL = r"""
+INSERT INTO pokemon_abilities (poke_id, ability_id)
+SELECT DISTINCT (body->'id')::int,
+                 substring(unnest(translate(jsonb_path_query_array(body->'abilities', '$.ability.url')::text, 
+                           '[]', '{}')::text[]) from '.+/([0-9]+)/$')::int
+FROM js_pokemon
+WHERE %(ids)s::int[] IS NULL OR id = ANY(%(ids)s::int[])
+ON CONFLICT DO NOTHING;
+"""
+
+# Statements of the pokemon_links stage
+LINK_SQL = [('pokemon_moves', POKEMON_MOVES_SQL), ('pokemon_abilities', POKEMON_ABILITIES_SQL)]
 
-# Add remaining foreign keys and create GIN indexes on text/text[] columns
-sql = r"""
+# Json table whose ids split each transform stage into shards (--transform-workers)
+SHARD_TABLES = {'pokedex': 'js_pokemon', 'moves': 'js_moves', 'abilities': 'js_abilities',
+                'pokemon_links': 'js_pokemon'}
+
+# Record the version of the build (single row table)
+BUILD_INFO_SQL = r"""
+INSERT INTO build_info (id, version, mode, built_at) VALUES (1, %(version)s, %(mode)s, now())
+ON CONFLICT (id) DO UPDATE SET version = EXCLUDED.version, mode = EXCLUDED.mode, built_at = EXCLUDED.built_at;
+"""
+
+# Add remaining foreign keys and create GIN indexes on the text[] column, the info text (to_tsvector expression, used by
+# ad hoc text queries such as those of trainer_example.ipynb) and the search (tsvector) columns
+# Each one is built by its own stage (and connection) as soon as the tables it needs are loaded (stage, deps, sql).
+# A refresh runs the GIN index stages too, so a database built before an index was added gets it (IF NOT EXISTS).
+INDEX_STAGES = [
+    ('fk_moves', ['moves', 'types'], r"""
+ALTER TABLE moves ADD FOREIGN KEY (type) REFERENCES types (id) ON DELETE CASCADE;
+"""),
+    ('fk_type_efficacy', ['type_efficacy', 'types'], r"""
+ALTER TABLE type_efficacy ADD FOREIGN KEY (attack_type) REFERENCES types (id) ON DELETE CASCADE;
+ALTER TABLE type_efficacy ADD FOREIGN KEY (defend_type) REFERENCES types (id) ON DELETE CASCADE;
+"""),
+    ('fk_pokemon_moves', ['pokemon_links'], r"""
 ALTER TABLE pokemon_moves ADD FOREIGN KEY (poke_id) REFERENCES pokedex (id) ON DELETE CASCADE;
 ALTER TABLE pokemon_moves ADD FOREIGN KEY (move_id) REFERENCES moves (id) ON DELETE CASCADE;
+"""),
+    ('fk_pokemon_abilities', ['pokemon_links'], r"""
 ALTER TABLE pokemon_abilities ADD FOREIGN KEY (poke_id) REFERENCES pokedex (id) ON DELETE CASCADE;
 ALTER TABLE pokemon_abilities ADD FOREIGN KEY (ability_id) REFERENCES abilities (id) ON DELETE CASCADE;
-CREATE INDEX gin_pd_type ON pokedex USING gin (type array_ops);
-CREATE INDEX gin_pd_info ON pokedex USING gin (to_tsvector('english', info));    
-CREATE INDEX gin_mv_info ON moves USING gin (to_tsvector('english', info));    
-CREATE INDEX gin_ab_info ON abilities USING gin (to_tsvector('english', info));    
+"""),
+    ('gin_pd_type', ['pokedex'], r"""
+CREATE INDEX IF NOT EXISTS gin_pd_type ON pokedex USING gin (type array_ops);
+"""),
+    ('gin_pd_info', ['pokedex'], r"""
+CREATE INDEX IF NOT EXISTS gin_pd_info ON pokedex USING gin (to_tsvector('english', info));
+"""),
+    ('gin_pd_search', ['pokedex'], r"""
+CREATE INDEX IF NOT EXISTS gin_pd_search ON pokedex USING gin (search);
+"""),
+    ('gin_mv_info', ['moves'], r"""
+CREATE INDEX IF NOT EXISTS gin_mv_info ON moves USING gin (to_tsvector('english', info));
+"""),
+    ('gin_mv_search', ['moves'], r"""
+CREATE INDEX IF NOT EXISTS gin_mv_search ON moves USING gin (search);
+"""),
+    ('gin_ab_info', ['abilities'], r"""
+CREATE INDEX IF NOT EXISTS gin_ab_info ON abilities USING gin (to_tsvector('english', info));
+"""),
+    ('gin_ab_search', ['abilities'], r"""
+CREATE INDEX IF NOT EXISTS gin_ab_search ON abilities USING gin (search);
+"""),
+]
+
+# Materialized serving views (read with the get_pokemon and get_team methods of TrainerPack in trainer.py): one row per
+# Pokemon with its abilities (with their text) and its moves (with their type names) aggregated as jsonb, and one row
+# per trainer with its limits and its team (each Pokemon with its types, ability and moves). A read is a single index
+# lookup instead of a join of pokedex, pokemon_abilities, abilities, pokemon_moves, moves and types. The views are
+# created empty (WITH NO DATA) along with the tables and filled by the serving stage. Their unique indexes let later
+# refreshes run with REFRESH MATERIALIZED VIEW CONCURRENTLY, so readers are never blocked.
+SERVING_VIEWS = ['pokemon_docs', 'trainer_teams']
+SERVING_SQL = r"""
+CREATE MATERIALIZED VIEW IF NOT EXISTS pokemon_docs AS
+SELECT p.id, p.name, p.height, p.weight, p.hp, p.attack, p.defense, p.s_attack, p.s_defense, p.speed, p.type,
+       p.evo_set, p.info, coalesce(a.abilities, '[]') as abilities, coalesce(m.moves, '[]') as moves
+FROM pokedex AS p
+LEFT JOIN (
+    SELECT pa.poke_id, jsonb_agg(jsonb_build_object('id', ab.id, 'name', ab.name, 'info', ab.info) ORDER BY ab.id)
+           as abilities
+    FROM pokemon_abilities AS pa JOIN abilities AS ab ON ab.id = pa.ability_id
+    GROUP BY pa.poke_id
+) AS a ON a.poke_id = p.id
+LEFT JOIN (
+    SELECT pm.poke_id, jsonb_agg(jsonb_build_object('id', mv.id, 'name', mv.name, 'type', ty.name, 'pp', mv.pp,
+                                                    'damage', mv.damage, 'accuracy', mv.accuracy) ORDER BY mv.id)
+           as moves
+    FROM pokemon_moves AS pm JOIN moves AS mv ON mv.id = pm.move_id LEFT JOIN types AS ty ON ty.id = mv.type
+    GROUP BY pm.poke_id
+) AS m ON m.poke_id = p.id
+WITH NO DATA;
+CREATE UNIQUE INDEX IF NOT EXISTS pokemon_docs_id ON pokemon_docs (id);
+CREATE UNIQUE INDEX IF NOT EXISTS pokemon_docs_name ON pokemon_docs (name);
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS trainer_teams AS
+SELECT o.id, o.name, o.max_pokemon, o.max_moves, o.pokemon_count, coalesce(t.team, '[]') as team
+FROM trainers AS o
+LEFT JOIN (
+    SELECT t.owner_id, jsonb_agg(jsonb_build_object(
+               'id', t.id, 'poke_id', t.poke_id, 'name', p.name, 'type', p.type,
+               'ability', CASE WHEN ab.id IS NOT NULL THEN jsonb_build_object('id', ab.id, 'name', ab.name) END,
+               'moves', coalesce(tm.moves, '[]')) ORDER BY t.id) as team
+    FROM trainer AS t JOIN pokedex AS p ON p.id = t.poke_id LEFT JOIN abilities AS ab ON ab.id = t.ability_id
+    LEFT JOIN (
+        SELECT tm.trainer_id, jsonb_agg(jsonb_build_object('id', mv.id, 'name', mv.name, 'type', ty.name)
+                                        ORDER BY mv.id) as moves
+        FROM trainer_moves AS tm JOIN moves AS mv ON mv.id = tm.move_id LEFT JOIN types AS ty ON ty.id = mv.type
+        GROUP BY tm.trainer_id
+    ) AS tm ON tm.trainer_id = t.id
+    GROUP BY t.owner_id
+) AS t ON t.owner_id = o.id
+WITH NO DATA;
+CREATE UNIQUE INDEX IF NOT EXISTS trainer_teams_id ON trainer_teams (id);
+CREATE UNIQUE INDEX IF NOT EXISTS trainer_teams_name ON trainer_teams (name);
 """
-cur.execute(sql)
-print(sql)
 
-conn.commit()
+
+@contextmanager
+def connection(schema=None):
+    """Open a PGSQL connection and cursor. Unqualified table names refer to the build schema (the staging schema in a
+    full build, public in refresh mode) unless a schema is passed. Commits (or rolls back on error) and closes the
+    connection on exit."""
+    schema = (STAGING_SCHEMA if not args.refresh else 'public') if schema is None else schema
+    conn = psycopg2.connect(host=secrets['host'], port=secrets['port'], database=secrets['database'],
+                            user=secrets['user'], password=secrets['pass'], connect_timeout=3,
+                            options='-c search_path=' + schema + ',public')
+    try:
+        with conn:
+            with conn.cursor() as cur:
+                yield cur
+    finally:
+        conn.close()
+
+
+def load_json(cur, table, id_texts):
+    """Copy (id, text) pages into a json table (js_<name>) along with the sha256 hash of each page. Pages are projected
+    to the fields the transforms read first (see projection.py) unless --keep-full-body is used.
+    In refresh mode only pages whose hash differs from the stored one are upserted, and their hashes are only
+    stored by the last stage (so the pages of a failed refresh are picked up again next time). -> list of loaded ids."""
+    stored = {}
+    if args.refresh:
+        cur.execute("SELECT id, hash FROM " + table + ";")
+        stored = dict(cur.fetchall())
+    loaded_ids = []
+    hashes = pending_hashes.setdefault(table, {})
+
+    def changed_rows():
+        for i, text in id_texts:
+            body = None
+            if not args.keep_full_body:
+                text, body = project_page(table, text)
+            digest = hashlib.sha256(text.encode('utf-8')).hexdigest()
+            if stored.get(i) != digest:
+                loaded_ids.append(i)
+                if parsed is not None:
+                    parsed.add(table, i, text, body)
+                if args.refresh:
+                    hashes[i] = digest
+                    digest = None
+                yield i, text, digest
+
+    if args.refresh:
+        cur.execute("CREATE TEMP TABLE tmp_" + table + " (LIKE " + table + ") ON COMMIT DROP;")
+        copy_rows(cur, 'tmp_' + table, changed_rows())
+        cur.execute("INSERT INTO " + table + " SELECT * FROM tmp_" + table + " ON CONFLICT (id) DO UPDATE "
+                    "SET body = EXCLUDED.body, hash = EXCLUDED.hash;")
+    else:
+        copy_rows(cur, table, changed_rows(), commit=True)
+    METRICS.inc('rows_loaded_total', len(loaded_ids), table=table)
+    METRICS.log("Loaded", len(loaded_ids), "rows into", table + ".")
+    return loaded_ids
+
+
+def refresh_ids(ids):
+    """Ids to re-derive in refresh mode (None means every row in a full build). -> sorted list or None."""
+    return sorted(ids) if args.refresh else None
+
+
+def discover_ids(id_texts, seen_moves, seen_abilities):
+    """Pass Pokemon pages through while sending each new move/ability id (not in the seen sets) to the move/ability
+    fetch stages."""
+    for i, text in id_texts:
+        for found, seen, ids in ((MOVE_ID.findall(text), seen_moves, move_ids),
+                                 (ABILITY_ID.findall(text), seen_abilities, ability_ids)):
+            for x in map(int, found):
+                if x not in seen:
+                    seen.add(x)
+                    ids.put(x)
+        yield i, text
+
+
+def list_ids(endpoint):
+    """Ids of every resource of a list endpoint. The first page gives the count, then the remaining pages are requested
+    together (pages are served from the response cache when fresh). -> sorted list (None if a page failed)."""
+    url_path = API_URL + endpoint + '/?limit=' + str(LIST_LIMIT) + '&offset='
+    failed = {}
+    pages = get_url(url_path, [0], cache=cache, failed=failed)
+    if failed or not pages:
+        return None
+    count = json.loads(pages[0][1])['count']
+    pages += get_url(url_path, list(range(LIST_LIMIT, count, LIST_LIMIT)), cache=cache, failed=failed)
+    if failed:
+        return None
+    return sorted({url_id(result['url']) for _, text in pages for result in json.loads(text)['results']})
+
+
+def discover_stage(endpoint):
+    """Create a stage that discovers the ids of a list endpoint (or falls back to ids [1:n] if it can't be fetched)."""
+    def stage():
+        ids = list_ids(endpoint)
+        if ids is None:
+            ids = list(range(1, FALLBACK_COUNTS[endpoint] + 1))
+            print("Warning: the", endpoint, "list could not be fetched, requesting ids 1 to", str(len(ids)) + ".")
+        discovered[endpoint] = ids
+        METRICS.log("Discovered", len(ids), endpoint, "ids.")
+    return stage
+
+
+def pokemon_ids():
+    """Ids of the Pokemon (and species) to fetch, the discovered species ids selected by NUM_OF_POKE. -> list."""
+    ids = discovered['pokemon-species']
+    if NUM_OF_POKE is None:
+        return ids
+    if isinstance(NUM_OF_POKE, int):
+        return [i for i in ids if i <= NUM_OF_POKE]
+    return list(NUM_OF_POKE)
+
+
+def pending_ids(cur, table, index):
+    """Ids of a json table still to fetch. Resume mode skips the pages already loaded and the 404 pages of an
+    earlier run. -> index for get_url."""
+    if not args.resume:
+        return index
+    cur.execute("SELECT id FROM " + table + " UNION SELECT id FROM fetch_failures WHERE tbl = %s AND status = '404';",
+                (table,))
+    done = {x[0] for x in cur.fetchall()}
+    if index is None:
+        return [] if 1 in done else None
+    if isinstance(index, int):
+        index = range(1, index + 1)
+    if hasattr(index, '__len__'):
+        return [i for i in index if i not in done]
+    return (i for i in index if i not in done)
+
+
+def record_failures(cur, table, failed):
+    """Record the pages of a json table that could not be fetched (a full build keeps them in fetch_failures).
+    Raises an error (after committing the loaded pages) if any failed for another reason than a 404 or a missing
+    cached page in offline mode, so the build stops before the swap and can be continued with --resume."""
+    if not args.refresh:
+        cur.execute("DELETE FROM fetch_failures WHERE tbl = %s AND id = ANY(%s);", (table, loaded[table]))
+        rows = [(table, i, str(status)) for i, status in failed.items() if status != 'offline']
+        if rows:
+            execute_values(cur, "INSERT INTO fetch_failures (tbl, id, status) VALUES %s "
+                                "ON CONFLICT (tbl, id) DO UPDATE SET status = EXCLUDED.status;", rows)
+    errors = sorted(i for i, status in failed.items() if status not in (404, 'offline'))
+    if failed:
+        METRICS.log(len(failed), "pages of", table, "could not be fetched.")
+    if errors:
+        cur.connection.commit()
+        raise RuntimeError(str(len(errors)) + " pages of " + table + " failed (ids " + str(errors[:10])[1:-1] +
+                           (", ..." if len(errors) > 10 else "") + "). Run again with --resume to fetch them.")
+
+
+def fetch_pages(cur, table, url_path, index, pages=None):
+    """Stream the pending pages from get_url into a json table and record the failed ids. Pass a function as pages
+    to pass the (id, text) pages through on their way to the table. Pass a function as index to get the ids when the
+    stage starts."""
+    index = index() if callable(index) else index
+    failed = {}
+    id_texts = get_url(url_path, pending_ids(cur, table, index), cache=cache, stream=True, failed=failed)
+    loaded[table] = load_json(cur, table, id_texts if pages is None else pages(id_texts))
+    if loaded[table]:
+        changed.add(table)
+    record_failures(cur, table, failed)
+
+
+def fetch_stage(table, url_path, index):
+    """Create a stage that streams pages from get_url into a json table on its own connection."""
+    def stage():
+        with connection() as cur:
+            fetch_pages(cur, table, url_path, index)
+    return stage
+
+
+def fetch_pokemon():
+    """Stream the Pokemon pages into js_pokemon and pass the move/ability ids on as they are found
+    (in resume mode the ids in the pages loaded by an earlier run are passed on first)."""
+    seen = (set(), set())
+    try:
+        with connection() as cur:
+            if args.resume:
+                cur.execute("SELECT id, body::text FROM js_pokemon;")
+                for _ in discover_ids(cur.fetchall(), *seen):
+                    pass
+            fetch_pages(cur, 'js_pokemon', API_URL + 'pokemon/', pokemon_ids,
+                        pages=lambda id_texts: discover_ids(id_texts, *seen))
+    finally:
+        end_id_queues()
+
+
+def end_id_queues():
+    """End the move and ability id queues, so the stages fetching them finish with the ids passed on so far
+    (also called when the pipeline aborts, as js_pokemon may never start)."""
+    move_ids.put(None)
+    ability_ids.put(None)
+
+
+def fetch_type_damage():
+    """Stream the page of each type in the type list (js_types) into js_type_damage."""
+    with connection() as cur:
+        cur.execute(TYPE_IDS_SQL)
+        ids = [x[0] for x in cur.fetchall()]
+        fetch_pages(cur, 'js_type_damage', API_URL + 'type/', ids)
+
+
+def pokedex_ids(cur):
+    """Pokedex rows to re-derive in refresh mode: changed pokemon/species and members of changed evolution chains."""
+    if not args.refresh:
+        return None
+    cur.execute("SELECT id FROM pokedex WHERE evo_set = ANY(%s);", (loaded['js_evo'],))
+    return refresh_ids(set(loaded['js_pokemon']) | set(loaded['js_species']) | {x[0] for x in cur.fetchall()})
+
+
+def inserted(target, count):
+    """Record and log the number of rows inserted (or updated) into target."""
+    METRICS.inc('rows_inserted_total', count, table=target)
+    METRICS.log("Inserted", count, "rows into", target + ".")
+
+
+def run_shards(name, statements):
+    """Run the transform statements of a stage split by id range (the ids of its SHARD_TABLES table) across
+    --transform-workers connections, each shard in its own transaction. Once every shard has finished they commit one
+    after another (this is not a two-phase commit), or all of them roll back if a shard fails. The first shard records
+    the finished stage and commits last, so if any other commit fails it rolls back and the stage stays unfinished: the
+    shards already committed are in the staging tables only, and --resume runs the stage again over them (every
+    transform is an ON CONFLICT upsert). -> dictionary of target and row count."""
+    with connection() as cur:
+        cur.execute("SELECT id FROM " + SHARD_TABLES[name] + " ORDER BY id;")
+        ids = [x[0] for x in cur.fetchall()]
+    size = max(1, -(-len(ids) // args.transform_workers))
+    shards = [ids[n:n + size] for n in range(0, len(ids), size)] or [[]]
+
+    def run(cur, shard):
+        counts = {}
+        for target, sql in statements:
+            cur.execute(sql, {'ids': shard})
+            counts[target] = cur.rowcount
+        return counts
+
+    # The connections are committed in reverse order of opening as the stack unwinds, so curs[0] commits last.
+    with ExitStack() as stack:
+        curs = [stack.enter_context(connection()) for _ in shards]
+        with ThreadPoolExecutor(len(shards)) as pool:
+            results = list(pool.map(run, curs, shards))
+        mark_finished(curs[0], name)
+    METRICS.log("Stage", name, "ran in", len(shards), "shards.")
+    return {target: sum(counts[target] for counts in results) for target, _ in statements}
+
+
+def sharded(name):
+    """Check if a stage is split into shards (--transform-workers in a full build with the SQL transforms). -> bool."""
+    return args.transform_workers > 1 and name in SHARD_TABLES
+
+
+def transform_stage(target, sql, table=None, ids=None):
+    """Create a stage that runs a transform statement (or the Python transform) into the target table on its own
+    connection (or split into shards, see run_shards). In refresh mode the statement is filtered to the ids loaded into
+    table, or to the ids returned by the ids function (called with the cursor)."""
+    def stage():
+        if sharded(target):
+            inserted(target, run_shards(target, [(target, sql)])[target])
+            return
+        with connection() as cur:
+            if ids is not None:
+                params = {'ids': ids(cur)}
+            else:
+                params = {'ids': None if table is None else refresh_ids(loaded[table])}
+            if parsed is not None:
+                inserted(target, TRANSFORMS[target](cur, parsed, params['ids']))
+            else:
+                cur.execute(sql, params)
+                inserted(target, cur.rowcount)
+            mark_finished(cur, target)
+    return stage
+
+
+def link_pokemon():
+    """Insert (or replace in refresh mode) the pokemon_moves/pokemon_abilities rows of the loaded Pokemon."""
+    if sharded('pokemon_links'):
+        for target, count in run_shards('pokemon_links', LINK_SQL).items():
+            inserted(target, count)
+        return
+    with connection() as cur:
+        if args.refresh:
+            cur.execute(UNLINK_SQL, {'ids': loaded['js_pokemon']})
+        if parsed is not None:
+            for target, count in transform_links(cur, parsed, refresh_ids(loaded['js_pokemon'])).items():
+                inserted(target, count)
+        else:
+            for target, sql in LINK_SQL:
+                cur.execute(sql, {'ids': refresh_ids(loaded['js_pokemon'])})
+                inserted(target, cur.rowcount)
+        mark_finished(cur, 'pokemon_links')
+
+
+def link_evolutions():
+    """Insert (or replace in refresh mode) the evolution graph of the loaded evolution chains."""
+    with connection() as cur:
+        ids = refresh_ids(loaded['js_evo'])
+        if args.refresh:
+            cur.execute(UNLINK_EVO_SQL, {'ids': ids})
+        if parsed is not None:
+            for target, count in transform_evolutions(cur, parsed, ids).items():
+                inserted(target, count)
+        else:
+            cur.execute(EVO_NODES_SQL, {'ids': ids})
+            for target, sql in EVO_SQL:
+                cur.execute(sql)
+                inserted(target, cur.rowcount)
+        mark_finished(cur, 'evolutions')
+
+
+def index_stage(name, sql):
+    """Create a stage that adds foreign keys or builds an index on its own connection."""
+    def stage():
+        with connection() as cur:
+            cur.execute(sql)
+            mark_finished(cur, name)
+    return stage
+
+
+def refresh_views():
+    """Fill the serving views once the tables they read are loaded. A full build (nobody reads the staging schema) and a
+    view that was never filled get a plain refresh. In refresh mode a filled view is refreshed concurrently (readers
+    keep the old rows until it commits), and only if the refresh changed any page."""
+    with connection() as cur:
+        cur.execute("SELECT matviewname, ispopulated FROM pg_matviews "
+                    "WHERE schemaname = current_schema() AND matviewname = ANY(%s);", (SERVING_VIEWS,))
+        populated = dict(cur.fetchall())
+        for view in SERVING_VIEWS:
+            if not args.refresh or not populated[view]:
+                cur.execute("REFRESH MATERIALIZED VIEW " + view + ";")
+            elif any(pending_hashes.values()):
+                cur.execute("REFRESH MATERIALIZED VIEW CONCURRENTLY " + view + ";")
+            else:
+                continue
+            METRICS.log("Refreshed the", view, "view.")
+        mark_finished(cur, 'serving')
+
+
+def mark_finished(cur, name):
+    """Record a finished stage of a full build in build_stages (in the same transaction as the stage's work)."""
+    if not args.refresh:
+        cur.execute("INSERT INTO build_stages (stage) VALUES (%s) "
+                    "ON CONFLICT (stage) DO UPDATE SET finished_at = now();", (name,))
+
+
+def checkpoint(name, func, deps=()):
+    """Create a stage that calls func unless an earlier run of an interrupted build finished it and none of the stages
+    in deps changed their tables in this run (resume mode)."""
+    def stage():
+        if name in finished and not changed.intersection(deps):
+            METRICS.log("Stage", name, "was already finished by an earlier run.")
+            return
+        func()
+        changed.add(name)
+    return stage
+
+
+def swap_tables():
+    """Move the live tables (and serving views) out of public and the staging ones into public in one transaction,
+    then drop the old tables and the staging schema (with the checkpoint tables). The build version is written before
+    the swap."""
+    with connection() as cur:
+        cur.execute(BUILD_INFO_SQL, {'version': BUILD_VERSION, 'mode': 'full'})
+        for table in TABLES + SERVING_VIEWS:
+            cur.execute("ANALYZE " + table + ";")
+    with connection('public') as cur:
+        cur.execute("DROP SCHEMA IF EXISTS " + OLD_SCHEMA + " CASCADE; CREATE SCHEMA " + OLD_SCHEMA + ";")
+        cur.execute("SELECT tablename FROM pg_tables WHERE schemaname = 'public' AND tablename = ANY(%s);", (TABLES,))
+        for (table,) in cur.fetchall():
+            cur.execute("ALTER TABLE public." + table + " SET SCHEMA " + OLD_SCHEMA + ";")
+        cur.execute("SELECT matviewname FROM pg_matviews WHERE schemaname = 'public' AND matviewname = ANY(%s);",
+                    (SERVING_VIEWS,))
+        for (view,) in cur.fetchall():
+            cur.execute("ALTER MATERIALIZED VIEW public." + view + " SET SCHEMA " + OLD_SCHEMA + ";")
+        for table in TABLES:
+            cur.execute("ALTER TABLE " + STAGING_SCHEMA + "." + table + " SET SCHEMA public;")
+        for view in SERVING_VIEWS:
+            cur.execute("ALTER MATERIALIZED VIEW " + STAGING_SCHEMA + "." + view + " SET SCHEMA public;")
+    METRICS.log("Swapped the", STAGING_SCHEMA, "tables into public.")
+    with connection('public') as cur:
+        cur.execute("DROP SCHEMA " + OLD_SCHEMA + " CASCADE; DROP SCHEMA " + STAGING_SCHEMA + " CASCADE;")
+
+
+def store_hashes():
+    """Store the hashes of the pages upserted by a refresh once every transform and the serving views have finished
+    (and a new build version if anything changed). A refresh commits stage by stage, so this is the last stage: the
+    pages of a refresh that failed before it still have their old hashes, and running the refresh again applies them."""
+    with connection() as cur:
+        for table, hashes in pending_hashes.items():
+            if hashes:
+                execute_values(cur, "UPDATE " + table + " AS js SET hash = v.hash FROM (VALUES %s) AS v (id, hash) "
+                                    "WHERE js.id = v.id;", list(hashes.items()))
+        if any(pending_hashes.values()):
+            cur.execute(BUILD_INFO_SQL, {'version': BUILD_VERSION, 'mode': 'refresh'})
+
+
+# Create a fresh staging schema for a full build, or keep the one of an interrupted build in resume mode (refresh mode
+# keeps every table in public and the trainer data, and only upserts what changed), then create any missing tables.
+if not args.refresh:
+    with connection('public') as cur:
+        METRICS.log("Connection opened to PGSQL database.")
+        cur.execute("SELECT EXISTS (SELECT 1 FROM pg_namespace WHERE nspname = %s);", (STAGING_SCHEMA,))
+        if args.resume and cur.fetchone()[0]:
+            METRICS.log("Resuming the interrupted build in", STAGING_SCHEMA + ".")
+        else:
+            if args.resume:
+                METRICS.log("There is no interrupted build to resume, starting a new build.")
+            cur.execute("DROP SCHEMA IF EXISTS " + STAGING_SCHEMA + " CASCADE; CREATE SCHEMA " + STAGING_SCHEMA + ";")
+    with connection() as cur:
+        cur.execute(CHECKPOINT_SQL)
+        cur.execute("SELECT stage FROM build_stages;")
+        finished.update(x[0] for x in cur.fetchall())
+with connection() as cur:
+    cur.execute(CREATE_SQL)
+    cur.execute(TRAINER_SQL)
+    cur.execute(SERVING_SQL)
+
+# Discovery stages read the Pokemon species and evolution chain ids from the list endpoints, so only existing pages
+# are requested (e.g. there is no evolution chain 210) and new Pokemon are picked up without code changes.
+# Fetch stages stream json data from pokeapi into the json tables (js_<name>).
+pipeline = Pipeline()
+pipeline.add('ids_species', discover_stage('pokemon-species'))
+pipeline.add('ids_evo', discover_stage('evolution-chain'))
+pipeline.add('js_pokemon', fetch_pokemon, ['ids_species'])
+pipeline.add('js_species', fetch_stage('js_species', API_URL + 'pokemon-species/', pokemon_ids), ['ids_species'])
+pipeline.add('js_types', fetch_stage('js_types', API_URL + 'type/', None))
+pipeline.add('js_type_damage', fetch_type_damage, ['js_types'])
+pipeline.add('js_evo', fetch_stage('js_evo', API_URL + 'evolution-chain/', lambda: discovered['evolution-chain']),
+             ['ids_evo'])
+pipeline.add('js_moves', fetch_stage('js_moves', API_URL + 'move/', iter(move_ids.get, None)))
+pipeline.add('js_abilities', fetch_stage('js_abilities', API_URL + 'ability/', iter(ability_ids.get, None)))
+pipeline.on_abort(end_id_queues)
+
+# Transform stages parse the json tables into the final tables as soon as their inputs are loaded.
+# In resume mode a stage finished by the interrupted build only runs again if one of its inputs changed.
+transforms = [('pokedex', transform_stage('pokedex', POKEDEX_SQL, ids=pokedex_ids),
+               ['js_pokemon', 'js_species', 'js_evo']),
+              ('types', transform_stage('types', TYPES_SQL), ['js_types']),
+              ('type_efficacy', transform_stage('type_efficacy', TYPE_EFFICACY_SQL), ['js_type_damage', 'types']),
+              ('moves', transform_stage('moves', MOVES_SQL, 'js_moves'), ['js_moves', 'types']),
+              ('abilities', transform_stage('abilities', ABILITIES_SQL, 'js_abilities'), ['js_abilities']),
+              ('pokemon_links', link_pokemon, ['js_pokemon', 'pokedex', 'moves', 'abilities']),
+              ('evolutions', link_evolutions, ['js_evo'])]
+for name, func, deps in transforms:
+    pipeline.add(name, checkpoint(name, func, deps), deps)
+if args.refresh:
+    pipeline.add('serving', refresh_views, ['pokedex', 'types', 'type_efficacy', 'moves', 'abilities', 'pokemon_links',
+                                            'evolutions'])
+    pipeline.add('hashes', store_hashes, ['serving'])
+    for name, deps, sql in INDEX_STAGES:
+        if name.startswith('gin_'):
+            pipeline.add(name, index_stage(name, sql), deps)
+else:
+    for name, deps, sql in INDEX_STAGES:
+        pipeline.add(name, checkpoint(name, index_stage(name, sql)), deps)
+    serving_deps = ['pokedex', 'types', 'moves', 'abilities', 'pokemon_links']
+    pipeline.add('serving', checkpoint('serving', refresh_views, serving_deps), serving_deps)
+    pipeline.add('swap', swap_tables, ['pokedex', 'types', 'type_efficacy', 'moves', 'abilities', 'pokemon_links',
+                                       'evolutions', 'serving'] +
+                 [name for name, _, _ in INDEX_STAGES])
+
+# Run the pipeline and write the metrics of the run (also when a stage fails).
+start = time.perf_counter()
+try:
+    pipeline.run()
+finally:
+    METRICS.set('build_seconds', round(time.perf_counter() - start, 6), mode='refresh' if args.refresh else 'full')
+    if args.metrics:
+        METRICS.write(args.metrics, args.metrics_format)
 
 # The json tables used to dump the data into are no longer required but are not dropped by default.
 # To drop the json tables created in this program simply uncomment the lines of code below by deleting the "# " portion.
 
-# sql = r"""
-# DROP TABLE IF EXISTS js_pokemon;
-# DROP TABLE IF EXISTS js_species;
-# DROP TABLE IF EXISTS js_types;
-# DROP TABLE IF EXISTS js_evo;
-# DROP TABLE IF EXISTS js_moves;
-# DROP TABLE IF EXISTS js_abilities;
-# """
-# cur.execute(sql)
-# print(sql)
-#
-# conn.commit()
-
-cur.close()
-conn.close()
-print("Connection closed to PGSQL database.")
+# with connection() as cur:
+#     sql = r"""
+#     DROP TABLE IF EXISTS js_pokemon;
+#     DROP TABLE IF EXISTS js_species;
+#     DROP TABLE IF EXISTS js_types;
+#     DROP TABLE IF EXISTS js_type_damage;
+#     DROP TABLE IF EXISTS js_evo;
+#     DROP TABLE IF EXISTS js_moves;
+#     DROP TABLE IF EXISTS js_abilities;
+#     """
+#     cur.execute(sql)
+#     print(sql)
+
+METRICS.log("Connection closed to PGSQL database.")
@@ -9,22 +9,34 @@ conn = psycopg2.connect(host=secrets['host'], port=secrets['port'], database=sec
                         user=secrets['user'], password=secrets['pass'], connect_timeout=3)
 cur = conn.cursor()
 
-# Drop all tables created in create_db.py
+# Drop all tables (and serving views, staging schemas and trainer trigger functions) created in create_db.py
 sql = r"""
+DROP MATERIALIZED VIEW IF EXISTS pokemon_docs;
+DROP MATERIALIZED VIEW IF EXISTS trainer_teams;
 DROP TABLE IF EXISTS js_pokemon;
 DROP TABLE IF EXISTS js_species;
 DROP TABLE IF EXISTS js_types;
+DROP TABLE IF EXISTS js_type_damage;
 DROP TABLE IF EXISTS js_evo;
 DROP TABLE IF EXISTS js_moves;
 DROP TABLE IF EXISTS js_abilities;
 DROP TABLE IF EXISTS pokedex CASCADE;
 DROP TABLE IF EXISTS types CASCADE;
+DROP TABLE IF EXISTS type_efficacy;
 DROP TABLE IF EXISTS pokemon_moves;
 DROP TABLE IF EXISTS pokemon_abilities;
 DROP TABLE IF EXISTS moves CASCADE;
 DROP TABLE IF EXISTS abilities CASCADE;
 DROP TABLE IF EXISTS trainer CASCADE;
 DROP TABLE IF EXISTS trainer_moves;
+DROP TABLE IF EXISTS trainers CASCADE;
+DROP FUNCTION IF EXISTS trainer_pokemon_count, trainer_move_count, trainers_max_moves CASCADE;
+DROP TABLE IF EXISTS build_info;
+DROP TABLE IF EXISTS evo_species;
+DROP TABLE IF EXISTS evo_edges;
+DROP TABLE IF EXISTS evo_closure;
+DROP SCHEMA IF EXISTS pokemon_build CASCADE;
+DROP SCHEMA IF EXISTS pokemon_old CASCADE;
 """
 cur.execute(sql)
 print(sql)
@@ -0,0 +1,68 @@
+# evolution.py creates the query helper of the evolution graph tables built by create_db.py (evo_species, evo_edges
+# and evo_closure). The closure table holds every (ancestor, descendant) pair of each evolution chain with its depth,
+# branch and path, so ancestors, descendants, stages and families are single indexed lookups instead of repeated
+# self-joins or JSON parsing, whatever the depth of the chain.
+# Species are passed by id or by name, and results come back as pandas dataframes built by select_frame (trainer.py).
+from trainer import select_frame
+
+
+class EvolutionGraph:
+    """Handles postgres connection (from PGSQLConnection or PGSQLPool) using with statements
+    to query the evolution graph of the Pokemon database from create_db.py."""
+    def __init__(self, pgsql_connection):
+        """Pass PGSQLConnection (or PGSQLPool) object."""
+        self.pgsql_connection = pgsql_connection
+
+    @staticmethod
+    def species_filter(column, species):
+        """SQL condition matching column to a species id (int) or name (str). -> (sql, params)."""
+        if isinstance(species, str):
+            return column + " = (SELECT id FROM evo_species WHERE name = %s)", (species,)
+        return column + " = %s", (species,)
+
+    def select(self, sql, params):
+        """Run a select statement. -> pd dataframe."""
+        with self.pgsql_connection as conn_cur:
+            conn_cur[1].execute(sql, params)
+            data = select_frame(conn_cur[1].fetchall(), conn_cur[1].description)
+        return data
+
+    def descendants(self, species, max_depth=None):
+        """Get every species a species evolves into (at any depth, or up to max_depth), with the depth, the branch (the
+        direct evolution the path goes through) and the path of species ids. -> pd dataframe."""
+        condition, params = self.species_filter('c.ancestor_id', species)
+        sql = ("SELECT s.id, s.name, s.stage, c.depth, c.branch, c.path FROM evo_closure AS c "
+               "JOIN evo_species AS s ON s.id = c.descendant_id "
+               "WHERE " + condition + " AND c.depth > 0 AND (%s::int IS NULL OR c.depth <= %s) "
+               "ORDER BY c.depth, c.path;")
+        return self.select(sql, params + (max_depth, max_depth))
+
+    def ancestors(self, species):
+        """Get every species that evolves into a species, nearest first, with the depth and path. -> pd dataframe."""
+        condition, params = self.species_filter('c.descendant_id', species)
+        sql = ("SELECT s.id, s.name, s.stage, c.depth, c.path FROM evo_closure AS c "
+               "JOIN evo_species AS s ON s.id = c.ancestor_id "
+               "WHERE " + condition + " AND c.depth > 0 ORDER BY c.depth;")
+        return self.select(sql, params)
+
+    def family(self, species):
+        """Get every species of the evolution chain of a species with its stage and parent. -> pd dataframe."""
+        condition, params = self.species_filter('id', species)
+        sql = ("SELECT s.id, s.name, s.stage, e.parent_id, s.chain_id FROM evo_species AS s "
+               "LEFT JOIN evo_edges AS e ON e.child_id = s.id "
+               "WHERE s.chain_id = (SELECT chain_id FROM evo_species WHERE " + condition + ") "
+               "ORDER BY s.stage, s.id;")
+        return self.select(sql, params)
+
+    def stage(self, species):
+        """Get the stage of a species in its evolution chain (1 for the first stage). -> int or None."""
+        condition, params = self.species_filter('id', species)
+        data = self.select("SELECT stage FROM evo_species WHERE " + condition + ";", params)
+        return None if data.empty else int(data['stage'].iloc[0])
+
+    def evolves_into(self, species, other):
+        """Check if species evolves into other (at any depth). -> bool."""
+        ancestor, params = self.species_filter('ancestor_id', species)
+        descendant, other_params = self.species_filter('descendant_id', other)
+        sql = "SELECT EXISTS (SELECT 1 FROM evo_closure WHERE " + ancestor + " AND " + descendant + " AND depth > 0);"
+        return bool(self.select(sql, params + other_params).iloc[0, 0])
@@ -0,0 +1,189 @@
+# fetch_engine.py creates the asyncio engine used by get_url to request pages from the API.
+# All requests of a fetch_all call share one aiohttp session, so connections are kept alive and reused.
+# Each host gets an adaptive concurrency limit (additive increase on success, halved on 429/5xx responses)
+# and a token bucket request budget (requests per second). Requests failing with a 429, a 5xx or a connection
+# error are retried a bounded number of times with jittered exponential backoff, honoring Retry-After when sent.
+# The (id, url) pairs can be any iterable, including one that blocks while waiting for ids that are still being
+# discovered (it is read in an executor thread), and every page is passed to the emit coroutine as it arrives.
+# Request counts, latencies, bytes downloaded, retries and errors are recorded in METRICS (metrics.py) per host,
+# and only retries and offline misses (unless quiet) and failed requests are printed.
+import asyncio
+import random
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+import aiohttp
+from metrics import METRICS
+from url_cache import URLCache
+
+
+# Default engine settings.
+START_CONCURRENCY = 16
+MAX_CONCURRENCY = 128
+HOST_RATE = 100
+HOST_BURST = 100
+MAX_RETRIES = 5
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 30
+TIMEOUT = 30
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class HostLimiter:
+    """Adaptive concurrency limit (AIMD) and token bucket request budget for a single host."""
+    def __init__(self, start=START_CONCURRENCY, max_limit=MAX_CONCURRENCY, rate=HOST_RATE, burst=HOST_BURST):
+        """Initialize the concurrency limit and a full token bucket."""
+        self.limit = float(start)
+        self.max_limit = max_limit
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.active = 0
+        self.stamp = None
+        self.resume_at = 0.0
+        self.last_cut = 0.0
+        self.cond = asyncio.Condition()
+
+    async def acquire(self):
+        """Wait for a free concurrency slot, the end of any Retry-After pause, and a token from the budget."""
+        loop = asyncio.get_running_loop()
+        async with self.cond:
+            await self.cond.wait_for(lambda: self.active < int(self.limit))
+            self.active += 1
+        while True:
+            now = loop.time()
+            if self.stamp is not None:
+                self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+            self.stamp = now
+            pause = self.resume_at - now
+            if pause <= 0 and self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep(max(pause, (1 - self.tokens) / self.rate))
+
+    async def release(self):
+        """Free a concurrency slot."""
+        async with self.cond:
+            self.active -= 1
+            self.cond.notify_all()
+
+    def success(self):
+        """Additive increase: the limit grows by about one for every limit-many successful requests."""
+        self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+    def throttled(self, retry_after=None):
+        """Multiplicative decrease (at most once per second) and pause the host for retry_after seconds."""
+        now = asyncio.get_running_loop().time()
+        if now - self.last_cut > 1:
+            self.limit = max(1.0, self.limit / 2)
+            self.last_cut = now
+        if retry_after:
+            self.resume_at = max(self.resume_at, now + retry_after)
+
+
+def retry_after_seconds(value):
+    """Parse a Retry-After header given as seconds or as an HTTP date. -> float or None."""
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max((parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+async def fetch_page(session, limiter, i, url, cache, emit, max_retries):
+    """Get one page (from the cache when fresh) and await emit(i, text). -> None or failure status."""
+    host = urlsplit(url).netloc
+    entry = None if cache is None else cache.lookup(url)
+    if entry is not None and cache.is_fresh(entry):
+        METRICS.inc('fetch_requests_total', host=host, result='cache_hit')
+        await emit(i, cache.read(url, entry))
+        return None
+    if cache is not None and cache.offline:
+        METRICS.inc('fetch_requests_total', host=host, result='offline_miss')
+        METRICS.log({'id': i, 'status': 'offline', 'error': 'page not in cache', 'url': url})
+        return 'offline'
+
+    headers = URLCache.conditional_headers(entry)
+    for attempt in range(max_retries + 1):
+        await limiter.acquire()
+        start = time.perf_counter()
+        try:
+            async with session.get(url, headers=headers) as response:
+                status = response.status
+                body = await response.read()
+                text = body.decode(response.get_encoding(), errors='replace')
+                response_headers = response.headers
+            METRICS.inc('fetch_bytes_total', len(body), host=host)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            status, text, response_headers = None, repr(e), {}
+        finally:
+            await limiter.release()
+        METRICS.observe('fetch_request_seconds', time.perf_counter() - start, host=host)
+
+        if status == 200:
+            limiter.success()
+            METRICS.inc('fetch_requests_total', host=host, result='ok')
+            if cache is not None:
+                cache.store(url, text, response_headers)
+            await emit(i, text)
+            return None
+        if status == 304 and entry is not None:
+            limiter.success()
+            METRICS.inc('fetch_requests_total', host=host, result='revalidated')
+            await emit(i, cache.revalidated(url, response_headers))
+            return None
+        if status is not None and status not in RETRY_STATUS:
+            break
+
+        retry_after = retry_after_seconds(response_headers.get('Retry-After'))
+        limiter.throttled(retry_after)
+        if attempt < max_retries:
+            delay = retry_after or random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+            METRICS.inc('fetch_retries_total', host=host, status=str(status))
+            METRICS.log({'id': i, 'status': status, 'retry': attempt + 1, 'delay': round(delay, 2), 'url': url})
+            await asyncio.sleep(delay)
+
+    METRICS.inc('fetch_requests_total', host=host, result='error')
+    METRICS.inc('fetch_errors_total', host=host, status=str(status))
+    print({'id': i, 'status': status, 'error': text, 'url': url})
+    return status
+
+
+async def fetch_all(id_urls, emit, cache=None, limiters=None, start_concurrency=START_CONCURRENCY,
+                    max_concurrency=MAX_CONCURRENCY, host_rate=HOST_RATE, max_retries=MAX_RETRIES):
+    """Get every (id, url) page concurrently and await emit(id, text) as each one arrives. Pass a dictionary as
+    limiters to share the per-host limits between calls on the same event loop.
+    -> dictionary of failed ids and their last status."""
+    limiters = {} if limiters is None else limiters
+    loop = asyncio.get_running_loop()
+    items = iter(id_urls)
+    end = object()
+
+    connector = aiohttp.TCPConnector(limit=max_concurrency, ttl_dns_cache=300)
+    timeout = aiohttp.ClientTimeout(total=TIMEOUT)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        ids = []
+        tasks = []
+        while True:
+            if isinstance(id_urls, (list, tuple)):
+                item = next(items, end)
+            else:
+                item = await loop.run_in_executor(None, next, items, end)
+            if item is end:
+                break
+            i, url = item
+            host = urlsplit(url).netloc
+            if host not in limiters:
+                limiters[host] = HostLimiter(start=start_concurrency, max_limit=max_concurrency,
+                                             rate=host_rate, burst=host_rate)
+            ids.append(i)
+            tasks.append(asyncio.ensure_future(fetch_page(session, limiters[host], i, url, cache, emit, max_retries)))
+        statuses = await asyncio.gather(*tasks)
+
+    return {i: status for i, status in zip(ids, statuses) if status is not None}
@@ -1,31 +1,37 @@
 # get_url.py creates function to get data async
 # Pass url_path without index (page number).
 # Add index as number to get that many pages, a +int list to get specific pages,
-# or none when no pages are needed.
-from concurrent.futures import as_completed
-from requests_futures.sessions import FuturesSession
-from pprint import pprint
+# or none when no pages are needed. The index can also be an iterator that is still producing ids
+# (e.g. iter(queue.get, None)), in which case pages are requested as the ids arrive.
+# Pass a URLCache object (url_cache.py) as cache to serve and revalidate pages from the on-disk cache.
+# Requests are made by the asyncio engine in fetch_engine.py (retries, backoff and adaptive concurrency).
+# Every call (from any thread) runs on one shared background event loop, so the per-host limits are shared too.
+# Use stream=True to get a generator that yields each (id, text) while the remaining pages are still downloading.
+# Pass a dictionary as failed to get the ids of the pages that could not be fetched and their last status
+# (filled in once every page has been requested).
+# Set ENGINE_SETTINGS to change the fetch_all settings (e.g. host_rate) of every call.
+import asyncio
+import queue
+import threading
+from fetch_engine import fetch_all
 
 
-def get_url(url_path, index=None):
-    futures = []
-    id_texts = []
+# Max number of downloaded pages waiting to be consumed from a stream (the download pauses when full).
+STREAM_QUEUE_SIZE = 200
 
+# Per-host limiters shared by every call on the engine loop.
+HOST_LIMITERS = {}
+
+# Keyword arguments of fetch_all (engine settings, e.g. host_rate) used by every call.
+ENGINE_SETTINGS = {}
+
+_engine_loop = None
+_engine_lock = threading.Lock()
+
+
+def get_url(url_path, index=None, cache=None, stream=False, failed=None):
     if index is None:
-        with FuturesSession(max_workers=1) as session:
-            url = url_path
-            future = session.get(url)
-            future.i = 1
-            future.geturl = url
-            futures.append(future)
-
-            for future in as_completed(futures):
-                response = future.result()
-                if response.status_code == 200:
-                    pprint({'id': future.i, 'url': future.geturl})
-                    id_texts.append((future.i, response.text))
-                else:
-                    pprint({'id': future.i, 'status': response.status_code, 'error': response.text, 'url': future.geturl})
+        id_urls = [(1, url_path)]
     else:
         try:
             _ = int(index)
@@ -33,21 +39,58 @@ def get_url(url_path, index=None):
             iterable = index
         else:
             iterable = range(1, index + 1)
+        if hasattr(iterable, '__len__'):
+            id_urls = [(i, url_path + str(i)) for i in iterable]
+        else:
+            id_urls = ((i, url_path + str(i)) for i in iterable)
+
+    id_texts = stream_urls(id_urls, cache, failed)
+    return id_texts if stream else list(id_texts)
+
+
+def engine_loop():
+    """Start (once) the background event loop shared by every get_url call. -> event loop."""
+    global _engine_loop
+    with _engine_lock:
+        if _engine_loop is None:
+            _engine_loop = asyncio.new_event_loop()
+            threading.Thread(target=_engine_loop.run_forever, daemon=True).start()
+    return _engine_loop
+
+
+def stream_urls(id_urls, cache=None, failed=None):
+    """Run fetch_all on the engine loop and yield (id, text) tuples as they arrive. Failed ids are added to the
+    failed dictionary (if passed) before the last tuple is yielded."""
+    loop = engine_loop()
+    results = queue.Queue()
+    slots = asyncio.Semaphore(STREAM_QUEUE_SIZE)
+    done = object()
+
+    async def emit(i, text):
+        await slots.acquire()
+        results.put((i, text))
+
+    async def run():
+        try:
+            failures = await fetch_all(id_urls, emit, cache=cache, limiters=HOST_LIMITERS, **ENGINE_SETTINGS)
+            if failed is not None:
+                failed.update(failures)
+            if cache is not None:
+                cache.save()
+        except BaseException as e:
+            results.put(e)
+        finally:
+            results.put(done)
 
-        with FuturesSession(max_workers=50) as session:
-            for i in iterable:
-                url = url_path + str(i)
-                future = session.get(url)
-                future.i = i
-                future.geturl = url
-                futures.append(future)
-
-            for future in as_completed(futures):
-                response = future.result()
-                if response.status_code == 200:
-                    pprint({'id': future.i, 'url': future.geturl})
-                    id_texts.append((future.i, response.text))
-                else:
-                    pprint({'id': future.i, 'status': response.status_code, 'error': response.text, 'url': future.geturl})
-
-    return id_texts
+    future = asyncio.run_coroutine_threadsafe(run(), loop)
+    try:
+        while True:
+            item = results.get()
+            if item is done:
+                break
+            if isinstance(item, BaseException):
+                raise item
+            loop.call_soon_threadsafe(slots.release)
+            yield item
+    finally:
+        future.cancel()
@@ -0,0 +1,138 @@
+# learnset.py creates an in-memory learnset index of the pokemon_moves and pokemon_abilities tables for team building
+# queries such as "which Pokemon can learn moves A, B and C and have ability D". Each move and each ability gets a packed
+# bitset with one bit per Pokemon (in pokedex id order), so a query is a few vectorized AND/OR operations over
+# ~16 words of 64 bits instead of a multi-way self-join or a GROUP BY ... HAVING scan of pokemon_moves.
+# The index is rebuilt from the database whenever create_db.py writes a new build version into the build_info table
+# (checked at most once every check_every seconds, like ref_cache.py). Moves and abilities can be passed by id or by
+# name.
+# See benchmark_learnset.py for a comparison with the SQL queries.
+import threading
+import time
+import numpy as np
+from ref_cache import RefCache, CHECK_EVERY
+
+
+# Number of Pokemon held by each word of a bitset.
+WORD_BITS = 64
+
+
+def popcount(bits):
+    """Count the set bits of a bitset (as one Python integer, faster than numpy for a few words). -> int."""
+    return int.from_bytes(bits.astype('<u8').tobytes(), 'little').bit_count()
+
+
+class Bitsets:
+    """Packed bitsets (one row of uint64 words per key) over the Pokemon ids of the pokedex table."""
+    def __init__(self, poke_ids, pairs):
+        """Pass the sorted Pokemon ids and the (key, poke_id) pairs of a link table."""
+        self.poke_ids = poke_ids
+        self.words = (len(poke_ids) + WORD_BITS - 1) // WORD_BITS
+        pairs = np.array(pairs, dtype=np.int64).reshape(-1, 2)
+        keys, rows = np.unique(pairs[:, 0], return_inverse=True)
+        self.rows = {int(key): n for n, key in enumerate(keys)}
+        self.bits = np.zeros((len(keys), self.words), dtype=np.uint64)
+        pos = np.searchsorted(poke_ids, pairs[:, 1])
+        known = (pos < len(poke_ids)) & (poke_ids[np.minimum(pos, len(poke_ids) - 1)] == pairs[:, 1])
+        pos, rows = pos[known], rows.reshape(-1)[known]
+        np.bitwise_or.at(self.bits, (rows, pos // WORD_BITS), self.bit(pos))
+        everyone = np.arange(len(poke_ids))
+        self.full = np.zeros(self.words, dtype=np.uint64)
+        np.bitwise_or.at(self.full, everyone // WORD_BITS, self.bit(everyone))
+
+    @staticmethod
+    def bit(pos):
+        """Bit of each position within its word. -> uint64 array."""
+        return np.left_shift(np.uint64(1), (pos % WORD_BITS).astype(np.uint64))
+
+    def all(self, keys):
+        """AND of the bitsets of keys (every bit set if there are none). -> uint64 array."""
+        rows = [self.rows.get(key) for key in keys]
+        if None in rows:
+            return np.zeros(self.words, dtype=np.uint64)
+        bits = self.full.copy()
+        for row in rows:
+            bits &= self.bits[row]
+        return bits
+
+    def any(self, keys):
+        """OR of the bitsets of keys (every bit unset if there are none). -> uint64 array."""
+        bits = np.zeros(self.words, dtype=np.uint64)
+        for row in (self.rows.get(key) for key in keys):
+            if row is not None:
+                bits |= self.bits[row]
+        return bits
+
+
+class LearnsetIndex:
+    """In-memory bitset index of the moves each Pokemon can learn and the abilities it can have."""
+    def __init__(self, pgsql_connection, check_every=CHECK_EVERY):
+        """Pass PGSQLConnection (or PGSQLPool) object. The index is built on first use."""
+        self.pgsql_connection = pgsql_connection
+        self.ref_cache = RefCache(pgsql_connection, check_every)
+        self.state = None
+        self.version = None
+        self.lock = threading.Lock()
+        self.builds = 0
+        self.build_seconds = None
+
+    def build(self):
+        """Load the pokedex ids and the link tables and build the bitsets of every move and ability."""
+        start = time.perf_counter()
+        with self.pgsql_connection as conn_cur:
+            version = self.ref_cache.build_version(conn_cur[1])
+            conn_cur[1].execute("SELECT id FROM pokedex ORDER BY id;")
+            poke_ids = np.array([x[0] for x in conn_cur[1].fetchall()], dtype=np.int64)
+            conn_cur[1].execute("SELECT move_id, poke_id FROM pokemon_moves;")
+            moves = Bitsets(poke_ids, conn_cur[1].fetchall())
+            conn_cur[1].execute("SELECT ability_id, poke_id FROM pokemon_abilities;")
+            abilities = Bitsets(poke_ids, conn_cur[1].fetchall())
+        self.state = (poke_ids, moves, abilities)
+        self.version = version
+        self.builds += 1
+        self.build_seconds = time.perf_counter() - start
+
+    def index(self):
+        """Get the current (poke_ids, moves, abilities) index, rebuilding it when the build version has changed.
+        -> tuple."""
+        self.ref_cache.check_version()
+        state = self.state
+        if state is None or self.ref_cache.version != self.version:
+            with self.lock:
+                if self.state is None or self.ref_cache.version != self.version:
+                    self.build()
+                state = self.state
+        return state
+
+    def key_ids(self, table, keys):
+        """Ids of moves or abilities passed by id or by name (unknown names give None). -> list."""
+        return [key if not isinstance(key, str) else getattr(self.ref_cache.get_name(table, key), 'id', None)
+                for key in keys]
+
+    def mask(self, moves=(), abilities=(), any_moves=(), any_abilities=()):
+        """Bitset of the Pokemon that can learn every move in moves and have every ability in abilities (and at least
+        one of any_moves and of any_abilities when passed). -> (uint64 array, poke_ids)."""
+        poke_ids, move_bits, ability_bits = self.index()
+        bits = move_bits.all(self.key_ids('moves', moves)) & ability_bits.all(self.key_ids('abilities', abilities))
+        if any_moves:
+            bits &= move_bits.any(self.key_ids('moves', any_moves))
+        if any_abilities:
+            bits &= ability_bits.any(self.key_ids('abilities', any_abilities))
+        return bits, poke_ids
+
+    def find(self, moves=(), abilities=(), any_moves=(), any_abilities=()):
+        """Get the ids of the Pokemon matching a query (arguments as in mask). -> sorted list of ints."""
+        bits, poke_ids = self.mask(moves, abilities, any_moves, any_abilities)
+        matches = np.unpackbits(bits.astype('<u8').view(np.uint8), bitorder='little')[:len(poke_ids)]
+        return poke_ids[matches.view(bool)].tolist()
+
+    def count(self, moves=(), abilities=(), any_moves=(), any_abilities=()):
+        """Count the Pokemon matching a query (arguments as in mask). -> int."""
+        return popcount(self.mask(moves, abilities, any_moves, any_abilities)[0])
+
+    def stats(self):
+        """Get build statistics. -> dictionary."""
+        state = self.state
+        return {'builds': self.builds, 'build_seconds': self.build_seconds, 'version': self.version,
+                'pokemon': None if state is None else len(state[0]),
+                'moves': None if state is None else len(state[1].rows),
+                'abilities': None if state is None else len(state[2].rows)}
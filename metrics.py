@@ -0,0 +1,158 @@
+# metrics.py creates the instrumentation shared by create_db.py, pipeline.py and the fetch engine.
+# Counters (e.g. bytes downloaded, retries, rows inserted per table), gauges (e.g. stage wall times) and histograms
+# (e.g. request latency) are recorded with labels into the METRICS object, which is thread-safe and can be written as
+# structured JSON or in the Prometheus text format. Progress messages go through METRICS.log so they can be silenced
+# with quiet mode.
+import json
+import threading
+import time
+
+
+# Upper bounds (seconds) of the latency histogram buckets.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+class Histogram:
+    """Count observations in cumulative buckets (Prometheus style) and keep their count and sum."""
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        """Initialize empty buckets."""
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        """Add one observation."""
+        for n, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[n] += 1
+                break
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self):
+        """Cumulative bucket counts (the last bucket is +Inf). -> list of (bound, count) tuples."""
+        total = 0
+        result = []
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            result.append((bound, total))
+        result.append((float('inf'), self.count))
+        return result
+
+    def quantile(self, q):
+        """Estimate a quantile as the upper bound of the bucket it falls in. -> float or None."""
+        if not self.count:
+            return None
+        for bound, total in self.cumulative():
+            if total >= q * self.count:
+                return bound
+        return None
+
+
+class Metrics:
+    """Thread-safe store of labeled counters, gauges and histograms."""
+    def __init__(self, quiet=False):
+        """Initialize empty metrics. Use quiet=True to silence log messages."""
+        self.quiet = quiet
+        self.lock = threading.Lock()
+        self.log_lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self.started = time.time()
+
+    @staticmethod
+    def key(name, labels):
+        """Key of one labeled series. -> (name, sorted label tuple)."""
+        return name, tuple(sorted(labels.items()))
+
+    def log(self, *args):
+        """Print a progress message unless quiet."""
+        if not self.quiet:
+            with self.log_lock:
+                print(' '.join(str(arg) for arg in args))
+
+    def inc(self, name, value=1, **labels):
+        """Add value to a counter."""
+        key = self.key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        """Set a gauge."""
+        with self.lock:
+            self.gauges[self.key(name, labels)] = value
+
+    def observe(self, name, value, **labels):
+        """Add an observation to a histogram."""
+        key = self.key(name, labels)
+        with self.lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram()
+            self.histograms[key].observe(value)
+
+    def reset(self):
+        """Drop every recorded metric."""
+        with self.lock:
+            self.counters.clear()
+            self.gauges.clear()
+            self.histograms.clear()
+            self.started = time.time()
+
+    def to_dict(self):
+        """Snapshot of every metric. -> dictionary (JSON serializable)."""
+        with self.lock:
+            counters = [{'name': k[0], 'labels': dict(k[1]), 'value': v} for k, v in sorted(self.counters.items())]
+            gauges = [{'name': k[0], 'labels': dict(k[1]), 'value': v} for k, v in sorted(self.gauges.items())]
+            histograms = [{'name': k[0], 'labels': dict(k[1]), 'count': h.count, 'sum': round(h.sum, 6),
+                           'p50': h.quantile(0.5), 'p90': h.quantile(0.9), 'p99': h.quantile(0.99),
+                           'buckets': {str(bound): total for bound, total in h.cumulative()}}
+                          for k, h in sorted(self.histograms.items())]
+        return {'started': self.started, 'counters': counters, 'gauges': gauges, 'histograms': histograms}
+
+    def to_json(self):
+        """Every metric as structured JSON. -> str."""
+        return json.dumps(self.to_dict(), indent=1)
+
+    def to_prometheus(self):
+        """Every metric in the Prometheus text exposition format. -> str."""
+        def series(name, labels, extra=()):
+            pairs = list(labels) + list(extra)
+            if not pairs:
+                return name
+            return name + '{' + ','.join(k + '="' + str(v).replace('"', '\\"') + '"' for k, v in pairs) + '}'
+
+        lines = []
+        with self.lock:
+            for kind, store in (('counter', self.counters), ('gauge', self.gauges)):
+                typed = set()
+                for (name, labels), value in sorted(store.items()):
+                    if name not in typed:
+                        lines.append('# TYPE ' + name + ' ' + kind)
+                        typed.add(name)
+                    lines.append(series(name, labels) + ' ' + repr(value))
+            typed = set()
+            for (name, labels), h in sorted(self.histograms.items()):
+                if name not in typed:
+                    lines.append('# TYPE ' + name + ' histogram')
+                    typed.add(name)
+                for bound, total in h.cumulative():
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append(series(name + '_bucket', labels, [('le', le)]) + ' ' + str(total))
+                lines.append(series(name + '_sum', labels) + ' ' + repr(h.sum))
+                lines.append(series(name + '_count', labels) + ' ' + str(h.count))
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path, fmt='json'):
+        """Write every metric to a file (or to stdout if path is '-') as 'json' or 'prometheus'."""
+        text = self.to_prometheus() if fmt == 'prometheus' else self.to_json() + '\n'
+        if path == '-':
+            print(text, end='')
+        else:
+            with open(path, 'w') as f:
+                f.write(text)
+
+
+# Metrics of the current process.
+METRICS = Metrics()
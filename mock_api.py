@@ -0,0 +1,440 @@
+# python3 mock_api.py
+# Creates a local stand-in of the https://pokeapi.co API, so get_url and create_db.py can be benchmarked and
+# regression-tested offline (run create_db.py with --api-url http://127.0.0.1:<port>/api/v2/).
+# The /pokemon, /pokemon-species, /type, /evolution-chain, /move and /ability paths are served from fixtures:
+# SyntheticPages generates seeded pages shaped like the real ones (every JSON path read by create_db.py, plus the bulk
+# the projection drops, e.g. version_group_details and flavor text in many languages) and RecordedPages replays the
+# pages of a response cache directory (url_cache.py). The pages keep the https://pokeapi.co/api/v2/ base in their
+# urls (only the ids are read from them). List endpoints are paginated with ?limit=&offset= (20 per page by default)
+# like the real API, and every page gets an ETag (304 Not Modified on If-None-Match).
+# Faults are injected from a seeded random generator: latency (plus jitter) on every response, a share of the resource
+# pages missing (404, the same pages on every request), a share of throttled (429 with Retry-After) and failed (5xx)
+# responses, a request budget per second beyond which responses are throttled, and the list pages of some endpoints can
+# answer 404 (e.g. to exercise the fallback id ranges of create_db.py). Evolution chain ids have gaps like the real API.
+# Use MockAPI(...).start() to serve from a background thread (see benchmark_build.py), or run this file.
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import threading
+import time
+from collections import Counter
+from urllib.parse import parse_qsl
+from aiohttp import web
+from url_cache import URLCache
+
+
+# Base url of the urls inside the pages.
+API_URL = 'https://pokeapi.co/api/v2/'
+
+# Served endpoints.
+ENDPOINTS = ['pokemon', 'pokemon-species', 'type', 'evolution-chain', 'move', 'ability']
+
+# Page size of the list endpoints when no limit is passed.
+DEFAULT_LIMIT = 20
+
+# Default number of synthetic resources of each endpoint (Pokemon species are also the Pokemon).
+SIZES = {'pokemon': 1025, 'type': 18, 'move': 919, 'ability': 307}
+
+# Every CHAIN_GAP-th evolution chain id is skipped (the real API has gaps too, e.g. there is no chain 210).
+CHAIN_GAP = 7
+
+# Languages of the synthetic flavor text and effect entries.
+LANGUAGES = ['ja-Hrkt', 'ko', 'zh-Hant', 'fr', 'de', 'es', 'it', 'en', 'ja', 'zh-Hans']
+
+# Stat names of the synthetic Pokemon pages.
+STATS = ['hp', 'attack', 'defense', 'special-attack', 'special-defense', 'speed']
+
+# Status codes of the injected server errors.
+ERROR_STATUS = [500, 502, 503, 504]
+
+
+def ref(endpoint, i, name=None):
+    """Named resource reference like the ones inside the API pages. -> dict."""
+    value = {'url': API_URL + endpoint + '/' + str(i) + '/'}
+    if name is not None:
+        value = {'name': name, **value}
+    return value
+
+
+class Fixtures:
+    """Pages served by MockAPI. Subclasses give the ids of each endpoint and the text of each page."""
+    def ids(self, endpoint):
+        """Ids of the resources of an endpoint. -> sorted list."""
+        raise NotImplementedError
+
+    def text(self, endpoint, i):
+        """Text of a resource page. -> str or None if there is no such page."""
+        raise NotImplementedError
+
+    def name(self, endpoint, i):
+        """Name of a resource in the list pages (None for evolution chains, which have no name). -> str or None."""
+        raise NotImplementedError
+
+    def list_text(self, endpoint, query_string, base_url):
+        """Text of a page of a list endpoint for the query string (limit and offset). -> str."""
+        query = dict(parse_qsl(query_string))
+        limit = int(query.get('limit', DEFAULT_LIMIT))
+        offset = int(query.get('offset', 0))
+        ids = self.ids(endpoint)
+        page_url = base_url + endpoint + '/?limit=' + str(limit) + '&offset='
+        results = [ref(endpoint, i, self.name(endpoint, i)) for i in ids[offset:offset + limit]]
+        return json.dumps({'count': len(ids),
+                           'next': page_url + str(offset + limit) if offset + limit < len(ids) else None,
+                           'previous': page_url + str(max(offset - limit, 0)) if offset > 0 else None,
+                           'results': results})
+
+    def warm(self):
+        """Create every page in advance (so page generation does not add to the measured latency)."""
+        for endpoint in ENDPOINTS:
+            for i in self.ids(endpoint):
+                self.text(endpoint, i)
+
+
+class SyntheticPages(Fixtures):
+    """Seeded synthetic pages of every endpoint. The same seed and sizes always give the same pages."""
+    def __init__(self, pokemon=SIZES['pokemon'], types=SIZES['type'], moves=SIZES['move'],
+                 abilities=SIZES['ability'], details=6, chain_gap=CHAIN_GAP, seed=1):
+        """Pass the number of resources of each endpoint, and details as the number of version group entries per move
+        of each Pokemon (most of the size of the real Pokemon pages)."""
+        self.sizes = {'pokemon': pokemon, 'pokemon-species': pokemon, 'type': types, 'move': moves,
+                      'ability': abilities}
+        self.details = details
+        self.seed = seed
+        self.pages = {}
+        rnd = random.Random(seed)
+        # Evolution chains of 1 to 3 consecutive species, some branching (a base species with 2 or 3 evolutions).
+        self.chains = {}
+        self.chain_of = {}
+        species = 1
+        chain = 0
+        while species <= pokemon:
+            chain += 1
+            if chain_gap and chain % chain_gap == 0:
+                chain += 1
+            size = min(rnd.choice([1, 1, 2, 2, 3, 3, 3]), pokemon - species + 1)
+            members = list(range(species, species + size))
+            if size == 3 and rnd.random() < 0.1:
+                tree = (members[0], [(members[1], []), (members[2], [])])
+            else:
+                tree = None
+                for i in reversed(members):
+                    tree = (i, [] if tree is None else [tree])
+            self.chains[chain] = tree
+            self.chain_of.update((i, chain) for i in members)
+            species += size
+
+    def ids(self, endpoint):
+        """Ids of the resources of an endpoint. -> sorted list."""
+        if endpoint == 'evolution-chain':
+            return list(self.chains)
+        return list(range(1, self.sizes[endpoint] + 1))
+
+    def name(self, endpoint, i):
+        """Name of a resource (endpoint-id, e.g. move-13). -> str or None."""
+        if endpoint == 'evolution-chain':
+            return None
+        return ('pokemon' if endpoint == 'pokemon-species' else endpoint) + '-' + str(i)
+
+    def entries(self, rnd, key, label, versions):
+        """Flavor text or effect entries in every language (versions entries per language). -> list."""
+        return [{key: label + ' (' + language + ' ' + str(n) + ').\nIt is\x0cgenerated text for "' + label + '".',
+                 'language': ref('language', k + 1, language), 'version_group': ref('version-group', n + 1, 'vg')}
+                for n in range(versions) for k, language in enumerate(LANGUAGES) if rnd.random() < 0.8]
+
+    def page(self, endpoint, i):
+        """Body of a resource page. -> dict or None."""
+        if endpoint == 'evolution-chain':
+            if i not in self.chains:
+                return None
+        elif not 1 <= i <= self.sizes[endpoint]:
+            return None
+        rnd = random.Random(str(self.seed) + '/' + endpoint + '/' + str(i))
+        name = self.name(endpoint, i)
+        types = self.sizes['type']
+        if endpoint == 'pokemon':
+            moves = rnd.sample(range(1, self.sizes['move'] + 1), min(rnd.randint(10, 100), self.sizes['move']))
+            abilities = rnd.sample(range(1, self.sizes['ability'] + 1), min(rnd.randint(1, 3), self.sizes['ability']))
+            details = [{'level_learned_at': level, 'move_learn_method': ref('move-learn-method', 1, 'level-up'),
+                        'version_group': ref('version-group', n + 1, 'vg-' + str(n + 1))}
+                       for n, level in enumerate(rnd.choices(range(1, 101), k=self.details))]
+            return {'id': i, 'name': name, 'base_experience': rnd.randint(36, 340), 'height': rnd.randint(1, 200),
+                    'weight': rnd.randint(1, 9999), 'order': i, 'is_default': True,
+                    'species': ref('pokemon-species', i, name),
+                    'stats': [{'base_stat': rnd.randint(5, 255), 'effort': rnd.randint(0, 3),
+                               'stat': ref('stat', n + 1, stat)} for n, stat in enumerate(STATS)],
+                    'types': [{'slot': n + 1, 'type': ref('type', t, self.name('type', t))}
+                              for n, t in enumerate(rnd.sample(range(1, types + 1), min(rnd.randint(1, 2), types)))],
+                    'abilities': [{'ability': ref('ability', a, self.name('ability', a)), 'is_hidden': n == 2,
+                                   'slot': n + 1} for n, a in enumerate(abilities)],
+                    'moves': [{'move': ref('move', m, self.name('move', m)), 'version_group_details': details}
+                              for m in moves],
+                    'sprites': {key: 'https://raw.githubusercontent.com/PokeAPI/sprites/master/sprites/pokemon/' +
+                                     key + '/' + str(i) + '.png' for key in ('front_default', 'front_shiny',
+                                                                             'back_default', 'back_shiny')}}
+        if endpoint == 'pokemon-species':
+            return {'id': i, 'name': name, 'order': i, 'capture_rate': rnd.randint(3, 255),
+                    'evolution_chain': ref('evolution-chain', self.chain_of[i]),
+                    'genera': [{'genus': name + ' Pokemon', 'language': ref('language', 9, 'en')}],
+                    'flavor_text_entries': self.entries(rnd, 'flavor_text', name, rnd.randint(1, 8))}
+        if endpoint == 'evolution-chain':
+            def stage(tree):
+                return {'is_baby': False, 'species': ref('pokemon-species', tree[0], self.name('pokemon', tree[0])),
+                        'evolution_details': [], 'evolves_to': [stage(child) for child in tree[1]]}
+            return {'id': i, 'baby_trigger_item': None, 'chain': stage(self.chains[i])}
+        if endpoint == 'type':
+            others = rnd.sample(range(1, types + 1), min(rnd.randint(2, 9), types))
+            split = rnd.randint(0, len(others))
+            relations = {'double_damage_to': others[:split // 2], 'half_damage_to': others[split // 2:split],
+                         'no_damage_to': others[split:split + 1] if rnd.random() < 0.3 else [],
+                         'double_damage_from': others[-2:], 'half_damage_from': others[:1], 'no_damage_from': []}
+            return {'id': i, 'name': name,
+                    'damage_relations': {key: [ref('type', t, self.name('type', t)) for t in value]
+                                         for key, value in relations.items()},
+                    'pokemon': [{'pokemon': ref('pokemon', p, self.name('pokemon', p)), 'slot': 1}
+                                for p in rnd.sample(range(1, self.sizes['pokemon'] + 1),
+                                                    min(50, self.sizes['pokemon']))],
+                    'moves': [ref('move', m, self.name('move', m))
+                              for m in range(i, self.sizes['move'] + 1, types)]}
+        if endpoint == 'move':
+            type_id = rnd.randint(1, types)
+            return {'id': i, 'name': name, 'accuracy': rnd.choice([None, 50, 70, 85, 90, 95, 100, 100, 100]),
+                    'power': rnd.choice([None, None, 20, 40, 60, 80, 90, 120, 150]),
+                    'pp': rnd.choice([5, 10, 15, 20, 25, 30, 35, 40]), 'priority': 0,
+                    'type': ref('type', type_id, self.name('type', type_id)),
+                    'damage_class': ref('move-damage-class', rnd.randint(1, 3), 'physical'),
+                    'effect_entries': [{'effect': 'Inflicts regular damage. ' + name + ' has a $effect_chance% '
+                                                  'chance to do something else.', 'short_effect': 'Inflicts damage.',
+                                        'language': ref('language', 9, 'en')}],
+                    'flavor_text_entries': self.entries(rnd, 'flavor_text', name, rnd.randint(0, 12)),
+                    'learned_by_pokemon': [ref('pokemon', p, self.name('pokemon', p))
+                                           for p in rnd.sample(range(1, self.sizes['pokemon'] + 1),
+                                                               min(rnd.randint(0, 200), self.sizes['pokemon']))]}
+        return {'id': i, 'name': name, 'is_main_series': True,
+                'effect_entries': self.entries(rnd, 'effect', name + ' effect', 1)[-2:],
+                'flavor_text_entries': self.entries(rnd, 'flavor_text', name, rnd.randint(0, 10)),
+                'pokemon': [{'is_hidden': False, 'pokemon': ref('pokemon', p, self.name('pokemon', p)), 'slot': 1}
+                            for p in rnd.sample(range(1, self.sizes['pokemon'] + 1), min(5, self.sizes['pokemon']))]}
+
+    def text(self, endpoint, i):
+        """Text of a resource page (created once). -> str or None."""
+        key = (endpoint, i)
+        if key not in self.pages:
+            body = self.page(endpoint, i)
+            self.pages[key] = None if body is None else json.dumps(body)
+        return self.pages[key]
+
+
+class RecordedPages(Fixtures):
+    """Pages of a response cache directory (url_cache.py), e.g. the cache filled by a create_db.py run. Recorded list
+    pages are served as they are, other list pages are made from the recorded resource pages."""
+    def __init__(self, cache_dir):
+        """Index the pages of the API recorded in cache_dir."""
+        self.cache = URLCache(cache_dir, offline=True)
+        self.resources = {endpoint: {} for endpoint in ENDPOINTS}
+        self.lists = {}
+        self.names = {}
+        for url in self.cache.index:
+            if not url.startswith(API_URL):
+                continue
+            endpoint, _, rest = url[len(API_URL):].partition('/')
+            if endpoint not in self.resources:
+                continue
+            rest = rest.rstrip('/')
+            if rest.isdigit():
+                self.resources[endpoint][int(rest)] = url
+            elif rest == '' or rest.startswith('?'):
+                self.lists[(endpoint, rest)] = url
+
+    def ids(self, endpoint):
+        """Ids of the recorded pages of an endpoint. -> sorted list."""
+        return sorted(self.resources[endpoint])
+
+    def text(self, endpoint, i):
+        """Text of a recorded resource page. -> str or None."""
+        url = self.resources[endpoint].get(i)
+        return None if url is None or self.cache.lookup(url) is None else self.cache.read(url)
+
+    def name(self, endpoint, i):
+        """Name of a recorded resource (read from its page). -> str or None."""
+        if (endpoint, i) not in self.names:
+            self.names[(endpoint, i)] = json.loads(self.text(endpoint, i) or '{}').get('name')
+        return self.names[(endpoint, i)]
+
+    def list_text(self, endpoint, query_string, base_url):
+        """Text of the recorded list page for the query string (or of a page made from the recorded resources).
+        -> str."""
+        url = self.lists.get((endpoint, '?' + query_string if query_string else ''))
+        if url is not None and self.cache.lookup(url) is not None:
+            return self.cache.read(url)
+        return super().list_text(endpoint, query_string, base_url)
+
+
+class MockAPI:
+    """Local PokeAPI server of a Fixtures object with injected latency, missing pages, throttling and errors."""
+    def __init__(self, fixtures=None, host='127.0.0.1', port=0, latency=0.0, jitter=0.0, missing=0.0, throttle=0.0,
+                 errors=0.0, retry_after=1.0, max_rate=None, unlisted=(), missing_in=ENDPOINTS, seed=1):
+        """Pass the fixtures (SyntheticPages() by default) and port (0 picks a free port). Pass latency and jitter in
+        seconds (each response waits latency plus a uniform share of jitter), missing as the share of the resource pages
+        of the missing_in endpoints answering 404, throttle and errors as the shares of responses answering 429 (with
+        a Retry-After of retry_after seconds, None to leave it out) and 5xx, max_rate as the requests per second beyond
+        which responses answer 429, and unlisted as the endpoints whose list pages answer 404."""
+        self.fixtures = SyntheticPages() if fixtures is None else fixtures
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.jitter = jitter
+        self.missing = missing
+        self.throttle = throttle
+        self.errors = errors
+        self.retry_after = retry_after
+        self.max_rate = max_rate
+        self.unlisted = set(unlisted)
+        self.missing_in = set(missing_in)
+        self.seed = seed
+        self.random = random.Random(seed)
+        self.etags = {}
+        self.counts = Counter()
+        self.bytes = 0
+        self.tokens = float(max_rate or 0)
+        self.stamp = None
+        self.loop = None
+        self.runner = None
+
+    @property
+    def url(self):
+        """Base url of the API served (pass it to create_db.py with --api-url). -> str."""
+        return 'http://' + self.host + ':' + str(self.port) + '/api/v2/'
+
+    def is_missing(self, endpoint, i):
+        """Check if a resource page is one of the missing pages (picked by a hash, so always the same). -> bool."""
+        if endpoint not in self.missing_in:
+            return False
+        digest = hashlib.sha256((str(self.seed) + '/' + endpoint + '/' + i).encode('utf-8')).digest()
+        return int.from_bytes(digest[:8], 'big') / 2 ** 64 < self.missing
+
+    def over_rate(self):
+        """Take a request from the max_rate budget (a token bucket of one second). -> True if it is exceeded."""
+        if not self.max_rate:
+            return False
+        now = time.monotonic()
+        if self.stamp is not None:
+            self.tokens = min(self.max_rate, self.tokens + (now - self.stamp) * self.max_rate)
+        self.stamp = now
+        if self.tokens < 1:
+            return True
+        self.tokens -= 1
+        return False
+
+    def respond(self, status, text=None, headers=None):
+        """Count and build a response. -> web.Response."""
+        self.counts[status] += 1
+        if text is None:
+            return web.Response(status=status, headers=headers)
+        body = text.encode('utf-8')
+        self.bytes += len(body)
+        return web.Response(status=status, body=body, headers=headers, content_type='application/json',
+                            charset='utf-8')
+
+    async def handle(self, request):
+        """Serve a page of an endpoint (after the injected latency and faults). -> web.Response."""
+        delay = self.latency + self.random.uniform(0, self.jitter)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if self.over_rate() or self.random.random() < self.throttle:
+            headers = None if self.retry_after is None else {'Retry-After': str(self.retry_after)}
+            return self.respond(429, 'Too Many Requests', headers)
+        if self.random.random() < self.errors:
+            status = self.random.choice(ERROR_STATUS)
+            return self.respond(status, 'Server Error')
+
+        endpoint, _, rest = request.match_info['path'].strip('/').partition('/')
+        if endpoint not in ENDPOINTS:
+            return self.respond(404, 'Not Found')
+        if rest == '':
+            if endpoint in self.unlisted:
+                return self.respond(404, 'Not Found')
+            try:
+                text = self.fixtures.list_text(endpoint, request.query_string, self.url)
+            except ValueError:
+                return self.respond(400, 'Bad Request')
+        elif rest.isdigit() and not self.is_missing(endpoint, rest):
+            text = self.fixtures.text(endpoint, int(rest))
+            if text is None:
+                return self.respond(404, 'Not Found')
+        else:
+            return self.respond(404, 'Not Found')
+
+        if text not in self.etags:
+            self.etags[text] = 'W/"' + hashlib.sha256(text.encode('utf-8')).hexdigest()[:32] + '"'
+        etag = self.etags[text]
+        if request.headers.get('If-None-Match') == etag:
+            return self.respond(304, headers={'ETag': etag})
+        return self.respond(200, text, {'ETag': etag})
+
+    def stats(self):
+        """Responses served so far. -> dictionary of requests, bytes and the count of each status."""
+        return {'requests': sum(self.counts.values()), 'bytes': self.bytes,
+                'status': {str(status): count for status, count in sorted(self.counts.items())}}
+
+    async def serve(self):
+        """Start serving on the running event loop (sets the port when it was 0)."""
+        app = web.Application()
+        app.router.add_get('/api/v2/{path:.*}', self.handle)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, self.host, self.port)
+        await site.start()
+        self.port = self.runner.addresses[0][1]
+
+    def start(self):
+        """Serve from a background thread (with its own event loop). -> self."""
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, daemon=True).start()
+        asyncio.run_coroutine_threadsafe(self.serve(), self.loop).result()
+        return self
+
+    def stop(self):
+        """Stop serving and the background event loop."""
+        asyncio.run_coroutine_threadsafe(self.runner.cleanup(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve a local stand-in of the https://pokeapi.co API.")
+    parser.add_argument('--host', default='127.0.0.1', help="address to listen on")
+    parser.add_argument('--port', type=int, default=8000, help="port to listen on")
+    parser.add_argument('--recorded', metavar='CACHE_DIR', help="replay the pages of a response cache directory "
+                                                                "instead of synthetic pages")
+    parser.add_argument('--pokemon', type=int, default=SIZES['pokemon'], help="number of synthetic Pokemon")
+    parser.add_argument('--moves', type=int, default=SIZES['move'], help="number of synthetic moves")
+    parser.add_argument('--abilities', type=int, default=SIZES['ability'], help="number of synthetic abilities")
+    parser.add_argument('--types', type=int, default=SIZES['type'], help="number of synthetic types")
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument('--jitter', type=float, default=0.0, help="up to this many more seconds per response")
+    parser.add_argument('--missing', type=float, default=0.0, help="share of resource pages answering 404")
+    parser.add_argument('--missing-in', nargs='+', choices=ENDPOINTS, default=ENDPOINTS,
+                        help="endpoints of the missing pages (every endpoint by default)")
+    parser.add_argument('--throttle', type=float, default=0.0, help="share of responses answering 429")
+    parser.add_argument('--errors', type=float, default=0.0, help="share of responses answering 5xx")
+    parser.add_argument('--retry-after', type=float, default=1.0, help="Retry-After seconds of the 429 responses")
+    parser.add_argument('--max-rate', type=float, help="requests per second beyond which responses answer 429")
+    parser.add_argument('--unlisted', nargs='+', choices=ENDPOINTS, default=[],
+                        help="endpoints whose list pages answer 404")
+    parser.add_argument('--seed', type=int, default=1, help="seed of the synthetic pages and injected faults")
+    args = parser.parse_args()
+
+    if args.recorded:
+        fixtures = RecordedPages(args.recorded)
+    else:
+        fixtures = SyntheticPages(args.pokemon, args.types, args.moves, args.abilities, seed=args.seed)
+    api = MockAPI(fixtures, args.host, args.port, args.latency, args.jitter, args.missing, args.throttle, args.errors,
+                  args.retry_after, args.max_rate, args.unlisted, args.missing_in, args.seed)
+    api.start()
+    print("Serving the mock API at", api.url, "(Ctrl+C to stop).")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        print(api.stats())
+        api.stop()
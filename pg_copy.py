@@ -0,0 +1,50 @@
+# pg_copy.py creates function to bulk load rows into a PGSQL table with COPY ... FROM STDIN.
+# Rows can be any iterable (e.g. the get_url generator) of tuples and are sent in batches of batch_size,
+# so only one batch is held in memory at a time no matter how many rows are loaded.
+# Lists (or tuples) in a row are loaded as PGSQL arrays (e.g. for text[] columns).
+# Use commit=True to commit after every batch, so the rows already sent are kept if the load is interrupted.
+import io
+
+
+# Number of rows sent per COPY statement.
+BATCH_SIZE = 100
+
+# Characters with a special meaning in the COPY text format.
+COPY_ESCAPES = str.maketrans({'\\': '\\\\', '\n': '\\n', '\r': '\\r', '\t': '\\t'})
+
+
+def array_literal(values):
+    """Format a list as a PGSQL array literal (None -> NULL element). -> str."""
+    return '{' + ','.join('NULL' if value is None else
+                          '"' + str(value).replace('\\', '\\\\').replace('"', '\\"') + '"' for value in values) + '}'
+
+
+def copy_value(value):
+    """Format one value for the COPY text format (None -> NULL, list -> array). -> str."""
+    if value is None:
+        return '\\N'
+    if isinstance(value, (list, tuple)):
+        value = array_literal(value)
+    return str(value).translate(COPY_ESCAPES)
+
+
+def copy_rows(cur, table, rows, columns=None, batch_size=BATCH_SIZE, commit=False):
+    """Load tuples into table using COPY in batches. Pass column names as a list (all columns if None), and
+    commit=True to commit the connection after every batch. -> row count."""
+    target = table if columns is None else table + ' (' + ', '.join(columns) + ')'
+    sql = "COPY " + target + " FROM STDIN;"
+    count = 0
+    buffer = io.StringIO()
+    for n, row in enumerate(rows, start=1):
+        buffer.write('\t'.join(copy_value(value) for value in row) + '\n')
+        if n % batch_size == 0:
+            buffer.seek(0)
+            cur.copy_expert(sql, buffer)
+            if commit:
+                cur.connection.commit()
+            buffer = io.StringIO()
+        count = n
+    if count % batch_size:
+        buffer.seek(0)
+        cur.copy_expert(sql, buffer)
+    return count
@@ -0,0 +1,76 @@
+# pipeline.py creates a small dependency-aware stage scheduler used by create_db.py.
+# Add stages (functions without arguments) with the names of the stages they depend on, then run the pipeline.
+# Every stage starts in its own thread as soon as all of its dependencies have finished, so independent stages
+# (e.g. fetches and SQL transforms on separate connections) overlap. If a stage fails, no new stages are started
+# and the first error is raised once the running stages have finished. Functions added with on_abort are called as soon
+# as a stage fails, so stages waiting on a stage that will never start (e.g. on a queue it feeds) can be released.
+# The wall time of each stage is recorded in METRICS (metrics.py).
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from metrics import METRICS
+
+
+class Pipeline:
+    """Run named stages in threads as soon as the stages they depend on have finished."""
+    def __init__(self):
+        """Initialize the stage and result dictionaries."""
+        self.stages = {}
+        self.results = {}
+        self.aborts = []
+
+    def add(self, name, func, deps=()):
+        """Add a stage. Pass the names of the stages that must finish before func is called as deps."""
+        self.stages[name] = (func, tuple(deps))
+
+    def on_abort(self, func):
+        """Add a function (without arguments) to call when a stage fails, before waiting for the running stages."""
+        self.aborts.append(func)
+
+    def run_stage(self, name, func):
+        """Call a stage function and record its wall time. -> stage result."""
+        start = time.perf_counter()
+        try:
+            result = func()
+        finally:
+            seconds = time.perf_counter() - start
+            METRICS.set('pipeline_stage_seconds', round(seconds, 6), stage=name)
+        METRICS.log("Stage", name, "finished in", round(seconds, 2), "seconds.")
+        return result
+
+    def run(self):
+        """Run every stage once its dependencies have finished. -> dictionary of stage results."""
+        for name, (_, deps) in self.stages.items():
+            for dep in deps:
+                if dep not in self.stages:
+                    raise ValueError("Stage " + name + " depends on unknown stage " + dep + ".")
+
+        pending = dict(self.stages)
+        running = {}
+        error = None
+        with ThreadPoolExecutor(max_workers=max(len(self.stages), 1)) as executor:
+            while pending or running:
+                if error is None:
+                    ready = [name for name, (_, deps) in pending.items() if all(d in self.results for d in deps)]
+                    for name in ready:
+                        func, _ = pending.pop(name)
+                        running[executor.submit(self.run_stage, name, func)] = name
+                if not running:
+                    if error is None:
+                        raise ValueError("Circular stage dependencies between: " + ', '.join(pending) + ".")
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        self.results[name] = future.result()
+                    except Exception as e:
+                        METRICS.inc('pipeline_stage_failures_total', stage=name)
+                        print("Stage", name, "failed:", repr(e))
+                        if error is None:
+                            error = e
+                            for func in self.aborts:
+                                func()
+
+        if error is not None:
+            raise error
+        return self.results
@@ -0,0 +1,57 @@
+# projection.py creates the projection step between get_url and the json tables (js_<name>) in create_db.py.
+# Most of each PokeAPI page is never read by the transforms (e.g. the version_group_details of every move, the sprite
+# urls and the flavor text of every language), so only the JSON paths listed in PROJECTIONS are kept and the page is
+# stored as compact JSON. A projection is a dictionary of the keys to keep, where True keeps the whole value and a
+# dictionary projects the value (or every element of a list) again. Elements of lists with a language are only kept
+# in LANGUAGE. Run create_db.py with --keep-full-body to store the pages as they are.
+import orjson
+
+
+# Language of the list entries (flavor text, effects) that are kept.
+LANGUAGE = 'en'
+
+# Flavor text and effect entries
+ENTRY = {'flavor_text': True, 'effect': True, 'language': {'name': True}}
+
+# Stage of an evolution chain (the evolves_to list holds the next stages)
+EVO_STAGE = {'species': {'name': True, 'url': True}}
+EVO_STAGE['evolves_to'] = EVO_STAGE
+
+# JSON paths read from the pages of each json table.
+PROJECTIONS = {
+    'js_pokemon': {'id': True, 'species': {'name': True}, 'height': True, 'weight': True,
+                   'stats': {'base_stat': True}, 'types': {'type': {'name': True}},
+                   'moves': {'move': {'url': True}}, 'abilities': {'ability': {'url': True}}},
+    'js_species': {'id': True, 'flavor_text_entries': ENTRY},
+    'js_types': {'results': {'name': True, 'url': True}},
+    'js_type_damage': {'id': True, 'name': True,
+                       'damage_relations': {'double_damage_to': {'url': True}, 'half_damage_to': {'url': True},
+                                            'no_damage_to': {'url': True}}},
+    'js_evo': {'id': True, 'chain': EVO_STAGE},
+    'js_moves': {'id': True, 'name': True, 'pp': True, 'power': True, 'accuracy': True, 'type': {'url': True},
+                 'flavor_text_entries': ENTRY, 'effect_entries': ENTRY},
+    'js_abilities': {'id': True, 'name': True, 'flavor_text_entries': ENTRY, 'effect_entries': ENTRY},
+}
+
+
+def in_language(value):
+    """Check if a list element has no language or is in LANGUAGE. -> bool."""
+    language = value.get('language') if isinstance(value, dict) else None
+    return not isinstance(language, dict) or language.get('name') == LANGUAGE
+
+
+def project(value, spec):
+    """Keep only the keys of spec in value (recursively). -> projected value."""
+    if spec is True:
+        return value
+    if isinstance(value, list):
+        return [project(element, spec) for element in value if in_language(element)]
+    if isinstance(value, dict):
+        return {key: project(value[key], sub_spec) for key, sub_spec in spec.items() if key in value}
+    return value
+
+
+def project_page(table, text):
+    """Project the text of a page of a json table. -> (compact JSON text, projected page)."""
+    body = project(orjson.loads(text), PROJECTIONS[table])
+    return orjson.dumps(body).decode('utf-8'), body
@@ -0,0 +1,259 @@
+# py_transform.py creates the Python transform engine (python3 create_db.py --transform python), an alternative to the
+# jsonb SQL statements in create_db.py. Each page is parsed once with orjson (as it is loaded into its json table, or
+# read back from the table if it was loaded by an earlier run) and only the fields the final tables need are kept.
+# The final rows are then built in batches and loaded with COPY (through a temp table and INSERT ... ON CONFLICT when
+# the table already has rows). Text fields get the same clean up as in the SQL statements (jsonb text escapes,
+# regexp_replace, translate of [] to {} and text[] unescaping), so both engines create the same tables
+# (see benchmark_transform.py).
+import re
+import time
+import orjson
+from metrics import METRICS
+from pg_copy import copy_rows
+
+
+# Id at the end of an API url (e.g. .../move/13/)
+URL_ID = re.compile(r'.+/([0-9]+)/$')
+
+# regexp_replace patterns of the SQL statements. PGSQL picks the longest alternative, so it is written first here.
+FLAVOR_PATTERN = re.compile(r'\\n|\\f')
+EFFECT_PATTERN = re.compile(r'\\n\\n|\\n|\\f|  ')
+
+# Damage factor of each damage relation of a type page (pairs that are not listed do normal damage, 1.0).
+DAMAGE_FACTORS = (('double_damage_to', 2.0), ('half_damage_to', 0.5), ('no_damage_to', 0.0))
+
+# Strings without these characters come out of the SQL clean up unchanged.
+SPECIAL = re.compile(r'[\x00-\x1f"\\\[\]]|  ')
+UNESCAPE = re.compile(r'\\(.)', re.S)
+BRACKETS = str.maketrans('[]', '{}')
+
+
+def sql_text(value, pattern=None):
+    """Clean up a string like the SQL statements do: escape it as jsonb text, apply the regexp_replace pattern,
+    translate [] to {} and unescape it as a text[] element. -> str (None for JSON null)."""
+    if value is None or not SPECIAL.search(value):
+        return value
+    text = orjson.dumps(value).decode('utf-8')[1:-1]
+    if pattern is not None:
+        text = pattern.sub(' ', text)
+    return UNESCAPE.sub(r'\1', text.translate(BRACKETS))
+
+
+def path(body, *keys):
+    """Follow keys/indexes into a parsed page like the -> operator. -> value (None if missing)."""
+    for key in keys:
+        try:
+            body = body[key]
+        except (KeyError, IndexError, TypeError):
+            return None
+    return body
+
+
+def url_id(url):
+    """Id at the end of an API url. -> int (None if there is none)."""
+    match = None if url is None else URL_ID.match(url)
+    return None if match is None else int(match.group(1))
+
+
+def first_english(entries, key, pattern):
+    """Cleaned up key of the first English entry (flavor text or effect). -> str (None if there is none)."""
+    for entry in entries or []:
+        if sql_text(path(entry, 'language', 'name')) == 'en':
+            return sql_text(entry.get(key), pattern)
+    return None
+
+
+def extract_pokemon(body):
+    """Pokedex fields, move ids and ability ids of a Pokemon page. -> tuple."""
+    return (body['id'], path(body, 'species', 'name'), body.get('height'), body.get('weight'),
+            *(path(body, 'stats', n, 'base_stat') for n in range(6)),
+            [sql_text(path(t, 'type', 'name')) for t in body.get('types') or []],
+            [url_id(path(m, 'move', 'url')) for m in body.get('moves') or []],
+            [url_id(path(a, 'ability', 'url')) for a in body.get('abilities') or []])
+
+
+def extract_species(body):
+    """Info (first English flavor text) of a species page. -> (id, info)."""
+    return body['id'], first_english(body.get('flavor_text_entries'), 'flavor_text', FLAVOR_PATTERN)
+
+
+def extract_evo(body):
+    """Species names of the first three stages of an evolution chain page, and the (species id, name, path of species
+    ids from the first stage) of every stage at any depth. -> (id, names, nodes)."""
+    chain = body.get('chain') or {}
+    stages = [chain]
+    names = []
+    for _ in range(3):
+        names += [sql_text(path(stage, 'species', 'name')) for stage in stages]
+        stages = [child for stage in stages for child in stage.get('evolves_to') or []]
+    nodes = []
+    stack = [(chain, [])]
+    while stack:
+        stage, parents = stack.pop()
+        ids = parents + [url_id(path(stage, 'species', 'url'))]
+        nodes.append((ids[-1], path(stage, 'species', 'name'), ids))
+        stack += [(child, ids) for child in reversed(stage.get('evolves_to') or [])]
+    return body['id'], names, nodes
+
+
+def extract_move(body):
+    """Moves row of a move page (info is the first English flavor text, else the first English effect). -> tuple."""
+    info = first_english(body.get('flavor_text_entries'), 'flavor_text', FLAVOR_PATTERN)
+    if info is None:
+        info = first_english(body.get('effect_entries'), 'effect', EFFECT_PATTERN)
+    return (body['id'], body.get('name'), body.get('pp'), body.get('power'), body.get('accuracy'),
+            url_id(path(body, 'type', 'url')), info)
+
+
+def extract_ability(body):
+    """Abilities row of an ability page (info as for moves). -> tuple."""
+    info = first_english(body.get('flavor_text_entries'), 'flavor_text', FLAVOR_PATTERN)
+    if info is None:
+        info = first_english(body.get('effect_entries'), 'effect', EFFECT_PATTERN)
+    return body['id'], body.get('name'), info
+
+
+def extract_types(body):
+    """Types rows of the type list page. -> list of (id, name) tuples."""
+    return [(url_id(sql_text(t.get('url'))), sql_text(t.get('name'))) for t in body.get('results') or []]
+
+
+def extract_type_damage(body):
+    """Damage factors of a type page against the defending types in its damage relations. -> (id, list of
+    (defend_type, factor) tuples)."""
+    relations = body.get('damage_relations') or {}
+    return body['id'], [(url_id(sql_text(t.get('url'))), factor)
+                        for relation, factor in DAMAGE_FACTORS for t in relations.get(relation) or []]
+
+
+# Extract function of each json table.
+EXTRACTORS = {'js_pokemon': extract_pokemon, 'js_species': extract_species, 'js_evo': extract_evo,
+              'js_moves': extract_move, 'js_abilities': extract_ability, 'js_types': extract_types,
+              'js_type_damage': extract_type_damage}
+
+
+class ParsedPages:
+    """Fields the final tables need from the parsed pages of each json table (by table and page id)."""
+    def __init__(self):
+        """Initialize an empty dictionary for each json table."""
+        self.pages = {table: {} for table in EXTRACTORS}
+
+    def add(self, table, i, text, body=None):
+        """Parse one page of a json table (unless it is passed already parsed as body) and keep its extracted fields."""
+        start = time.perf_counter()
+        self.pages[table][i] = EXTRACTORS[table](orjson.loads(text) if body is None else body)
+        METRICS.inc('transform_parse_seconds_total', time.perf_counter() - start, table=table)
+
+    def get(self, cur, table, ids=None):
+        """Extracted fields of the pages with the given ids (every page if None). Pages that were not parsed during
+        this run are read from the json table first. -> dictionary of page id and extracted fields."""
+        pages = self.pages[table]
+        if ids is None:
+            cur.execute("SELECT id, body::text FROM " + table + " WHERE NOT (id = ANY(%s));", (list(pages),))
+        else:
+            cur.execute("SELECT id, body::text FROM " + table + " WHERE id = ANY(%s);",
+                        ([i for i in ids if i not in pages],))
+        for i, text in cur.fetchall():
+            self.add(table, i, text)
+        return {i: pages[i] for i in (sorted(pages) if ids is None else ids) if i in pages}
+
+
+def load_rows(cur, table, columns, rows, conflict):
+    """COPY rows into an empty table, or through a temp table and INSERT ... ON CONFLICT conflict otherwise.
+    -> number of rows inserted (or updated)."""
+    cur.execute("SELECT EXISTS (SELECT 1 FROM " + table + ");")
+    if not cur.fetchone()[0]:
+        return copy_rows(cur, table, rows, columns)
+    cols = ', '.join(columns)
+    cur.execute("CREATE TEMP TABLE tmp_" + table + " (LIKE " + table + ") ON COMMIT DROP;")
+    copy_rows(cur, 'tmp_' + table, rows, columns)
+    cur.execute("INSERT INTO " + table + " (" + cols + ") SELECT " + cols + " FROM tmp_" + table +
+                " ON CONFLICT " + conflict + ";")
+    return cur.rowcount
+
+
+def update_all(columns):
+    """ON CONFLICT clause that updates every column but the id. -> str."""
+    return "(id) DO UPDATE SET " + ', '.join(col + " = EXCLUDED." + col for col in columns[1:])
+
+
+def transform_pokedex(cur, parsed, ids=None):
+    """Insert the pokedex rows of the Pokemon pages (all if ids is None). -> row count."""
+    evo_sets = {}
+    for evo_set, names, _ in parsed.get(cur, 'js_evo').values():
+        for name in names:
+            evo_sets.setdefault(name, evo_set)
+    info = dict(parsed.get(cur, 'js_species', ids).values())
+    rows = ((*p[:11], evo_sets.get(p[1]), info.get(p[0]))
+            for p in sorted(parsed.get(cur, 'js_pokemon', ids).values()))
+    columns = ['id', 'name', 'height', 'weight', 'hp', 'attack', 'defense', 's_attack', 's_defense', 'speed', 'type',
+               'evo_set', 'info']
+    return load_rows(cur, 'pokedex', columns, rows, update_all(columns))
+
+
+def transform_types(cur, parsed, ids=None):
+    """Insert the types rows of the type list page (ids are not used, the list page is always read). -> row count."""
+    rows = (row for page in parsed.get(cur, 'js_types').values() for row in page)
+    return load_rows(cur, 'types', ['id', 'name'], rows, update_all(['id', 'name']))
+
+
+def transform_type_efficacy(cur, parsed, ids=None):
+    """Insert the type_efficacy rows (every attacking and defending type pair) of the type pages (ids are not used,
+    every pair is always written). -> row count."""
+    type_ids = sorted(i for page in parsed.get(cur, 'js_types').values() for i, _ in page)
+    factors = {}
+    for attack_type, relations in parsed.get(cur, 'js_type_damage').values():
+        for defend_type, factor in relations:
+            factors[attack_type, defend_type] = min(factor, factors.get((attack_type, defend_type), factor))
+    rows = ((a, d, factors.get((a, d), 1.0)) for a in type_ids for d in type_ids)
+    return load_rows(cur, 'type_efficacy', ['attack_type', 'defend_type', 'factor'], rows,
+                     "(attack_type, defend_type) DO UPDATE SET factor = EXCLUDED.factor")
+
+
+def transform_moves(cur, parsed, ids=None):
+    """Insert the moves rows of the move pages (all if ids is None). -> row count."""
+    columns = ['id', 'name', 'pp', 'damage', 'accuracy', 'type', 'info']
+    return load_rows(cur, 'moves', columns, sorted(parsed.get(cur, 'js_moves', ids).values()), update_all(columns))
+
+
+def transform_abilities(cur, parsed, ids=None):
+    """Insert the abilities rows of the ability pages (all if ids is None). -> row count."""
+    columns = ['id', 'name', 'info']
+    return load_rows(cur, 'abilities', columns, sorted(parsed.get(cur, 'js_abilities', ids).values()),
+                     update_all(columns))
+
+
+def transform_links(cur, parsed, ids=None):
+    """Insert the pokemon_moves and pokemon_abilities rows of the Pokemon pages (all if ids is None).
+    -> dictionary of table and row count."""
+    pokemon = sorted(parsed.get(cur, 'js_pokemon', ids).values())
+    counts = {}
+    for table, columns, n in (('pokemon_moves', ['poke_id', 'move_id'], 11),
+                              ('pokemon_abilities', ['poke_id', 'ability_id'], 12)):
+        rows = ((p[0], x) for p in pokemon for x in dict.fromkeys(p[n]))
+        counts[table] = load_rows(cur, table, columns, rows, "DO NOTHING")
+    return counts
+
+
+def transform_evolutions(cur, parsed, ids=None):
+    """Insert the evo_species, evo_edges and evo_closure rows of the evolution chain pages (all if ids is None).
+    -> dictionary of table and row count."""
+    chains = sorted(parsed.get(cur, 'js_evo', ids).values())
+    nodes = [(chain_id, *node) for chain_id, _, chain in chains for node in chain]
+    species = sorted((i, name, chain_id, len(ids)) for chain_id, i, name, ids in nodes)
+    edges = [(chain_id, ids[-2], i) for chain_id, i, _, ids in nodes if len(ids) > 1]
+    closure = ((chain_id, a, i, len(ids) - 1 - n, ids[n + 1] if n + 1 < len(ids) else None, ids[n:])
+               for chain_id, i, _, ids in nodes for n, a in enumerate(ids))
+    return {'evo_species': load_rows(cur, 'evo_species', ['id', 'name', 'chain_id', 'stage'], species,
+                                     update_all(['id', 'name', 'chain_id', 'stage'])),
+            'evo_edges': load_rows(cur, 'evo_edges', ['chain_id', 'parent_id', 'child_id'], edges,
+                                   "(parent_id, child_id) DO UPDATE SET chain_id = EXCLUDED.chain_id"),
+            'evo_closure': load_rows(cur, 'evo_closure',
+                                     ['chain_id', 'ancestor_id', 'descendant_id', 'depth', 'branch', 'path'], closure,
+                                     "(ancestor_id, descendant_id) DO UPDATE SET chain_id = EXCLUDED.chain_id, "
+                                     "depth = EXCLUDED.depth, branch = EXCLUDED.branch, path = EXCLUDED.path")}
+
+
+# Transform function of each final table created from a single statement in the SQL path.
+TRANSFORMS = {'pokedex': transform_pokedex, 'types': transform_types, 'type_efficacy': transform_type_efficacy,
+              'moves': transform_moves, 'abilities': transform_abilities}
@@ -0,0 +1,136 @@
+# ref_cache.py creates a read-through, in-process cache of the reference tables (pokedex, moves, abilities, types).
+# The tables only change when create_db.py runs, so each one is loaded once (on first use) into a list of named tuples
+# indexed by id and by name, and every lookup after that is served from memory without a round trip.
+# create_db.py writes a new version into the build_info table whenever a build (or refresh) goes live. The cache checks
+# that version at most once every check_every seconds and drops every loaded table when it has changed.
+import threading
+import time
+from collections import namedtuple
+
+
+# Reference tables that can be cached and their (id, name) columns.
+REF_TABLES = {'pokedex': ('id', 'name'), 'moves': ('id', 'name'), 'abilities': ('id', 'name'), 'types': ('id', 'name')}
+
+# Stored full text search columns (see search.py) left out of the cached rows.
+SKIP_COLUMNS = {'search'}
+
+# Seconds between checks of the build version.
+CHECK_EVERY = 5
+
+
+class RefTable:
+    """Rows of one reference table held in memory and indexed by id and by name."""
+    def __init__(self, table, columns, rows):
+        """Create a named tuple for each row and the id/name indexes."""
+        row_type = namedtuple(table.capitalize(), columns)
+        id_col, name_col = (columns.index(col) for col in REF_TABLES[table])
+        self.rows = [row_type._make(row) for row in rows]
+        self.by_id = {row[id_col]: row for row in self.rows}
+        self.by_name = {row[name_col]: row for row in self.rows}
+
+
+class RefCache:
+    """Read-through cache of the reference tables. Lookups return named tuples of the table row (None if missing)."""
+    def __init__(self, pgsql_connection, check_every=CHECK_EVERY):
+        """Pass PGSQLConnection (or PGSQLPool) object. Tables are loaded on first use."""
+        self.pgsql_connection = pgsql_connection
+        self.check_every = check_every
+        self.tables = {}
+        self.version = None
+        self.checked = None
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.loads = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def build_version(cur):
+        """Read the build version written by create_db.py (None for databases built before build_info). The table is
+        looked up first, so the transaction of the cursor (e.g. a snapshot export) is never rolled back. -> str."""
+        cur.execute("SELECT to_regclass('build_info') IS NOT NULL;")
+        if not cur.fetchone()[0]:
+            return None
+        cur.execute("SELECT version FROM build_info WHERE id = 1;")
+        row = cur.fetchone()
+        return None if row is None else row[0]
+
+    def check_version(self):
+        """Drop the loaded tables if the build version has changed (checked at most once every check_every seconds)."""
+        now = time.monotonic()
+        if self.checked is not None and now - self.checked < self.check_every:
+            return
+        with self.lock:
+            if self.checked is not None and now - self.checked < self.check_every:
+                return
+            with self.pgsql_connection as conn_cur:
+                version = self.build_version(conn_cur[1])
+            if self.checked is not None and version != self.version:
+                self.tables = {}
+                self.invalidations += 1
+            self.version = version
+            self.checked = time.monotonic()
+
+    def table(self, table):
+        """Get a reference table, loading it from the database on first use. -> RefTable."""
+        self.check_version()
+        ref = self.tables.get(table)
+        if ref is not None:
+            return ref
+        if table not in REF_TABLES:
+            raise ValueError("Table " + table + " is not a reference table (" + ', '.join(REF_TABLES) + ").")
+        with self.lock:
+            ref = self.tables.get(table)
+            if ref is None:
+                with self.pgsql_connection as conn_cur:
+                    conn_cur[1].execute("SELECT * FROM " + table + " ORDER BY id;")
+                    keep = [n for n, col in enumerate(conn_cur[1].description) if col.name not in SKIP_COLUMNS]
+                    rows = [[row[n] for n in keep] for row in conn_cur[1].fetchall()]
+                    columns = [conn_cur[1].description[n].name for n in keep]
+                ref = RefTable(table, columns, rows)
+                self.tables = dict(self.tables, **{table: ref})
+                self.loads += 1
+        return ref
+
+    def count(self, row):
+        """Count a lookup as a hit or a miss. -> row."""
+        if row is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return row
+
+    def get(self, table, row_id):
+        """Get one row by id. -> named tuple or None."""
+        return self.count(self.table(table).by_id.get(row_id))
+
+    def get_name(self, table, name):
+        """Get one row by name. -> named tuple or None."""
+        return self.count(self.table(table).by_name.get(name))
+
+    def get_many(self, table, row_ids):
+        """Get rows by a list of ids. -> list of named tuples (None for missing ids)."""
+        by_id = self.table(table).by_id
+        return [self.count(by_id.get(row_id)) for row_id in row_ids]
+
+    def get_names(self, table, names):
+        """Get rows by a list of names. -> list of named tuples (None for missing names)."""
+        by_name = self.table(table).by_name
+        return [self.count(by_name.get(name)) for name in names]
+
+    def all(self, table):
+        """Get every row of a table ordered by id. -> list of named tuples."""
+        return list(self.table(table).rows)
+
+    def invalidate(self):
+        """Drop every loaded table (they are reloaded on next use)."""
+        with self.lock:
+            self.tables = {}
+            self.invalidations += 1
+
+    def stats(self):
+        """Get lookup and load statistics. -> dictionary."""
+        total = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hits / total if total else None,
+                'loads': self.loads, 'invalidations': self.invalidations, 'version': self.version,
+                'tables': sorted(self.tables)}
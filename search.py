@@ -0,0 +1,79 @@
+# search.py creates the full text search API of the pokedex, moves and abilities tables (a sibling of TrainerPack).
+# create_db.py stores a generated tsvector column (search) in each table, the name weighted above the info text, with a
+# GIN index on it, so a search only runs index scans and never recomputes a vector. One call searches every table with
+# a single statement: the matches are ranked (ts_rank), paged (limit/offset, along with the total number of matches)
+# and only the rows of the page get a highlighted fragment of their info text (ts_headline).
+# Search text is matched word by word (every word must match), each word as a prefix by default (e.g. "thund punc"
+# finds thunder-punch). Use prefix=False to get web search syntax instead ("quoted phrases", or, -excluded).
+# See benchmark_search.py for latency benchmarks.
+import re
+from trainer import select_frame
+
+
+# Searchable tables.
+SEARCH_TABLES = ['pokedex', 'moves', 'abilities']
+
+# Words of the search text used in prefix queries.
+WORD = re.compile(r'[^\W_]+')
+
+# ts_headline options of the highlighted fragments.
+HEADLINE_OPTIONS = 'StartSel=<b>, StopSel=</b>, MaxWords=20, MinWords=8, MaxFragments=1'
+
+# Matches of each table (the query is passed as the %(query)s parameter, the tsquery expression is filled in).
+MATCH_SQL = r"""
+SELECT '{table}'::text as source, id, name::text as name, info, ts_rank(search, {tsquery}) as rank
+FROM {table}
+WHERE search @@ {tsquery}
+"""
+
+# Page of the ranked matches of every table, and the highlighted info text of the rows of the page only.
+SEARCH_SQL = r"""
+WITH hits AS (
+{matches}
+), page AS (
+    SELECT *, count(*) OVER () as total FROM hits ORDER BY rank DESC, source, id LIMIT %(limit)s OFFSET %(offset)s
+)
+SELECT source, id, name, rank,
+       CASE WHEN %(highlight)s THEN ts_headline('english', coalesce(info, ''), {tsquery}, %(options)s) END as headline,
+       total
+FROM page
+ORDER BY rank DESC, source, id;
+"""
+
+
+def prefix_query(text):
+    """to_tsquery text matching every word of the search text as a prefix. -> str (empty if there are no words, which
+    matches nothing)."""
+    return ' & '.join(word + ':*' for word in WORD.findall(text.lower()))
+
+
+class TextSearch:
+    """Handles postgres connection (from PGSQLConnection or PGSQLPool) using with statements
+    to search the pokedex, moves and abilities tables of the Pokemon database from create_db.py."""
+    def __init__(self, pgsql_connection):
+        """Pass PGSQLConnection (or PGSQLPool) object."""
+        self.pgsql_connection = pgsql_connection
+
+    @staticmethod
+    def statement(tables, prefix=True):
+        """Search statement over tables. -> SQL text."""
+        for table in tables:
+            if table not in SEARCH_TABLES:
+                raise ValueError("Table " + table + " is not searchable (" + ', '.join(SEARCH_TABLES) + ").")
+        tsquery = "to_tsquery('english', %(query)s)" if prefix else "websearch_to_tsquery('english', %(query)s)"
+        matches = 'UNION ALL'.join(MATCH_SQL.format(table=table, tsquery=tsquery) for table in tables)
+        return SEARCH_SQL.format(matches=matches, tsquery=tsquery)
+
+    def search(self, text, tables=SEARCH_TABLES, limit=10, offset=0, prefix=True, highlight=True):
+        """Search the name and info text of tables, best matches first. Use limit and offset to page through the
+        matches (the total column is the number of matches over every page). Highlighted fragments of the info text
+        (headline, matches in <b></b>) are only made for the rows of the page (use highlight=False to skip them).
+        -> pd dataframe of source table, id, name, rank, headline and total."""
+        query = prefix_query(text) if prefix else text
+        sql = self.statement(tables, prefix)
+        params = {'query': query, 'limit': limit, 'offset': offset, 'highlight': highlight,
+                  'options': HEADLINE_OPTIONS}
+        with self.pgsql_connection as conn_cur:
+            conn_cur[1].execute(sql, params)
+            data = select_frame(conn_cur[1].fetchall(), conn_cur[1].description)
+        return data
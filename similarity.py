@@ -0,0 +1,126 @@
+# similarity.py creates a base-stat similarity index of the pokedex table ("Pokemon similar to X").
+# The six base stats, height and weight of every Pokemon are loaded into a contiguous float32 matrix that is saved as
+# a .npy file per build version (build_info) under INDEX_DIR and opened memory-mapped, so every worker process on the
+# machine shares one copy from the page cache. The matrix is written once by the first process that needs it.
+# Distances are weighted Euclidean distances, optionally on z-scored columns (normalize=True, so height and weight do
+# not dwarf the stats). Normalizing only divides each column weight by the column variance, so it is folded into the
+# weights and the shared raw matrix is used as is: d^2 = |M|^2.w - 2 (Q*w).M^T + |Q|^2.w is one matrix product for a
+# whole batch of queries (computed in float64). Results can be filtered to Pokemon with one of a list of types or in
+# an evolution set.
+# See benchmark_similarity.py for a comparison with the SQL query.
+import json
+import os
+import numpy as np
+from ref_cache import RefCache
+
+
+# Stat columns of the pokedex table in the matrix.
+COLUMNS = ['hp', 'attack', 'defense', 's_attack', 's_defense', 'speed', 'height', 'weight']
+
+# Directory of the memory-mapped matrix files.
+INDEX_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.similarity')
+
+
+class StatIndex:
+    """Memory-mapped base-stat matrix of the pokedex table with batched k-nearest-neighbor queries."""
+    def __init__(self, pgsql_connection, weights=None, normalize=True, index_dir=INDEX_DIR):
+        """Pass PGSQLConnection (or PGSQLPool) object. Pass weights as a dictionary of column and weight (1 for the
+        columns left out, 0 to ignore a column)."""
+        self.pgsql_connection = pgsql_connection
+        self.index_dir = index_dir
+        self.load()
+        weights = np.array([1.0 if weights is None else float(weights.get(col, 1.0)) for col in COLUMNS])
+        if normalize:
+            variance = self.matrix.var(axis=0, dtype=np.float64)
+            weights = weights / np.where(variance > 0, variance, 1.0)
+        self.weights = weights
+        self.norms = np.square(self.matrix, dtype=np.float64) @ self.weights
+
+    def paths(self, version):
+        """Paths of the matrix and metadata files of a build version. -> (matrix path, metadata path)."""
+        name = 'pokedex-' + (version or 'unversioned')
+        return os.path.join(self.index_dir, name + '.npy'), os.path.join(self.index_dir, name + '.json')
+
+    def write(self, cur, version):
+        """Write the matrix and metadata (ids, names, types, evo sets) files of the current pokedex table."""
+        cur.execute("SELECT id, name, type, evo_set, " + ', '.join(COLUMNS) + " FROM pokedex ORDER BY id;")
+        rows = cur.fetchall()
+        matrix = np.array([[np.nan if x is None else float(x) for x in row[4:]] for row in rows],
+                          dtype=np.float32).reshape(-1, len(COLUMNS))
+        # Missing values get the column mean, so they neither attract nor repel neighbors.
+        means = np.nanmean(matrix, axis=0) if len(matrix) else np.zeros(len(COLUMNS))
+        matrix = np.where(np.isnan(matrix), np.nan_to_num(means), matrix)
+        meta = {'version': version, 'columns': COLUMNS, 'ids': [row[0] for row in rows],
+                'names': [row[1] for row in rows], 'types': [row[2] or [] for row in rows],
+                'evo_sets': [row[3] for row in rows]}
+        matrix_path, meta_path = self.paths(version)
+        os.makedirs(self.index_dir, exist_ok=True)
+        tmp = '.' + str(os.getpid()) + '.tmp'
+        with open(matrix_path + tmp, 'wb') as f:
+            np.save(f, np.ascontiguousarray(matrix), allow_pickle=False)
+        with open(meta_path + tmp, 'w') as f:
+            json.dump(meta, f)
+        os.replace(meta_path + tmp, meta_path)
+        os.replace(matrix_path + tmp, matrix_path)
+
+    def load(self):
+        """Open the matrix of the current build version memory-mapped (writing it first if it does not exist)."""
+        with self.pgsql_connection as conn_cur:
+            version = RefCache.build_version(conn_cur[1])
+            matrix_path, meta_path = self.paths(version)
+            if not (os.path.exists(matrix_path) and os.path.exists(meta_path)):
+                self.write(conn_cur[1], version)
+        with open(meta_path) as f:
+            meta = json.load(f)
+        self.version = version
+        self.matrix = np.load(matrix_path, mmap_mode='r')
+        self.ids = np.array(meta['ids'], dtype=np.int64)
+        self.names = meta['names']
+        type_names = sorted({name for types in meta['types'] for name in types})
+        self.type_columns = {name: n for n, name in enumerate(type_names)}
+        self.type_matrix = np.zeros((len(self.ids), len(type_names)), dtype=bool)
+        for n, types in enumerate(meta['types']):
+            self.type_matrix[n, [self.type_columns[name] for name in types]] = True
+        self.evo_sets = np.array([-1 if x is None else x for x in meta['evo_sets']], dtype=np.int64)
+        self.rows = {name: n for n, name in enumerate(self.names)}
+        self.rows.update({int(i): n for n, i in enumerate(self.ids)})
+
+    def mask(self, types=None, evo_set=None):
+        """Rows allowed by the filters (Pokemon with one of types, in evo_set). -> bool array."""
+        allowed = np.ones(len(self.ids), dtype=bool)
+        if types is not None:
+            columns = [self.type_columns[name] for name in types if name in self.type_columns]
+            allowed &= self.type_matrix[:, columns].any(axis=1)
+        if evo_set is not None:
+            allowed &= self.evo_sets == evo_set
+        return allowed
+
+    def search(self, vectors, k=5, types=None, evo_set=None, exclude=None):
+        """Find the k nearest Pokemon of a batch of stat vectors (one row of COLUMNS values per query). Pass exclude as
+        one row index per query to leave out (e.g. the query Pokemon itself, -1 for none).
+        -> (row indexes, distances) arrays of shape (queries, k), nearest first."""
+        vectors = np.asarray(vectors, dtype=np.float64).reshape(-1, len(COLUMNS))
+        squared = (self.norms[np.newaxis, :] - 2 * ((vectors * self.weights) @ self.matrix.T)
+                   + (np.square(vectors) @ self.weights)[:, np.newaxis])
+        squared[:, ~self.mask(types, evo_set)] = np.inf
+        if exclude is not None:
+            exclude = np.asarray(exclude)
+            valid = exclude >= 0
+            squared[np.nonzero(valid)[0], exclude[valid]] = np.inf
+        k = min(k, squared.shape[1])
+        if k < squared.shape[1]:
+            nearest = np.argpartition(squared, k - 1, axis=1)[:, :k]
+        else:
+            nearest = np.tile(np.arange(squared.shape[1]), (len(squared), 1))
+        order = np.argsort(np.take_along_axis(squared, nearest, axis=1), axis=1, kind='stable')
+        nearest = np.take_along_axis(nearest, order, axis=1)
+        distances = np.sqrt(np.maximum(np.take_along_axis(squared, nearest, axis=1), 0))
+        return nearest, distances
+
+    def similar(self, pokemon, k=5, types=None, evo_set=None):
+        """Find the k Pokemon most similar to each Pokemon in a list of ids or names (leaving the Pokemon itself out).
+        -> list of lists of (id, name, distance) tuples, nearest first (finite distances only)."""
+        rows = [self.rows[p] for p in pokemon]
+        nearest, distances = self.search(self.matrix[rows], k, types, evo_set, exclude=rows)
+        return [[(int(self.ids[n]), self.names[n], float(d)) for n, d in zip(row, dist) if np.isfinite(d)]
+                for row, dist in zip(nearest, distances)]
@@ -0,0 +1,220 @@
+# python3 snapshot.py
+# snapshot.py creates versioned columnar snapshots of the relational tables, so notebooks and batch jobs can read them
+# without a Postgres connection. export_snapshot copies each table out of the database with COPY ... TO STDOUT (one
+# JSON object per row, parsed by pyarrow into typed columns, with arrays as list columns) inside one read-only
+# transaction, and writes it as an uncompressed Arrow IPC file under SNAPSHOT_DIR/<build version>/ (build_info), along
+# with a Parquet copy of the tables in PARQUET_TABLES for publishing (e.g. the pokedex Kaggle dataset). The link tables
+# (pokemon_moves, pokemon_abilities) are stored in CSR form: one list row per pokedex id, so the offsets of the list
+# column are the row pointers and its values the linked ids. A snapshot is written to a temporary directory and renamed
+# into place, then the latest file is pointed at it.
+# Snapshot memory-maps the Arrow files, so opening one only reads the manifest and every column is a zero-copy view of
+# the page cache shared by every process on the machine (to_pandas and frame() copy, table() and links() do not).
+# Requires pyarrow (pip install pyarrow), which is imported on first use, so the module (and its constants) can be
+# imported without it. See benchmark_snapshot.py for load times compared with select queries.
+import io
+import json
+import os
+import shutil
+import time
+import numpy as np
+from ref_cache import RefCache, SKIP_COLUMNS
+
+
+# Directory of the snapshots (one directory per build version and a latest file naming the newest one).
+SNAPSHOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.snapshots')
+
+# Tables exported as they are (ordered by their first column).
+SNAPSHOT_TABLES = ['pokedex', 'moves', 'abilities', 'types', 'type_efficacy']
+
+# Link tables exported in CSR form: the pokedex id column and the linked id column.
+LINK_TABLES = {'pokemon_moves': ('poke_id', 'move_id'), 'pokemon_abilities': ('poke_id', 'ability_id')}
+
+# Tables also written as Parquet files.
+PARQUET_TABLES = ['pokedex']
+
+# Arrow types of the Postgres column types (by type oid, as pyarrow type aliases, arrays as a list of the alias of their
+# elements), other types are exported as text.
+ARROW_TYPES = {16: 'bool', 20: 'int64', 21: 'int16', 23: 'int32', 700: 'float32', 701: 'float64', 1700: 'float64',
+               25: 'string', 1043: 'string', 1000: ['bool'], 1005: ['int16'], 1007: ['int32'], 1016: ['int64'],
+               1009: ['string'], 1015: ['string']}
+
+# Copy the rows of a select statement as one JSON object per line (the quote and delimiter characters can't appear in
+# JSON text, so the lines are copied as they are).
+COPY_SQL = r"""
+COPY (SELECT row_to_json(t) FROM ({select}) AS t) TO STDOUT WITH (FORMAT csv, QUOTE e'\x01', DELIMITER e'\x02');
+"""
+
+
+def arrow():
+    """Import pyarrow with the json and parquet modules used by snapshots. -> pyarrow module."""
+    try:
+        import pyarrow
+        import pyarrow.json
+        import pyarrow.parquet
+    except ImportError as error:
+        raise ImportError("snapshot.py requires pyarrow (pip install pyarrow).") from error
+    return pyarrow
+
+
+def arrow_type(pa, type_code):
+    """Arrow type of a Postgres column type oid. -> pa data type (None for columns exported as text)."""
+    kind = ARROW_TYPES.get(type_code)
+    if isinstance(kind, list):
+        return pa.list_(pa.type_for_alias(kind[0]))
+    return None if kind is None else pa.type_for_alias(kind)
+
+
+def copy_table(cur, table, order_by=None):
+    """Copy a table (without the SKIP_COLUMNS) out of the database in JSON lines. -> pa table."""
+    pa = arrow()
+    cur.execute("SELECT * FROM " + table + " LIMIT 0;")
+    columns = [(col.name, arrow_type(pa, col.type_code)) for col in cur.description if col.name not in SKIP_COLUMNS]
+    select = ("SELECT " + ', '.join(name if kind is not None else name + '::text' for name, kind in columns) +
+              " FROM " + table + " ORDER BY " + (order_by or columns[0][0]))
+    schema = pa.schema([(name, pa.string() if kind is None else kind) for name, kind in columns])
+    sink = io.BytesIO()
+    cur.copy_expert(COPY_SQL.format(select=select), sink)
+    data = pa.py_buffer(sink.getbuffer())
+    if not data.size:
+        return schema.empty_table()
+    options = pa.json.ParseOptions(explicit_schema=schema, unexpected_field_behavior='error')
+    return pa.json.read_json(pa.BufferReader(data), parse_options=options).combine_chunks()
+
+
+def csr_table(ids, pairs, id_col, link_col):
+    """CSR form of a link table: one row per id (sorted) with the sorted list of its linked ids. -> pa table."""
+    pa = arrow()
+    owners = pairs.column(id_col).to_numpy()
+    linked = pairs.column(link_col).to_numpy()
+    keep = np.isin(owners, ids)
+    owners, linked = owners[keep], linked[keep]
+    offsets = np.append(np.searchsorted(owners, ids, side='left'), len(owners)).astype(np.int32)
+    values = pa.ListArray.from_arrays(pa.array(offsets), pa.array(linked, type=pa.int32()))
+    return pa.table({id_col: pa.array(ids, type=pa.int32()), link_col: values})
+
+
+def write_arrow(table, path):
+    """Write a table as an uncompressed Arrow IPC file (one record batch, so every column is contiguous)."""
+    pa = arrow()
+    with pa.OSFile(path, 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table.combine_chunks(), max_chunksize=max(table.num_rows, 1))
+
+
+def export_snapshot(pgsql_connection, snapshot_dir=SNAPSHOT_DIR, overwrite=False):
+    """Export the tables of the current build into a snapshot directory (kept as is if the snapshot of the build version
+    already exists, unless overwrite=True). Pass PGSQLConnection (or PGSQLPool) object. -> snapshot path."""
+    with pgsql_connection as conn_cur:
+        cur = conn_cur[1]
+        cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY;")
+        version = RefCache.build_version(cur) or 'unversioned'
+        path = os.path.join(snapshot_dir, version)
+        if os.path.exists(os.path.join(path, 'manifest.json')) and not overwrite:
+            write_latest(snapshot_dir, version)
+            return path
+        start = time.perf_counter()
+        tables = {table: copy_table(cur, table) for table in SNAPSHOT_TABLES}
+        ids = tables['pokedex'].column('id').to_numpy()
+        for table, (id_col, link_col) in LINK_TABLES.items():
+            pairs = copy_table(cur, table, id_col + ', ' + link_col)
+            tables[table] = csr_table(ids, pairs, id_col, link_col)
+        copy_seconds = time.perf_counter() - start
+
+    tmp = os.path.join(snapshot_dir, '.' + version + '.' + str(os.getpid()) + '.tmp')
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    manifest = {'version': version, 'created': time.time(), 'copy_seconds': round(copy_seconds, 6), 'tables': {},
+                'links': {table: list(cols) for table, cols in LINK_TABLES.items()}}
+    for table, data in tables.items():
+        write_arrow(data, os.path.join(tmp, table + '.arrow'))
+        if table in PARQUET_TABLES:
+            arrow().parquet.write_table(data, os.path.join(tmp, table + '.parquet'), compression='zstd')
+        manifest['tables'][table] = {'rows': data.num_rows, 'columns': data.schema.names}
+    with open(os.path.join(tmp, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=1)
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.rename(tmp, path)
+    write_latest(snapshot_dir, version)
+    return path
+
+
+def write_latest(snapshot_dir, version):
+    """Point the latest file of snapshot_dir at a snapshot version (atomically)."""
+    tmp = os.path.join(snapshot_dir, 'latest.' + str(os.getpid()) + '.tmp')
+    with open(tmp, 'w') as f:
+        f.write(version)
+    os.replace(tmp, os.path.join(snapshot_dir, 'latest'))
+
+
+def view(array):
+    """Zero-copy numpy view of the data buffer of an int32 pyarrow array without nulls. -> numpy array."""
+    return np.frombuffer(array.buffers()[1], dtype=np.int32, count=len(array), offset=array.offset * 4)
+
+
+class Snapshot:
+    """Memory-mapped columnar snapshot of the Pokemon database (no Postgres connection needed)."""
+    def __init__(self, version=None, snapshot_dir=SNAPSHOT_DIR):
+        """Open the snapshot of a build version (the latest export if None). Tables are mapped on first use."""
+        if version is None:
+            with open(os.path.join(snapshot_dir, 'latest')) as f:
+                version = f.read().strip()
+        self.path = os.path.join(snapshot_dir, version)
+        with open(os.path.join(self.path, 'manifest.json')) as f:
+            self.manifest = json.load(f)
+        self.version = self.manifest['version']
+        self.tables = {}
+
+    def table(self, name):
+        """Table of the snapshot, mapped from its Arrow file (zero-copy). -> pa table."""
+        if name not in self.tables:
+            pa = arrow()
+            if name not in self.manifest['tables']:
+                raise ValueError("Table " + name + " is not in the snapshot (" + ', '.join(self.manifest['tables']) +
+                                 ").")
+            source = pa.memory_map(os.path.join(self.path, name + '.arrow'), 'r')
+            self.tables[name] = pa.ipc.open_file(source).read_all()
+        return self.tables[name]
+
+    def frame(self, name):
+        """Table of the snapshot as a dataframe (a copy, like select_frame in trainer.py). -> pd dataframe."""
+        return self.table(name).to_pandas()
+
+    def links(self, name):
+        """CSR arrays of a link table (zero-copy): the sorted pokedex ids, the row pointers (the linked ids of ids[n]
+        are indices[indptr[n]:indptr[n + 1]]) and the linked ids. -> (ids, indptr, indices) numpy arrays."""
+        if name not in self.manifest['links']:
+            raise ValueError("Table " + name + " is not a link table (" + ', '.join(self.manifest['links']) + ").")
+        id_col, link_col = self.manifest['links'][name]
+        data = self.table(name)
+        if not data.num_rows:
+            return np.zeros(0, np.int32), np.zeros(1, np.int32), np.zeros(0, np.int32)
+        values = data.column(link_col).chunk(0)
+        return view(data.column(id_col).chunk(0)), view(values.offsets), view(values.values)
+
+    def linked(self, name, poke_id):
+        """Ids linked to one Pokemon in a link table (e.g. the move ids of a Pokemon in pokemon_moves).
+        -> numpy array (empty if the id is not in the snapshot)."""
+        ids, indptr, indices = self.links(name)
+        row = np.searchsorted(ids, poke_id)
+        if row == len(ids) or ids[row] != poke_id:
+            return indices[:0]
+        return indices[indptr[row]:indptr[row + 1]]
+
+
+# Export a snapshot of the current database when the module runs as main.
+if __name__ == "__main__":
+    import argparse
+    import hidden
+    from trainer import PGSQLConnection
+    parser = argparse.ArgumentParser(description="Export a columnar snapshot of the Pokemon database.")
+    parser.add_argument('--snapshot-dir', default=SNAPSHOT_DIR, help="directory of the snapshots")
+    parser.add_argument('--overwrite', action='store_true', help="export again if the build version already exists")
+    args = parser.parse_args()
+    secrets = hidden.secrets()
+    pgsql_conn = PGSQLConnection(host=secrets['host'], port=secrets['port'], database=secrets['database'],
+                                 user=secrets['user'], password=secrets['pass'])
+    snapshot_path = export_snapshot(pgsql_conn, args.snapshot_dir, args.overwrite)
+    tables = Snapshot(os.path.basename(snapshot_path), args.snapshot_dir).manifest['tables']
+    print("Exported", ', '.join(name + ' (' + str(info['rows']) + ' rows)' for name, info in tables.items()), "to",
+          snapshot_path + ".")
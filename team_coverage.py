@@ -0,0 +1,222 @@
+# team_coverage.py creates a vectorized type coverage engine over pokedex.type and the type_efficacy table from
+# create_db.py, used to score and complete trainer teams (TrainerPack.MAX_POKEMON Pokemon).
+# Coverage only depends on the types of each member, so the Pokemon are grouped by type combination and every
+# combination gets packed bitsets of the type combinations it hits super effectively (offense), of the attacking types
+# it resists and of the attacking types it is weak to. Scoring a batch of teams is then a gather, an OR over the members
+# (the weaknesses are counted per type with bitwise adders) and a popcount in numpy, so millions of candidate teams are
+# scored per second.
+# Team score: share of the type combinations in the pokedex that some member hits super effectively with one of its own
+# types, plus the share of attacking types that some member resists (or is immune to), minus the share of attacking
+# types that at least half of the team is weak to.
+# Running module as main scores the team of the default trainer and prints its best completions.
+import itertools
+import time
+import numpy as np
+from trainer import TrainerPack
+
+
+# Number of type combinations (the best single additions to the partial team) searched by best_completions.
+POOL = 40
+
+# Number of candidate teams scored per numpy batch.
+BATCH = 200000
+
+# Number of set bits in each byte value (popcount for numpy versions without np.bitwise_count).
+BYTE_BITS = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+def popcounts(bits):
+    """Count the set bits of each row of packed uint64 words. -> int array."""
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(bits).sum(axis=-1, dtype=np.int64)
+    return BYTE_BITS[bits.view(np.uint8)].sum(axis=-1, dtype=np.int64)
+
+
+def combinations(n, r, batch=BATCH):
+    """Yield every combination of r of range(n) in lexicographic order in batches of rows. The first r - 1 members
+    come from itertools and the last member is expanded in numpy. -> generator of int arrays."""
+    if r == 1:
+        yield np.arange(n).reshape(-1, 1)
+        return
+    prefixes = itertools.combinations(range(n), r - 1)
+    while True:
+        heads = np.fromiter(itertools.chain.from_iterable(itertools.islice(prefixes, max(1, batch // n))),
+                            dtype=np.int64).reshape(-1, r - 1)
+        if not len(heads):
+            return
+        counts = n - 1 - heads[:, -1]
+        starts = np.cumsum(counts) - counts
+        tails = np.arange(counts.sum()) - np.repeat(starts, counts) + np.repeat(heads[:, -1] + 1, counts)
+        yield np.column_stack([np.repeat(heads, counts, axis=0), tails])
+
+
+def pack(flags):
+    """Pack each row of a boolean matrix into uint64 words. -> uint64 array."""
+    packed = np.packbits(flags, axis=1, bitorder='little')
+    packed = np.pad(packed, ((0, 0), (0, -packed.shape[1] % 8)))
+    return np.ascontiguousarray(packed).view('<u8')
+
+
+class TypeCoverage:
+    """Handles postgres connection (from PGSQLConnection or PGSQLPool) using with statements
+    to load the Pokemon types and damage factors, and scores the type coverage of teams."""
+    def __init__(self, pgsql_connection):
+        """Pass PGSQLConnection (or PGSQLPool) object. The types and damage factors are loaded once."""
+        self.pgsql_connection = pgsql_connection
+        self.teams_per_second = None
+        self.load()
+
+    def load(self):
+        """Load the types, the type_efficacy matrix and the type combination of each Pokemon, and build the coverage
+        bitsets of each type combination."""
+        with self.pgsql_connection as conn_cur:
+            conn_cur[1].execute("SELECT id, name FROM types ORDER BY id;")
+            type_rows = conn_cur[1].fetchall()
+            conn_cur[1].execute("SELECT attack_type, defend_type, factor FROM type_efficacy;")
+            factors = conn_cur[1].fetchall()
+            conn_cur[1].execute("SELECT id, type FROM pokedex ORDER BY id;")
+            pokemon = conn_cur[1].fetchall()
+        # Only the types some Pokemon has are attacking/defending types (e.g. not the unknown and shadow types).
+        names = {name: type_id for type_id, name in type_rows}
+        used = sorted({names[name] for _, types in pokemon for name in types or [] if name in names})
+        position = {type_id: n for n, type_id in enumerate(used)}
+        self.type_names = [dict(type_rows)[type_id] for type_id in used]
+        efficacy = np.ones((len(used), len(used)))
+        for attack_type, defend_type, factor in factors:
+            if attack_type in position and defend_type in position:
+                efficacy[position[attack_type], position[defend_type]] = float(factor)
+        self.efficacy = efficacy
+
+        combos = {}
+        self.poke_ids = np.array([poke_id for poke_id, _ in pokemon], dtype=np.int64)
+        self.poke_combo = np.array([combos.setdefault(tuple(sorted(position[names[name]] for name in types or []
+                                                                   if name in names)), len(combos))
+                                    for _, types in pokemon], dtype=np.int64)
+        self.combos = list(combos)
+        # Damage factor of every attacking type against each combination, and the best factor of each combination's
+        # own types against every combination.
+        defense = np.array([np.prod(efficacy[:, list(combo)], axis=1) for combo in self.combos])
+        offense = np.array([np.max([defense[:, t] for t in combo], axis=0) if combo else np.zeros(len(self.combos))
+                            for combo in self.combos])
+        self.hits = pack(offense > 1)
+        self.resists = pack(defense < 1)
+        self.weak = pack(defense > 1)
+        self.weak_counts = (defense > 1).astype(np.int64)
+        self.all_types = pack(np.ones((1, len(used)), dtype=bool))[0]
+
+    def combo_of(self, poke_ids):
+        """Type combination index of each Pokemon id. -> int array."""
+        return self.poke_combo[np.searchsorted(self.poke_ids, poke_ids)]
+
+    def fixed(self, combos):
+        """Coverage of fixed team members (OR of their bitsets and the number of members weak to each type).
+        -> (hits, resists, weak counts, size) tuple."""
+        combos = np.asarray(combos, dtype=np.int64)
+        return (np.bitwise_or.reduce(self.hits[combos], axis=0, initial=0),
+                np.bitwise_or.reduce(self.resists[combos], axis=0, initial=0),
+                self.weak_counts[combos].sum(axis=0), len(combos))
+
+    def scores(self, teams, fixed=None):
+        """Score a batch of teams (one row of type combination indices per team, added to the fixed members).
+        -> (scores, offense counts, resisted counts, shared weakness counts) arrays."""
+        teams = np.asarray(teams, dtype=np.int64)
+        hits, resists, weak, size = self.fixed([]) if fixed is None else fixed
+        size += teams.shape[1]
+        offense = popcounts(np.bitwise_or.reduce(self.hits[teams], axis=1) | hits)
+        resisted = popcounts(np.bitwise_or.reduce(self.resists[teams], axis=1) | resists)
+        # Bit planes of the number of members weak to each type (plane i holds bit i of the count), one member added
+        # at a time with a ripple carry, then compared with half of the team.
+        planes = [np.tile(pack(((weak >> i) & 1).astype(bool).reshape(1, -1)), (len(teams), 1))
+                  for i in range(size.bit_length())]
+        for member in teams.T:
+            carry = self.weak[member]
+            for plane in planes:
+                plane ^= carry
+                carry = carry & ~plane
+        threshold = (size + 1) // 2
+        greater = np.zeros_like(planes[0])
+        equal = np.broadcast_to(self.all_types, greater.shape).copy()
+        for i in reversed(range(len(planes))):
+            if threshold >> i & 1:
+                equal &= planes[i]
+            else:
+                greater |= equal & planes[i]
+                equal &= ~planes[i]
+        shared = popcounts(greater | equal)
+        types = len(self.type_names)
+        return offense / len(self.combos) + (resisted - shared) / types, offense, resisted, shared
+
+    def team_score(self, poke_ids):
+        """Score the coverage of one team of Pokemon ids. -> dictionary."""
+        combos = self.combo_of(poke_ids)
+        score, offense, resisted, shared = (x[0] for x in self.scores(combos.reshape(1, -1)))
+        weak = self.weak_counts[combos].sum(axis=0)
+        return {'score': float(score), 'offense': int(offense), 'resisted': int(resisted),
+                'shared_weaknesses': int(shared), 'combos': len(self.combos), 'types': len(self.type_names),
+                'weak_to': [name for name, n in zip(self.type_names, weak) if n * 2 >= len(combos)]}
+
+    def best_completions(self, poke_ids, top=10, pool=POOL, size=None):
+        """Search the best completions of a partial team of Pokemon ids up to size members (TrainerPack.MAX_POKEMON by
+        default). Every team of pool type combinations (the best single additions to the partial team) is scored in
+        numpy batches. -> list of (score, type names of each added member, Pokemon ids of each added member) tuples,
+        best first."""
+        size = TrainerPack.MAX_POKEMON if size is None else size
+        fixed = self.fixed(self.combo_of(poke_ids))
+        missing = size - len(poke_ids)
+        if missing <= 0:
+            return [(self.team_score(poke_ids)['score'], [], [])]
+        singles = self.scores(np.arange(len(self.combos)).reshape(-1, 1), fixed)[0]
+        candidates = np.argsort(-singles, kind='stable')[:pool]
+        best_scores = np.empty(0)
+        best_teams = np.empty((0, min(missing, len(candidates))), dtype=np.int64)
+        start = time.perf_counter()
+        scored = 0
+        for batch in combinations(len(candidates), best_teams.shape[1]):
+            if not len(batch):
+                continue
+            batch = candidates[batch]
+            scored += len(batch)
+            batch_scores = self.scores(batch, fixed)[0]
+            keep = np.argpartition(-batch_scores, min(top, len(batch)) - 1)[:top]
+            best_scores = np.concatenate([best_scores, batch_scores[keep]])
+            best_teams = np.concatenate([best_teams, batch[keep]])
+            order = np.argsort(-best_scores, kind='stable')[:top]
+            best_scores, best_teams = best_scores[order], best_teams[order]
+        self.teams_per_second = scored / max(time.perf_counter() - start, 1e-9)
+        return [(float(score), [[self.type_names[t] for t in self.combos[c]] for c in team],
+                 [self.poke_ids[self.poke_combo == c].tolist() for c in team])
+                for score, team in zip(best_scores, best_teams)]
+
+    def trainer_team(self, trainer=TrainerPack.DEFAULT_TRAINER):
+        """Get the Pokemon ids of the team of a trainer (by name or id). -> list of ints."""
+        column = "o.name" if isinstance(trainer, str) else "o.id"
+        with self.pgsql_connection as conn_cur:
+            conn_cur[1].execute("SELECT t.poke_id FROM trainer AS t JOIN trainers AS o ON o.id = t.owner_id "
+                                "WHERE " + column + " = %s ORDER BY t.id;", (trainer,))
+            poke_ids = [x[0] for x in conn_cur[1].fetchall()]
+        return poke_ids
+
+    def complete_trainer(self, top=10, pool=POOL, trainer=TrainerPack.DEFAULT_TRAINER):
+        """Search the best completions of the team of a trainer (by name or id) up to the max number of Pokemon of the
+        trainer. -> list as in best_completions."""
+        column = "name" if isinstance(trainer, str) else "id"
+        with self.pgsql_connection as conn_cur:
+            conn_cur[1].execute("SELECT max_pokemon FROM trainers WHERE " + column + " = %s;", (trainer,))
+            size = conn_cur[1].fetchall()[0][0]
+        return self.best_completions(self.trainer_team(trainer), top, pool, size)
+
+
+# Code to run when module runs as main. Does not run when module is imported.
+# Scores the team of the default trainer and prints its best completions.
+if __name__ == "__main__":
+    import hidden
+    from trainer import PGSQLConnection
+    secrets = hidden.secrets()
+    pgsql_conn = PGSQLConnection(host=secrets['host'], port=secrets['port'], database=secrets['database'],
+                                 user=secrets['user'], password=secrets['pass'])
+    coverage = TypeCoverage(pgsql_conn)
+    trainer = coverage.trainer_team()
+    print("Trainer team", trainer, coverage.team_score(trainer))
+    for score, types, choices in coverage.best_completions(trainer, top=5):
+        print(round(score, 4), types, [ids[:3] for ids in choices])
+    print(round(coverage.teams_per_second), "teams scored per second.")
@@ -0,0 +1,49 @@
+# Shared fixtures of the tests. The tests only cover the parts of the modules that run without a database: the query
+# helpers that load their data once get a FakeConnection that answers those queries from fixed rows.
+import pytest
+
+
+class FakeCursor:
+    """Cursor answering each query with the rows of the first SQL fragment it contains."""
+    def __init__(self, answers):
+        """Pass a list of (SQL fragment, rows) pairs."""
+        self.answers = answers
+        self.rows = []
+
+    def execute(self, sql, params=None):
+        """Pick the rows of the query (a query without an answer fails the test)."""
+        for fragment, rows in self.answers:
+            if fragment in sql:
+                self.rows = list(rows)
+                return
+        raise AssertionError("Unexpected query: " + sql)
+
+    def fetchall(self):
+        """Rows of the last query. -> list of tuples."""
+        return self.rows
+
+    def fetchone(self):
+        """First row of the last query. -> tuple or None."""
+        return self.rows[0] if self.rows else None
+
+
+class FakeConnection:
+    """Stand-in of PGSQLConnection with the same with statement interface."""
+    def __init__(self, answers):
+        """Pass a list of (SQL fragment, rows) pairs."""
+        self.answers = answers
+
+    def __enter__(self):
+        """Open a fake cursor. -> (None, cursor)."""
+        return None, FakeCursor(self.answers)
+
+    def __exit__(self, exc_type, exc_value, tb):
+        """Nothing to commit or close."""
+
+
+@pytest.fixture
+def fake_connection():
+    """Factory of FakeConnection objects. Databases without build_info are answered by default."""
+    def make(answers):
+        return FakeConnection(list(answers) + [("to_regclass('build_info')", [(False,)])])
+    return make
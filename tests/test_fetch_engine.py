@@ -0,0 +1,106 @@
+# Tests of the retry and backoff of fetch_engine.py against a local MockAPI (mock_api.py) with injected faults.
+import asyncio
+import time
+import pytest
+import fetch_engine
+from fetch_engine import HostLimiter, fetch_all, retry_after_seconds
+from metrics import METRICS
+from mock_api import ERROR_STATUS, MockAPI, SyntheticPages
+
+
+PAGES = 30
+
+
+@pytest.fixture
+def serve(monkeypatch):
+    """Start MockAPI servers of a few synthetic Pokemon (stopped after the test), with a fast backoff."""
+    monkeypatch.setattr(fetch_engine, 'BACKOFF_BASE', 0.001)
+    METRICS.reset()
+    apis = []
+
+    def start(**faults):
+        api = MockAPI(SyntheticPages(pokemon=PAGES, types=3, moves=10, abilities=5, details=1), **faults).start()
+        apis.append(api)
+        return api
+    yield start
+    for api in apis:
+        api.stop()
+
+
+def fetch(api, max_retries):
+    """Fetch every Pokemon page of a MockAPI. -> (dictionary of id and text, failed ids and statuses)."""
+    pages = {}
+
+    async def emit(i, text):
+        pages[i] = text
+
+    id_urls = [(i, api.url + 'pokemon/' + str(i)) for i in range(1, PAGES + 1)]
+    failed = asyncio.run(fetch_all(id_urls, emit, max_retries=max_retries))
+    return pages, failed
+
+
+def counter(name, **labels):
+    """Value of a METRICS counter summed over the series matching labels. -> int."""
+    return sum(value for (key, series), value in METRICS.counters.items()
+               if key == name and labels.items() <= dict(series).items())
+
+
+def test_retry_after_seconds():
+    assert retry_after_seconds(None) is None
+    assert retry_after_seconds('3') == 3.0
+    assert retry_after_seconds('-1') == 0.0
+    assert retry_after_seconds('soon') is None
+    assert retry_after_seconds('Wed, 21 Oct 2015 07:28:00 GMT') == 0.0
+
+
+def test_host_limiter_aimd():
+    async def run():
+        limiter = HostLimiter(start=8, max_limit=10)
+        limiter.throttled()
+        halved = limiter.limit
+        limiter.throttled()
+        for _ in range(100):
+            limiter.success()
+        return halved, limiter.limit
+    halved, grown = asyncio.run(run())
+    # A second throttle within a second does not cut the limit again, and successes grow it up to max_limit.
+    assert halved == 4
+    assert grown == 10
+
+
+def test_throttled_and_failed_pages_are_retried(serve):
+    api = serve(throttle=0.3, errors=0.2, retry_after=None, seed=3)
+    pages, failed = fetch(api, max_retries=20)
+    assert failed == {}
+    assert sorted(pages) == list(range(1, PAGES + 1))
+    assert all('"id": ' + str(i) in text for i, text in pages.items())
+    status = api.stats()['status']
+    retried = sum(status.get(str(code), 0) for code in [429] + ERROR_STATUS)
+    assert retried > 0
+    assert counter('fetch_retries_total') == retried
+
+
+def test_retry_after_is_honored(serve):
+    api = serve(throttle=0.5, retry_after=0.3, seed=5)
+    start = time.perf_counter()
+    pages, failed = fetch(api, max_retries=20)
+    assert failed == {}
+    assert len(pages) == PAGES
+    assert time.perf_counter() - start >= 0.3
+
+
+def test_retries_are_bounded(serve):
+    api = serve(errors=1.0)
+    pages, failed = fetch(api, max_retries=2)
+    assert pages == {}
+    assert sorted(failed) == list(range(1, PAGES + 1))
+    assert set(failed.values()) <= set(ERROR_STATUS)
+    assert api.stats()['requests'] == 3 * PAGES
+    assert counter('fetch_errors_total') == PAGES
+
+
+def test_missing_pages_are_not_retried(serve):
+    api = serve(missing=1.0, missing_in=['pokemon'])
+    pages, failed = fetch(api, max_retries=5)
+    assert failed == {i: 404 for i in range(1, PAGES + 1)}
+    assert api.stats()['status'] == {'404': PAGES}
@@ -0,0 +1,42 @@
+# Tests of the packed bitsets of learnset.py against brute force set operations.
+import random
+import numpy as np
+import pytest
+from learnset import Bitsets, popcount
+
+
+def members(bits, poke_ids):
+    """Pokemon ids of the set bits of a bitset (as decoded by LearnsetIndex.find). -> set."""
+    flags = np.unpackbits(bits.astype('<u8').view(np.uint8), bitorder='little')[:len(poke_ids)]
+    return set(poke_ids[flags.view(bool)].tolist())
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_bitsets_match_brute_force(seed):
+    rnd = random.Random(seed)
+    # Pokemon ids with gaps, over more than one word, and pairs of keys with known and unknown Pokemon ids.
+    poke_ids = np.array(sorted(rnd.sample(range(1, 400), rnd.randint(1, 200))), dtype=np.int64)
+    keys = list(range(1, 30))
+    pairs = {(rnd.choice(keys), rnd.choice(poke_ids.tolist() + [999])) for _ in range(rnd.randint(0, 600))}
+    sets = {key: {poke_id for k, poke_id in pairs if k == key and poke_id != 999} for key in keys}
+    bitsets = Bitsets(poke_ids, sorted(pairs))
+    everyone = set(poke_ids.tolist())
+
+    for _ in range(50):
+        query = rnd.sample(keys + [1000], rnd.randint(0, 4))
+        expected_all = set(everyone)
+        for key in query:
+            expected_all &= sets.get(key, set())
+        expected_any = set().union(*(sets.get(key, set()) for key in query))
+        assert members(bitsets.all(query), poke_ids) == expected_all
+        assert members(bitsets.any(query), poke_ids) == expected_any
+        assert popcount(bitsets.all(query)) == len(expected_all)
+        assert popcount(bitsets.any(query)) == len(expected_any)
+
+
+def test_empty_link_table():
+    poke_ids = np.array([1, 2, 3], dtype=np.int64)
+    bitsets = Bitsets(poke_ids, [])
+    assert members(bitsets.all([]), poke_ids) == {1, 2, 3}
+    assert members(bitsets.all([5]), poke_ids) == set()
+    assert members(bitsets.any([5]), poke_ids) == set()
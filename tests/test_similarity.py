@@ -0,0 +1,69 @@
+# Tests of the k-nearest-neighbor queries of similarity.py against brute force weighted distances.
+import random
+import numpy as np
+import pytest
+from similarity import COLUMNS, StatIndex
+
+
+TYPES = ['fire', 'water', 'grass']
+
+
+def pokedex_rows(seed, count=60):
+    """Random pokedex rows (id, name, type, evo_set, COLUMNS values), with a missing height. -> list of tuples."""
+    rnd = random.Random(seed)
+    rows = [(i, 'poke' + str(i), rnd.sample(TYPES, rnd.randint(1, 2)), rnd.randint(1, 10)) +
+            tuple(rnd.randint(1, 255) for _ in COLUMNS[:6]) + (rnd.randint(1, 40), rnd.randint(1, 2000))
+            for i in range(1, count + 1)]
+    rows[3] = rows[3][:10] + (None,) + rows[3][11:]
+    return rows
+
+
+def brute_force(rows, weights, normalize, query, k, types=None, evo_set=None):
+    """The k nearest Pokemon of a query Pokemon id by weighted Euclidean distance. -> list of (id, distance)."""
+    matrix = np.array([[np.nan if x is None else x for x in row[4:]] for row in rows], dtype=np.float32)
+    matrix = np.where(np.isnan(matrix), np.nanmean(matrix, axis=0), matrix).astype(np.float64)
+    w = np.array([weights.get(col, 1.0) for col in COLUMNS])
+    if normalize:
+        w = w / matrix.var(axis=0)
+    q = matrix[[row[0] for row in rows].index(query)]
+    found = [(row[0], float(np.sqrt(((matrix[n] - q) ** 2 * w).sum()))) for n, row in enumerate(rows)
+             if row[0] != query and (types is None or set(types) & set(row[2]))
+             and (evo_set is None or row[3] == evo_set)]
+    return sorted(found, key=lambda x: x[1])[:k]
+
+
+@pytest.mark.parametrize('normalize', [True, False])
+@pytest.mark.parametrize('seed', range(3))
+def test_similar_matches_brute_force(tmp_path, fake_connection, seed, normalize):
+    rows = pokedex_rows(seed)
+    weights = {'speed': 3.0, 'weight': 0.0}
+    index = StatIndex(fake_connection([("FROM pokedex", rows)]), weights=weights, normalize=normalize,
+                      index_dir=str(tmp_path))
+    for query in (1, 4, 30):
+        for filters in ({}, {'types': ['water']}, {'evo_set': rows[query - 1][3]}):
+            [found] = index.similar([query], k=5, **filters)
+            expected = brute_force(rows, weights, normalize, query, 5, **filters)
+            assert [poke_id for poke_id, _, _ in found] == [poke_id for poke_id, _ in expected]
+            assert [d for _, _, d in found] == pytest.approx([d for _, d in expected], rel=1e-4, abs=1e-6)
+
+
+def test_batch_and_names(tmp_path, fake_connection):
+    rows = pokedex_rows(7)
+    index = StatIndex(fake_connection([("FROM pokedex", rows)]), index_dir=str(tmp_path))
+    batch = index.similar([5, 'poke9', 12], k=3)
+    for result, query in zip(batch, [5, 9, 12]):
+        [single] = index.similar([query], k=3)
+        assert [row[:2] for row in result] == [row[:2] for row in single]
+        assert [row[2] for row in result] == pytest.approx([row[2] for row in single])
+    assert all(row[1] == 'poke' + str(row[0]) for result in batch for row in result)
+    # k larger than the pokedex returns every other Pokemon, and a filter without matches returns nothing.
+    assert len(index.similar([1], k=100)[0]) == len(rows) - 1
+    assert index.similar([1], k=5, types=['dragon']) == [[]]
+
+
+def test_matrix_is_reused(tmp_path, fake_connection):
+    rows = pokedex_rows(1)
+    StatIndex(fake_connection([("FROM pokedex", rows)]), index_dir=str(tmp_path))
+    # A second index of the same build version maps the saved matrix instead of reading the pokedex table.
+    index = StatIndex(fake_connection([]), index_dir=str(tmp_path))
+    assert index.ids.tolist() == [row[0] for row in rows]
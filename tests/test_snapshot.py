@@ -0,0 +1,49 @@
+# Tests of the CSR link tables of snapshot.py: csr_table, written as an Arrow file and mapped back by Snapshot.links.
+import json
+import random
+import numpy as np
+import pytest
+from snapshot import Snapshot, csr_table, write_arrow, write_latest
+
+pa = pytest.importorskip('pyarrow')
+
+
+def export_links(tmp_path, ids, pairs):
+    """Write a snapshot with one link table (pokemon_moves) of sorted (poke_id, move_id) pairs. -> Snapshot."""
+    pairs = sorted(pairs)
+    pair_table = pa.table({'poke_id': pa.array([p for p, _ in pairs], type=pa.int32()),
+                           'move_id': pa.array([m for _, m in pairs], type=pa.int32())})
+    table = csr_table(np.array(ids), pair_table, 'poke_id', 'move_id')
+    path = tmp_path / 'v1'
+    path.mkdir()
+    write_arrow(table, str(path / 'pokemon_moves.arrow'))
+    manifest = {'version': 'v1', 'tables': {'pokemon_moves': {'rows': table.num_rows}},
+                'links': {'pokemon_moves': ['poke_id', 'move_id']}}
+    (path / 'manifest.json').write_text(json.dumps(manifest))
+    write_latest(str(tmp_path), 'v1')
+    return Snapshot(snapshot_dir=str(tmp_path))
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_csr_round_trip(tmp_path, seed):
+    rnd = random.Random(seed)
+    ids = sorted(rnd.sample(range(1, 300), rnd.randint(1, 100)))
+    # Pairs of Pokemon that are not in ids (e.g. rows of a newer pokedex) are left out.
+    pairs = {(rnd.choice(ids + [1000]), rnd.randint(1, 900)) for _ in range(rnd.randint(0, 800))}
+    snapshot = export_links(tmp_path, ids, pairs)
+
+    links, indptr, indices = snapshot.links('pokemon_moves')
+    assert links.tolist() == ids
+    assert indptr[0] == 0 and indptr[-1] == len(indices)
+    for n, poke_id in enumerate(ids):
+        expected = sorted(m for p, m in pairs if p == poke_id)
+        assert indices[indptr[n]:indptr[n + 1]].tolist() == expected
+        assert snapshot.linked('pokemon_moves', poke_id).tolist() == expected
+    assert snapshot.linked('pokemon_moves', 1000).tolist() == []
+
+
+def test_empty_link_table(tmp_path):
+    snapshot = export_links(tmp_path, [], [])
+    links, indptr, indices = snapshot.links('pokemon_moves')
+    assert (len(links), indptr.tolist(), len(indices)) == (0, [0], 0)
+    assert snapshot.linked('pokemon_moves', 1).tolist() == []
@@ -0,0 +1,69 @@
+# Tests of the vectorized team scores of team_coverage.py against the score definition computed member by member.
+import itertools
+import random
+import numpy as np
+import pytest
+from team_coverage import TypeCoverage, combinations
+
+
+def coverage_data(seed, types=6, pokemon=40):
+    """Random types, damage factors and Pokemon types (with an unused type and a Pokemon without types).
+    -> (answers of the fake connection, efficacy dictionary, dictionary of Pokemon id and type ids)."""
+    rnd = random.Random(seed)
+    type_rows = [(t, 'type-' + str(t)) for t in range(1, types + 2)]
+    efficacy = {(a, d): rnd.choice([0, 0.5, 1, 1, 2]) for a in range(1, types + 2) for d in range(1, types + 2)}
+    poke_types = {i: rnd.sample(range(1, types + 1), rnd.randint(1, 2)) for i in range(1, pokemon + 1)}
+    poke_types[pokemon + 1] = []
+    answers = [("FROM types", type_rows),
+               ("FROM type_efficacy", [(a, d, f) for (a, d), f in efficacy.items()]),
+               ("FROM pokedex", [(i, ['type-' + str(t) for t in ts] or None) for i, ts in poke_types.items()])]
+    return answers, efficacy, poke_types
+
+
+def brute_force_score(efficacy, poke_types, team):
+    """Score of a team of Pokemon ids from the definition in team_coverage.py. -> (score, offense, resisted,
+    shared)."""
+    used = sorted({t for ts in poke_types.values() for t in ts})
+    combos = {tuple(sorted(ts)) for ts in poke_types.values()}
+
+    def factor(attack, defend_types):
+        return np.prod([efficacy[attack, d] for d in defend_types])
+
+    offense = sum(any(factor(t, combo) > 1 for member in team for t in poke_types[member]) for combo in combos)
+    resisted = sum(any(factor(a, poke_types[member]) < 1 for member in team) for a in used)
+    shared = sum(2 * sum(factor(a, poke_types[member]) > 1 for member in team) >= len(team) for a in used)
+    return offense / len(combos) + (resisted - shared) / len(used), offense, resisted, shared
+
+
+@pytest.mark.parametrize('n, r', [(5, 1), (6, 3), (9, 4), (3, 3)])
+def test_combinations_match_itertools(n, r):
+    rows = np.concatenate(list(combinations(n, r, batch=7)))
+    assert [tuple(row) for row in rows.tolist()] == list(itertools.combinations(range(n), r))
+
+
+@pytest.mark.parametrize('seed', range(4))
+def test_team_score_matches_brute_force(fake_connection, seed):
+    answers, efficacy, poke_types = coverage_data(seed)
+    coverage = TypeCoverage(fake_connection(answers))
+    rnd = random.Random(seed)
+    for size in (1, 2, 3, 6):
+        for _ in range(20):
+            team = rnd.sample(sorted(poke_types), size)
+            score = coverage.team_score(team)
+            expected = brute_force_score(efficacy, poke_types, team)
+            assert (score['offense'], score['resisted'], score['shared_weaknesses']) == expected[1:]
+            assert score['score'] == pytest.approx(expected[0])
+
+
+def test_best_completions_match_brute_force(fake_connection):
+    answers, efficacy, poke_types = coverage_data(11)
+    coverage = TypeCoverage(fake_connection(answers))
+    partial = [1, 2]
+    best = coverage.best_completions(partial, top=5, pool=len(coverage.combos), size=4)
+    # One Pokemon of each type combination, added two at a time to the partial team.
+    representatives = {tuple(sorted(ts)): i for i, ts in sorted(poke_types.items(), reverse=True)}
+    expected = sorted((brute_force_score(efficacy, poke_types, partial + list(pair))[0]
+                       for pair in itertools.combinations(representatives.values(), 2)), reverse=True)[:5]
+    assert [score for score, _, _ in best] == pytest.approx(expected)
+    for score, _, choices in best:
+        assert brute_force_score(efficacy, poke_types, partial + [ids[0] for ids in choices])[0] == pytest.approx(score)
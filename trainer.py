@@ -1,11 +1,66 @@
 # Perform CRUD operations on trainer and trainer_moves tables in Pokemon database.
 # PGSQLConnection class sets up the connection to be open and closed using with statements.
-# TrainerPack class uses PGSQLConnection object to perform CRUD operations on Pokemon database.
+# PGSQLPool class shares a pool of open connections between threads using the same with statements.
+# TrainerPack class uses PGSQLConnection (or PGSQLPool) object to perform CRUD operations on Pokemon database.
+# Select results come back as pandas dataframes, all at once (get_select, unlabeled columns of Python objects) or in
+# chunks streamed from a server-side cursor (iter_select) for large result sets. Chunks are built by select_frame with
+# the column names and numeric dtypes of the query.
+# Hot reads of one Pokemon (get_pokemon) or one team (get_team) are single index lookups in the serving views created by
+# create_db.py and come back as dictionaries. The team view is refreshed with refresh_views after team edits.
 # Running module as main will truncate the trainer/trainer_moves tables and create the default setup for those tables.
+import itertools
+import threading
+import time
 import psycopg2
-from psycopg2.extensions import AsIs
+import psycopg2.errors
+from psycopg2.pool import PoolError
 import pandas as pd
 from collections import defaultdict
+from contextlib import contextmanager
+
+
+# Pandas dtypes of the numeric PGSQL column types (by type oid) in select results, other columns stay objects.
+# bool, int8, int2, int4, float4, float8, numeric
+SELECT_DTYPES = {16: 'boolean', 20: 'Int64', 21: 'Int64', 23: 'Int64', 700: 'float64', 701: 'float64',
+                 1700: 'float64'}
+
+# Number of rows fetched per round trip (and per chunk) by iter_select.
+ITERSIZE = 2000
+
+# Counter used to give each server-side cursor a unique name.
+_cursor_ids = itertools.count(1)
+
+# Materialized serving views of create_db.py (SERVING_SQL): one row per Pokemon and one row per trainer.
+SERVING_VIEWS = ['pokemon_docs', 'trainer_teams']
+
+# Lock the trainers and then the team Pokemon (trainer table ids passed as %(ids)s) written by a move edit, in the order
+# the triggers of create_db.py lock them, so the foreign key check of the write can't deadlock with a team replace.
+TEAM_LOCK_SQL = ("SELECT 1 FROM trainers WHERE id IN (SELECT owner_id FROM trainer WHERE id = ANY(%(ids)s)) "
+                 "ORDER BY id FOR NO KEY UPDATE; SELECT 1 FROM trainer WHERE id = ANY(%(ids)s) ORDER BY id "
+                 "FOR NO KEY UPDATE;")
+
+# Messages of the team limit constraints of the trainers table (the move limit triggers raise their own message).
+LIMIT_MESSAGES = {'trainers_max_pokemon': "Total Pokemon of a trainer would exceed its max_pokemon (MAX_POKEMON)."}
+
+
+def select_frame(rows, description):
+    """Create a dataframe from fetched rows with the column names and numeric dtypes of the cursor description.
+    -> pd dataframe."""
+    # Each column is built once with its final dtype (keyed by position, so repeated column names are kept).
+    columns = list(zip(*rows)) if rows else [()] * len(description)
+    data = pd.DataFrame({n: pd.Series(values, dtype=SELECT_DTYPES.get(col.type_code, None if values else object))
+                         for n, (col, values) in enumerate(zip(description, columns))})
+    data.columns = [col.name for col in description]
+    return data
+
+
+def select_row(row, description):
+    """Create a dictionary from a fetched row with the column names of the cursor description (numeric columns as
+    floats, like select_frame). -> dictionary (None if there is no row)."""
+    if row is None:
+        return None
+    return {col.name: float(value) if col.type_code in (700, 701, 1700) and value is not None else value
+            for col, value in zip(description, row)}
 
 
 class PGSQLConnection:
@@ -18,131 +73,499 @@ class PGSQLConnection:
         self.user = user
         self.password = password
         self.connect_timeout = connect_timeout
+        self.depth = 0
 
     def __enter__(self):
-        """Open psycopg2 connection (conn) and creates cursor (cur) using with."""
+        """Open psycopg2 connection (conn) and creates cursor (cur) using with.
+        Nested with statements reuse the open connection and cursor."""
+        if self.depth:
+            self.depth += 1
+            return self.conn, self.cur
         self.conn = psycopg2.connect(host=self.host, port=self.port, database=self.database,
                                      user=self.user, password=self.password, connect_timeout=self.connect_timeout)
-        self.cur = self.conn.cursor()
+        try:
+            self.cur = self.conn.cursor()
+        except BaseException:
+            self.conn.close()
+            raise
+        # Counted only once the connection is open, so a failed connect leaves the object usable for the next with.
+        self.depth = 1
         print("Connection opened to PGSQL database.")
         return self.conn, self.cur
 
     def __exit__(self, exc_type, exc_value, tb):
-        """Commits and closes PGSQL cursor, connection using with."""
+        """Commits and closes PGSQL cursor, connection using with (when leaving the outermost with statement)."""
+        self.depth -= 1
+        if self.depth:
+            return
         self.conn.commit()
         self.cur.close()
         self.conn.close()
         print("Connection closed to PGSQL database.\n")
 
 
+class PGSQLPool:
+    """Create class to share a thread-safe pool of psycopg2 connections with the same with statement interface as
+    PGSQLConnection. Each with statement borrows one connection for one transaction (commit on success, rollback on
+    error), and nested with statements in the same thread reuse the borrowed connection and its transaction."""
+    def __init__(self, host, port, database, user, password, connect_timeout=3, minconn=2, maxconn=10,
+                 checkout_timeout=30, ping_after=60, max_idle=None):
+        """Open minconn connections up front, and more on demand up to maxconn borrowed at once (others wait up to
+        checkout_timeout seconds). Returned connections are kept open for reuse, up to max_idle of them (maxconn by
+        default, so a busy pool stops opening connections once it has grown to its peak concurrency). Size maxconn to
+        the number of threads that query at once, within the max_connections of the server. Connections idle for more
+        than ping_after seconds are checked before use."""
+        max_idle = maxconn if max_idle is None else max_idle
+        if not 0 <= minconn <= max_idle <= maxconn:
+            raise ValueError("PGSQLPool needs 0 <= minconn <= max_idle <= maxconn.")
+        self.params = dict(host=host, port=port, database=database, user=user, password=password,
+                           connect_timeout=connect_timeout)
+        self.maxconn = maxconn
+        self.max_idle = max_idle
+        self.checkout_timeout = checkout_timeout
+        self.ping_after = ping_after
+        self.slots = threading.BoundedSemaphore(maxconn)
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.last_used = {}
+        self.closed = False
+        self.idle = []
+        try:
+            for _ in range(minconn):
+                self.idle.append(self.connect())
+        except BaseException:
+            self.close()
+            raise
+        print("Connection pool opened to PGSQL database.")
+
+    def connect(self):
+        """Open a new connection to the PGSQL database. -> connection."""
+        return psycopg2.connect(**self.params)
+
+    def discard(self, conn):
+        """Close a connection that is not kept in the pool."""
+        self.last_used.pop(id(conn), None)
+        conn.close()
+
+    def is_healthy(self, conn):
+        """Check that a pooled connection is open (ping it with SELECT 1 if it has been idle). -> bool."""
+        if conn.closed:
+            return False
+        if time.monotonic() - self.last_used.get(id(conn), 0) < self.ping_after:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1;")
+            conn.rollback()
+        except psycopg2.Error:
+            return False
+        return True
+
+    def checkout(self):
+        """Borrow a healthy idle connection (or open a new one), waiting for one to be returned if maxconn are in use.
+        -> connection."""
+        if not self.slots.acquire(timeout=self.checkout_timeout):
+            raise PoolError("Timed out waiting for a connection from the pool.")
+        try:
+            while True:
+                with self.lock:
+                    if self.closed:
+                        raise PoolError("The connection pool is closed.")
+                    conn = self.idle.pop() if self.idle else None
+                if conn is None:
+                    return self.connect()
+                if self.is_healthy(conn):
+                    return conn
+                self.discard(conn)
+        except BaseException:
+            self.slots.release()
+            raise
+
+    def checkin(self, conn):
+        """Return a borrowed connection to the pool. It is kept open for reuse if fewer than max_idle connections are
+        idle, otherwise (or if it is broken or the pool is closed) it is closed."""
+        with self.lock:
+            keep = not conn.closed and not self.closed and len(self.idle) < self.max_idle
+            if keep:
+                self.last_used[id(conn)] = time.monotonic()
+                self.idle.append(conn)
+        if not keep:
+            self.discard(conn)
+        self.slots.release()
+
+    def __enter__(self):
+        """Borrow a connection (conn) and create cursor (cur) using with. -> (conn, cur)."""
+        local = self.local
+        if getattr(local, 'depth', 0):
+            local.depth += 1
+            return local.conn, local.cur
+        local.conn = self.checkout()
+        local.cur = local.conn.cursor()
+        local.depth = 1
+        local.failed = False
+        return local.conn, local.cur
+
+    def __exit__(self, exc_type, exc_value, tb):
+        """Commit (or roll back on error) and return the connection when leaving the outermost with statement."""
+        local = self.local
+        local.failed = local.failed or exc_type is not None
+        local.depth -= 1
+        if local.depth:
+            return
+        conn, cur = local.conn, local.cur
+        local.conn = local.cur = None
+        try:
+            if local.failed:
+                conn.rollback()
+            else:
+                conn.commit()
+        finally:
+            if not conn.closed:
+                cur.close()
+            self.checkin(conn)
+
+    def close(self):
+        """Close every idle connection in the pool (borrowed connections are closed when they are returned)."""
+        with self.lock:
+            self.closed = True
+            idle, self.idle = self.idle, []
+        for conn in idle:
+            self.discard(conn)
+        print("Connection pool closed to PGSQL database.\n")
+
+
 class TrainerPack:
-    """Handles postgres connection (from PGSQLConnection) using with statements
-    to perform CRUD operations on the Pokemon database from create_db.py."""
+    """Handles postgres connection (from PGSQLConnection or PGSQLPool) using with statements
+    to perform CRUD operations on the Pokemon database from create_db.py. Each trainer (trainers table) owns one team
+    of Pokemon in the trainer table. The MAX_POKEMON and MAX_MOVES limits of each trainer are stored and enforced by
+    the database (see TRAINER_SQL in create_db.py), so any number of TrainerPack objects and processes can write at
+    once without recounting the tables. A write that would exceed a limit is rolled back as a whole."""
     MAX_POKEMON = 6
     MAX_MOVES = 4
+    DEFAULT_TRAINER = 'default'
 
-    def __init__(self, pgsql_connection):
-        """Pass PGSQLConnection object. Initialize count data attributes."""
+    def __init__(self, pgsql_connection, trainer=DEFAULT_TRAINER):
+        """Pass PGSQLConnection (or PGSQLPool) object and the name (or id) of the trainer whose team is used by the
+        single team methods (a trainer name that does not exist yet is created with the current limits). Initialize
+        count data attributes (trainer_count and moves_count of the team, kept up to date by the single team methods
+        of this object, use update_counts to read them again after other writes)."""
         self.pgsql_connection = pgsql_connection
-        with self.pgsql_connection as conn_cur:
-            self.trainer_count = self.get_trainer_count(conn_cur)
-            self.moves_count = self.get_moves_count(conn_cur)
-        if self.trainer_count > TrainerPack.MAX_POKEMON:
-            print("Warning: Change has caused current number of trainer pokemon to exceed MAX_POKEMON =", TrainerPack.MAX_POKEMON)
-        if max(self.moves_count.values()) > TrainerPack.MAX_MOVES:
-            print("Warning: Change has caused current number of trainer moves to exceed MAX_MOVES =", TrainerPack.MAX_MOVES)
+        self.trainer_ids = {}
+        self.trainer_id = self.create_trainers([trainer])[trainer] if isinstance(trainer, str) else trainer
+        self.update_counts()
 
     @classmethod
     def change_trainer_max(cls, new_max):
-        """Change the default max number of Pokemon for the trainer table."""
+        """Change the default max number of Pokemon of new trainers (use set_limits for an existing trainer)."""
         cls.MAX_POKEMON = new_max
 
     @classmethod
     def change_moves_max(cls, new_max):
-        """Change the default max number of Pokemon moves for the trainer_moves table."""
+        """Change the default max number of moves per Pokemon of new trainers (use set_limits for an existing
+        trainer)."""
         cls.MAX_MOVES = new_max
 
+    @contextmanager
+    def transaction(self):
+        """Group several TrainerPack calls in one transaction on one connection using with. With a PGSQLPool the
+        whole group is rolled back on error. -> (conn, cur)."""
+        with self.pgsql_connection as conn_cur:
+            yield conn_cur
+
+    def limited(self, sql, params=None):
+        """Run a write statement whose team limits are checked by the database. The statement runs in a savepoint, so
+        a rejected statement leaves the rest of the transaction intact.
+        -> list of returned rows (empty if none), or None if a limit would be exceeded (nothing is written)."""
+        with self.pgsql_connection as conn_cur:
+            conn_cur[1].execute("SAVEPOINT trainer_limits;")
+            try:
+                conn_cur[1].execute(sql, params)
+            except psycopg2.errors.CheckViolation as error:
+                conn_cur[1].execute("ROLLBACK TO SAVEPOINT trainer_limits;")
+                print("No values were written.",
+                      LIMIT_MESSAGES.get(error.diag.constraint_name, error.diag.message_primary))
+                return None
+            rows = conn_cur[1].fetchall() if conn_cur[1].description else []
+            conn_cur[1].execute("RELEASE SAVEPOINT trainer_limits;")
+        return rows
+
+    def create_trainers(self, names, max_pokemon=None, max_moves=None):
+        """Create trainers (names that already exist are kept as they are) with the MAX_POKEMON and MAX_MOVES limits
+        unless others are passed. -> dictionary of name and trainer id."""
+        names = list(dict.fromkeys(names))
+        max_pokemon = self.MAX_POKEMON if max_pokemon is None else max_pokemon
+        max_moves = self.MAX_MOVES if max_moves is None else max_moves
+        sql = (r"WITH new AS (INSERT INTO trainers (name, max_pokemon, max_moves) SELECT unnest(%(names)s::text[]), "
+               r"%(max_pokemon)s, %(max_moves)s ON CONFLICT (name) DO NOTHING RETURNING name, id) "
+               r"SELECT name, id FROM new UNION ALL SELECT name, id FROM trainers WHERE name = ANY(%(names)s);")
+        params = {'names': names, 'max_pokemon': max_pokemon, 'max_moves': max_moves}
+        ids = {}
+        with self.pgsql_connection as conn_cur:
+            # A trainer created by another transaction after the snapshot of the statement shows up on the next try.
+            while len(ids) < len(names):
+                conn_cur[1].execute(sql, params)
+                ids.update(conn_cur[1].fetchall())
+        self.trainer_ids.update(ids)
+        return ids
+
+    def get_trainer_ids(self, trainers):
+        """Get the ids of trainers passed by name or id (names are looked up once). -> list of ints."""
+        missing = [name for name in trainers if isinstance(name, str) and name not in self.trainer_ids]
+        if missing:
+            with self.pgsql_connection as conn_cur:
+                conn_cur[1].execute(r"SELECT name, id FROM trainers WHERE name = ANY(%s);", (missing,))
+                self.trainer_ids.update(conn_cur[1].fetchall())
+        for name in missing:
+            if name not in self.trainer_ids:
+                raise ValueError("Trainer " + name + " does not exist (use create_trainers).")
+        return [self.trainer_ids[name] if isinstance(name, str) else name for name in trainers]
+
+    def set_limits(self, max_pokemon=None, max_moves=None, trainer=None):
+        """Change the max number of Pokemon and of moves per Pokemon of a trainer (this trainer by default). A limit
+        below the current team is rejected. -> True if the limits were changed."""
+        trainer_id = self.trainer_id if trainer is None else self.get_trainer_ids([trainer])[0]
+        sql = (r"UPDATE trainers SET max_pokemon = coalesce(%s, max_pokemon), max_moves = coalesce(%s, max_moves) "
+               r"WHERE id = %s;")
+        return self.limited(sql, (max_pokemon, max_moves, trainer_id)) is not None
+
     def get_trainer_count(self, conn_cur=None):
-        """Get number of Pokemon in trainer table. -> count as int."""
-        sql = r"SELECT count(*) FROM trainer;"
+        """Get number of Pokemon in the team of this trainer. -> count as int."""
+        sql = r"SELECT pokemon_count FROM trainers WHERE id = %s;"
         if conn_cur is None:
             with self.pgsql_connection as conn_cur:
-                conn_cur[1].execute(sql)
+                conn_cur[1].execute(sql, (self.trainer_id,))
                 count = conn_cur[1].fetchall()[0][0]
         else:
-            conn_cur[1].execute(sql)
+            conn_cur[1].execute(sql, (self.trainer_id,))
             count = conn_cur[1].fetchall()[0][0]
         return count
 
+    def update_counts(self):
+        """Read the trainer_count and moves_count attributes of the team of this trainer from the database again."""
+        with self.pgsql_connection as conn_cur:
+            self.trainer_count = self.get_trainer_count(conn_cur)
+            self.moves_count = self.get_moves_count(conn_cur)
+
     def get_moves_count(self, conn_cur=None):
-        """Get trainer move count for each Pokemon. -> count as default dictionary."""
+        """Get move count for each Pokemon in the team of this trainer. -> count as default dictionary."""
         count_dd = defaultdict(int)
         count_dd[0] = 0
-        sql = r"SELECT trainer_id, count(move_id) FROM trainer_moves GROUP BY trainer_id;"
+        sql = r"SELECT id, move_count FROM trainer WHERE owner_id = %s;"
         if conn_cur is None:
             with self.pgsql_connection as conn_cur:
-                conn_cur[1].execute(sql)
+                conn_cur[1].execute(sql, (self.trainer_id,))
                 count_list = conn_cur[1].fetchall()
         else:
-            conn_cur[1].execute(sql)
+            conn_cur[1].execute(sql, (self.trainer_id,))
             count_list = conn_cur[1].fetchall()
         for id_count in count_list:
             count_dd[id_count[0]] = id_count[1]
         return count_dd
 
+    def team_values(self, conn_cur, teams):
+        """VALUES rows (owner_id, poke_id, ability_id) of a dictionary of trainer and (poke_id, ability_id) tuples.
+        -> (SQL text, trainer ids)."""
+        trainer_ids = self.get_trainer_ids(list(teams))
+        values = ','.join([conn_cur[1].mogrify("(%s,%s,%s)", (trainer_id,) + tuple(tup)).decode('utf-8')
+                           for trainer_id, team in zip(trainer_ids, teams.values()) for tup in team])
+        return values, trainer_ids
+
+    def team_ids(self, teams, trainer_ids, rows):
+        """Group the (id, owner_id) rows returned by a team insert by trainer. -> dictionary of trainer and list of
+        trainer table ids."""
+        ids = defaultdict(list)
+        for row_id, owner_id in rows:
+            ids[owner_id].append(row_id)
+        return {trainer: ids[trainer_id] for trainer, trainer_id in zip(teams, trainer_ids)}
+
+    def insert_teams(self, teams):
+        """Add Pokemon to the teams of several trainers in one statement. Pass a dictionary of trainer (name or id) and
+        list of poke_id, ability_id integer tuples (use None for a NULL ability_id). Nothing is inserted if any team
+        would exceed its limit. -> dictionary of trainer and list of new trainer table ids (None if rejected)."""
+        with self.pgsql_connection as conn_cur:
+            values, trainer_ids = self.team_values(conn_cur, teams)
+            if not values:
+                return {trainer: [] for trainer in teams}
+            rows = self.limited("INSERT INTO trainer (owner_id, poke_id, ability_id) VALUES " + values +
+                                " RETURNING id, owner_id;")
+        return None if rows is None else self.team_ids(teams, trainer_ids, rows)
+
+    def replace_teams(self, teams):
+        """Replace the whole teams of several trainers (and their moves) in one transaction. Pass teams as in
+        insert_teams (an empty list clears a team). Nothing is changed if any team would exceed its limit.
+        -> dictionary of trainer and list of new trainer table ids (None if rejected)."""
+        with self.pgsql_connection as conn_cur:
+            values, trainer_ids = self.team_values(conn_cur, teams)
+            # The teams are locked first (in id order) so that the DELETE of a concurrent replace of the same teams
+            # runs after this one commits (with a new snapshot that sees its rows).
+            sql = ("SELECT 1 FROM trainers WHERE id = ANY(%(ids)s) ORDER BY id FOR NO KEY UPDATE; "
+                   "DELETE FROM trainer WHERE owner_id = ANY(%(ids)s);")
+            if values:
+                sql += (" INSERT INTO trainer (owner_id, poke_id, ability_id) VALUES " + values +
+                        " RETURNING id, owner_id;")
+            rows = self.limited(sql, {'ids': trainer_ids})
+        return None if rows is None else self.team_ids(teams, trainer_ids, rows)
+
+    def update_trainer(self, trainer_poke_ability):
+        """Change the Pokemon and ability of team members (their moves are kept). Pass list of trainer_id, poke_id,
+        ability_id integer tuples (use None for a NULL ability_id). -> number of updated rows."""
+        with self.pgsql_connection as conn_cur:
+            values = ','.join([conn_cur[1].mogrify("(%s::int,%s::int,%s::int)", tup).decode('utf-8')
+                               for tup in trainer_poke_ability])
+            if not values:
+                return 0
+            conn_cur[1].execute("UPDATE trainer AS t SET poke_id = v.poke_id, ability_id = v.ability_id "
+                                "FROM (VALUES " + values + ") AS v (id, poke_id, ability_id) WHERE t.id = v.id;")
+            count = conn_cur[1].rowcount
+        return count
+
     def insert_trainer(self, poke_ability):
-        """Insert values into trainer table. Pass list of poke_id, ability_id integer tuples. Use None to pass a NULL
-        value inside a tuple (for ability_id column)."""
-        if self.trainer_count + len(poke_ability) > self.MAX_POKEMON:
-            print("No values were inserted. Total Pokemon in trainer table would exceed MAX_POKEMON =",
-                  str(self.MAX_POKEMON) + ".")
-        else:
-            with self.pgsql_connection as conn_cur:
-                values = ','.join([conn_cur[1].mogrify("(%s,%s)", tup).decode('utf-8') for tup in poke_ability])
-                conn_cur[1].execute("INSERT INTO %s VALUES %s;", (AsIs('trainer (poke_id, ability_id)'), AsIs(values)))
-            self.trainer_count += len(poke_ability)
+        """Insert values into the team of this trainer. Pass list of poke_id, ability_id integer tuples. Use None to
+        pass a NULL value inside a tuple (for ability_id column). Nothing is inserted if the team would exceed its max
+        number of Pokemon (use insert_teams to get the new trainer table ids)."""
+        ids = self.insert_teams({self.trainer_id: poke_ability})
+        if ids is not None:
+            self.trainer_count += len(ids[self.trainer_id])
+            for row_id in ids[self.trainer_id]:
+                self.moves_count[row_id] = 0
 
     def insert_moves(self, trainer_move):
-        """Insert values into trainer_moves table. Pass list of trainer_id, move_id integer tuples."""
-        temp = self.moves_count.copy()
-        for tup in trainer_move:
-            temp[tup[0]] += 1
-        if max(temp.values()) > self.MAX_MOVES:
-            print("No values were inserted. Total moves (for at least one Pokemon) in trainer_moves table would exceed "
-                  "MAX_MOVES =", str(self.MAX_MOVES) + ".")
-        else:
-            with self.pgsql_connection as conn_cur:
-                values = ','.join([conn_cur[1].mogrify("(%s,%s)", tup).decode('utf-8') for tup in trainer_move])
-                conn_cur[1].execute("INSERT INTO %s VALUES %s;", (AsIs('trainer_moves'), AsIs(values)))
-            self.moves_count = temp
+        """Insert values into trainer_moves table (for the Pokemon of any team). Pass list of trainer_id, move_id
+        integer tuples. Nothing is inserted if a Pokemon would exceed the max moves of its trainer (use replace_moves
+        to know whether the moves were written)."""
+        if not trainer_move:
+            return
+        with self.pgsql_connection as conn_cur:
+            values = ','.join([conn_cur[1].mogrify("(%s,%s)", tup).decode('utf-8') for tup in trainer_move])
+            rows = self.limited(TEAM_LOCK_SQL + " INSERT INTO trainer_moves VALUES " + values + ";",
+                                {'ids': list({trainer_id for trainer_id, _ in trainer_move})})
+        if rows is not None:
+            for trainer_id, _ in trainer_move:
+                if trainer_id in self.moves_count:
+                    self.moves_count[trainer_id] += 1
+
+    def replace_moves(self, moves):
+        """Replace the moves of several team Pokemon in one transaction. Pass a dictionary of trainer_id and list of
+        move ids. Nothing is changed if a Pokemon would exceed the max moves of its trainer.
+        -> True if the moves were replaced."""
+        trainer_move = [(trainer_id, move_id) for trainer_id, move_ids in moves.items() for move_id in move_ids]
+        sql = TEAM_LOCK_SQL + " DELETE FROM trainer_moves WHERE trainer_id = ANY(%(ids)s);"
+        with self.pgsql_connection as conn_cur:
+            values = ','.join([conn_cur[1].mogrify("(%s,%s)", tup).decode('utf-8') for tup in trainer_move])
+            if values:
+                sql += " INSERT INTO trainer_moves VALUES " + values + ";"
+            rows = self.limited(sql, {'ids': list(moves)})
+        return rows is not None
+
+    def clear_counts(self):
+        """Reset the count data attributes to an empty team."""
+        self.trainer_count = 0
+        self.moves_count.clear()
+        self.moves_count[0] = 0
+
+    def clear_team(self):
+        """Delete every Pokemon (and its moves) of the team of this trainer."""
+        with self.pgsql_connection as conn_cur:
+            conn_cur[1].execute(r"DELETE FROM trainer WHERE owner_id = %s;", (self.trainer_id,))
+        self.clear_counts()
 
     def trunc_trainer(self):
-        """Truncate trainer table and restarts serial count at 1 for id column.
+        """Truncate trainer table (the teams of every trainer) and restarts serial count at 1 for id column.
         Cascade will propagate truncate to all tables with a foreign key reference
         to the trainer table (so the trainer_moves table will also be truncated)."""
         sql = r"TRUNCATE TABLE trainer RESTART IDENTITY CASCADE;"
         with self.pgsql_connection as conn_cur:
             conn_cur[1].execute(sql)
-        self.trainer_count = 0
-        self.moves_count.clear()
-        self.moves_count[0] = 0
+        self.clear_counts()
 
     def trunc_moves(self):
         """Truncate trainer_moves table."""
         sql = r"TRUNCATE TABLE trainer_moves;"
         with self.pgsql_connection as conn_cur:
             conn_cur[1].execute(sql)
-        self.moves_count.clear()
-        self.moves_count[0] = 0
+        for trainer_id in self.moves_count:
+            self.moves_count[trainer_id] = 0
 
-    def get_select(self, sql):
-        """Pass SQL select statement and get results. Pass SQL text as raw string (r"<sql>"). -> pd dataframe."""
+    def get_pokemon(self, pokemon):
+        """Get the pokedex row of a Pokemon (by id or name) with its abilities (id, name, info) and moves (id, name,
+        type, pp, damage, accuracy) as lists of dictionaries, from the pokemon_docs view. Pass a list to get several
+        Pokemon in one statement. -> dictionary (None if there is no such Pokemon), or list of them in the order
+        passed."""
+        keys = pokemon if isinstance(pokemon, (list, tuple)) else [pokemon]
+        ids = [key for key in keys if not isinstance(key, str)]
+        names = [key for key in keys if isinstance(key, str)]
         with self.pgsql_connection as conn_cur:
-            conn_cur[1].execute(sql)
+            if not isinstance(pokemon, (list, tuple)):
+                conn_cur[1].execute("SELECT * FROM pokemon_docs WHERE " + ("name" if names else "id") + " = %s;",
+                                    (pokemon,))
+                return select_row(conn_cur[1].fetchone(), conn_cur[1].description)
+            conn_cur[1].execute(r"SELECT * FROM pokemon_docs WHERE id = ANY(%s) OR name = ANY(%s);", (ids, names))
+            rows = [select_row(row, conn_cur[1].description) for row in conn_cur[1].fetchall()]
+        found = {row['id']: row for row in rows}
+        found.update({row['name']: row for row in rows})
+        return [found.get(key) for key in keys]
+
+    def get_team(self, trainer=None):
+        """Get a trainer (this trainer by default, or by name or id) with its limits and its team from the trainer_teams
+        view: each team Pokemon (id in the trainer table, poke_id, name, type) with its ability (id, name) and moves
+        (id, name, type). The view shows the teams as of its last refresh (see refresh_views).
+        -> dictionary (None if the trainer is not in the view)."""
+        trainer_id = self.trainer_id if trainer is None else self.get_trainer_ids([trainer])[0]
+        with self.pgsql_connection as conn_cur:
+            conn_cur[1].execute(r"SELECT * FROM trainer_teams WHERE id = %s;", (trainer_id,))
+            row = select_row(conn_cur[1].fetchone(), conn_cur[1].description)
+        return row
+
+    def refresh_views(self, views=None):
+        """Refresh serving views (every one in SERVING_VIEWS by default), e.g. ['trainer_teams'] after team edits. A
+        filled view is refreshed concurrently (readers keep seeing the old rows until the refresh commits), a view that
+        was never filled gets a plain refresh."""
+        views = SERVING_VIEWS if views is None else views
+        with self.pgsql_connection as conn_cur:
+            conn_cur[1].execute(r"SELECT matviewname, ispopulated FROM pg_matviews "
+                                r"WHERE schemaname = current_schema() AND matviewname = ANY(%s);", (list(views),))
+            populated = dict(conn_cur[1].fetchall())
+            for view in views:
+                if view not in populated:
+                    raise ValueError("View " + view + " does not exist (run create_db.py).")
+                conn_cur[1].execute("REFRESH MATERIALIZED VIEW " + ("CONCURRENTLY " if populated[view] else "") +
+                                    view + ";")
+
+    def get_select(self, sql, params=None):
+        """Pass SQL select statement and get results. Pass SQL text as raw string (r"<sql>"). Pass query parameters
+        (%s or %(name)s placeholders, write a literal % as %%) as a tuple or dictionary. The columns are numbered and
+        hold Python objects (select_frame labels them and sets numeric dtypes). -> pd dataframe."""
+        with self.pgsql_connection as conn_cur:
+            conn_cur[1].execute(sql, params)
             data = conn_cur[1].fetchall()
         data = pd.DataFrame(data)
         return data
 
+    def iter_select(self, sql, params=None, itersize=ITERSIZE, arrow=False):
+        """Stream the results of a SQL select statement in chunks of up to itersize rows from a server-side (named)
+        cursor, so only one chunk is held in memory at a time. Pass SQL text and parameters as in get_select. The
+        connection stays open until the generator is exhausted or closed. The first chunk is always yielded (empty if
+        there are no rows). Use arrow=True to get pyarrow record batches instead of dataframes.
+        -> generator of pd dataframes (or pa record batches)."""
+        if arrow:
+            import pyarrow as pa
+        with self.pgsql_connection as conn_cur:
+            cur = conn_cur[0].cursor(name='trainer_select_' + str(next(_cursor_ids)))
+            cur.itersize = itersize
+            try:
+                cur.execute(sql, params)
+                first = True
+                while True:
+                    rows = cur.fetchmany(itersize)
+                    if not rows and not first:
+                        break
+                    first = False
+                    data = select_frame(rows, cur.description)
+                    yield pa.RecordBatch.from_pandas(data, preserve_index=False) if arrow else data
+            finally:
+                if not conn_cur[0].closed:
+                    cur.close()
+
 
 # Code to run when module runs as main. Does not run when module is imported.
 # Used to create a quick random setup of trainer and trainer_moves.
@@ -155,3 +578,4 @@ if __name__ == "__main__":
     tp.trunc_trainer()
     tp.insert_trainer([(65, 39)])
     tp.insert_moves([(1, 347)])
+    tp.refresh_views(['trainer_teams'])
@@ -0,0 +1,116 @@
+# url_cache.py creates an on-disk cache for the json pages requested by get_url.
+# Bodies are content-addressed (stored once per sha256 hash under <cache_dir>/objects) and an index file
+# maps each url to its body hash, the ETag/Last-Modified validators sent by the API, and when it was last validated.
+# Entries younger than the ttl are served without a request, older entries are revalidated with a conditional GET,
+# and the least recently used entries are evicted once the cache grows past max_bytes.
+# In offline (replay) mode only cached bodies are served and the network is never touched.
+import hashlib
+import json
+import os
+import time
+
+
+# Default cache location, time to live (seconds) and size bound (bytes).
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.pokeapi_cache')
+CACHE_TTL = 7 * 24 * 60 * 60
+CACHE_MAX_BYTES = 2 * 1024 ** 3
+
+
+class URLCache:
+    """Content-addressed response cache keyed by url with ttl, conditional revalidation and LRU eviction."""
+    def __init__(self, cache_dir=CACHE_DIR, ttl=CACHE_TTL, max_bytes=CACHE_MAX_BYTES, offline=False):
+        """Initialize cache parameters and load the url index from cache_dir (created if missing)."""
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.offline = offline
+        self.index_path = os.path.join(cache_dir, 'index.json')
+        os.makedirs(os.path.join(cache_dir, 'objects'), exist_ok=True)
+        try:
+            with open(self.index_path) as f:
+                self.index = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.index = {}
+
+    def _object_path(self, digest):
+        """Path of the body file for a sha256 hex digest (sharded by the first two characters)."""
+        return os.path.join(self.cache_dir, 'objects', digest[:2], digest)
+
+    def lookup(self, url):
+        """Get the index entry for url whose body is still on disk. -> dict or None."""
+        entry = self.index.get(url)
+        if entry is None or not os.path.exists(self._object_path(entry['hash'])):
+            return None
+        return entry
+
+    def is_fresh(self, entry):
+        """Check if an entry was validated within the ttl (every entry is fresh in offline mode). -> bool."""
+        return self.offline or time.time() - entry['validated'] < self.ttl
+
+    def read(self, url, entry=None):
+        """Read the cached body for url and mark it as recently used. -> text."""
+        entry = self.lookup(url) if entry is None else entry
+        entry['used'] = time.time()
+        with open(self._object_path(entry['hash']), encoding='utf-8') as f:
+            return f.read()
+
+    @staticmethod
+    def conditional_headers(entry):
+        """Get the If-None-Match/If-Modified-Since headers to revalidate an entry. -> dict."""
+        headers = {}
+        if entry is not None:
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def store(self, url, text, headers):
+        """Store a 200 response body for url along with its ETag/Last-Modified response headers."""
+        data = text.encode('utf-8')
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._object_path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = path + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        now = time.time()
+        self.index[url] = {'hash': digest, 'size': len(data), 'etag': headers.get('ETag'),
+                           'last_modified': headers.get('Last-Modified'), 'validated': now, 'used': now}
+
+    def revalidated(self, url, headers):
+        """Mark the entry for url as valid again after a 304 Not Modified response. -> cached text."""
+        entry = self.index[url]
+        entry['validated'] = time.time()
+        entry['etag'] = headers.get('ETag', entry.get('etag'))
+        entry['last_modified'] = headers.get('Last-Modified', entry.get('last_modified'))
+        return self.read(url, entry)
+
+    def evict(self):
+        """Drop least recently used urls (and unreferenced bodies) until the cache fits in max_bytes."""
+        sizes = {entry['hash']: entry['size'] for entry in self.index.values()}
+        total = sum(sizes.values())
+        refs = {}
+        for entry in self.index.values():
+            refs[entry['hash']] = refs.get(entry['hash'], 0) + 1
+        for url in sorted(self.index, key=lambda u: self.index[u]['used']):
+            if total <= self.max_bytes:
+                break
+            digest = self.index.pop(url)['hash']
+            refs[digest] -= 1
+            if refs[digest] == 0:
+                total -= sizes[digest]
+                try:
+                    os.remove(self._object_path(digest))
+                except FileNotFoundError:
+                    pass
+
+    def save(self):
+        """Evict if needed and write the url index to disk atomically."""
+        self.evict()
+        tmp_path = self.index_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.index, f)
+        os.replace(tmp_path, self.index_path)